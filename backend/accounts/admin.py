@@ -1,9 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+
+from backend.pagination import EstimatedCountMixin
 from .models import CustomUser
 
 
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(EstimatedCountMixin, UserAdmin):
     model = CustomUser
     list_display = ('email', 'is_staff', 'is_active')
     list_filter = ('is_staff', 'is_active')
@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from backend.checks import is_process_local
+from backend.metrics import CACHE_REQUESTS
+from .models import CustomUser
+
+
+# User fields kept in the cache; anything else is loaded lazily on first access.
+# Ordered like the model's concrete fields, as Model.from_db() expects.
+CACHED_USER_FIELDS = [
+    field.attname for field in CustomUser._meta.concrete_fields
+    if field.attname in {
+        'id', 'email', 'name', 'phone', 'tier', 'subscription_start', 'subscription_end',
+        'is_active', 'is_staff', 'is_superuser',
+    }
+]
+
+
+def token_cache():
+    """
+    The cache for token lookups, or None when it is per-process: invalidation
+    could not reach the other workers, which would keep accepting deleted
+    tokens and deactivated users until their entries expired.
+    """
+    if is_process_local(settings.TOKEN_AUTH_CACHE):
+        return None
+    return caches[settings.TOKEN_AUTH_CACHE]
+
+
+def token_cache_key(key):
+    return f'auth:token:{key}'
+
+
+def invalidate_token(key):
+    cache = token_cache()
+    if cache is not None:
+        cache.delete(token_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that caches the token -> user lookup.
+
+    A hit costs no queries: the user is rebuilt from the cached essential
+    fields as a deferred instance, so any other field is fetched on access
+    and save() only writes the fields that were loaded or changed. Entries
+    are dropped when the token is deleted or the user is saved (see
+    accounts.signals) and expire after TOKEN_AUTH_CACHE_TTL seconds. Nothing
+    is cached unless TOKEN_AUTH_CACHE is shared by all workers.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = token_cache()
+        if cache is None:
+            return self.credentials(key, None, self.load_token(key))
+
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+
+        CACHE_REQUESTS.inc(cache='token_auth', result='miss' if cached is None else 'hit')
+        if cached is None:
+            token = self.load_token(key)
+            cache.set(cache_key, self.cache_entry(token), settings.TOKEN_AUTH_CACHE_TTL)
+            return self.credentials(key, None, token)
+        return self.credentials(key, cached, None)
+
+    def load_token(self, key):
+        try:
+            return Token.objects.select_related('user').get(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views, reaching the cache and database through their async APIs"""
+        key = TokenKeyParser().authenticate(request)
+        if key is None:
+            return None
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        cache = token_cache()
+        if cache is None:
+            return self.credentials(key, None, await self.aload_token(key))
+
+        cache_key = token_cache_key(key)
+        cached = await cache.aget(cache_key)
+
+        CACHE_REQUESTS.inc(cache='token_auth', result='miss' if cached is None else 'hit')
+        if cached is None:
+            token = await self.aload_token(key)
+            await cache.aset(cache_key, self.cache_entry(token), settings.TOKEN_AUTH_CACHE_TTL)
+            return self.credentials(key, None, token)
+        return self.credentials(key, cached, None)
+
+    async def aload_token(self, key):
+        try:
+            return await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+    def cache_entry(self, token):
+        """The database alias the token was read from and the cached user fields"""
+        return (token._state.db, [getattr(token.user, field) for field in CACHED_USER_FIELDS])
+
+    def credentials(self, key, cached, token):
+        """(user, token) from a loaded token, or from a cache entry when token is None"""
+        if token is None:
+            db, values = cached
+            user = CustomUser.from_db(db, CACHED_USER_FIELDS, values)
+            token = Token(key=key, user=user)
+        else:
+            user = token.user
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (user, token)
+
+
+class TokenKeyParser(TokenAuthentication):
+    """Reads the token key from the Authorization header the way TokenAuthentication does"""
+
+    def authenticate_credentials(self, key):
+        return key
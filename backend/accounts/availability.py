@@ -0,0 +1,245 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from backend.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Catch-ups re-read users saved this long before the previous one started,
+# for saves committed late and for clock differences between workers
+CATCH_UP_OVERLAP = timedelta(seconds=30)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing"""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.bit_count = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.items = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bit_count for i in range(self.hash_count))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    @property
+    def estimated_error_rate(self):
+        return (1 - math.exp(-self.hash_count * self.items / self.bit_count)) ** self.hash_count
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def normalize_phone(phone):
+    return ''.join(ch for ch in phone if ch.isdigit() or ch == '+')
+
+
+class AvailabilityIndex:
+    """
+    Per-process Bloom filters of registered emails and phone numbers.
+
+    A miss means the value is definitely not registered, so the availability
+    endpoints can answer without touching the database; a hit falls through
+    to the indexed query. Users saved in this process are added at once.
+    Users registered or changed by other processes are caught up by their
+    updated_at at most every AVAILABILITY_FILTER_REFRESH seconds. Filters
+    are rebuilt from scratch every AVAILABILITY_FILTER_REBUILD seconds, which
+    clears values that users have since given up.
+
+    With AVAILABILITY_FILTER_THREAD the first lookup starts a thread that
+    builds and refreshes the filters, and lookups go to the database until
+    the first build is done. Otherwise the lookup that finds the filters due
+    refreshes them; a lookup waiting on the lock meanwhile finds them fresh.
+
+    Saves that skip Model.save(), such as QuerySet.update() without
+    updated_at, are only picked up by the next rebuild.
+    """
+
+    def __init__(self):
+        # lock guards the filters; refresh_lock lets one caller at a time
+        # query the users, without holding up add() meanwhile
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.emails = None
+        self.phones = None
+        self.modified_since = None
+        self.built_at = None
+        self.refreshed_at = None
+        self.refresher = None
+        self.stopping = threading.Event()
+        self.counters = {'lookups': 0, 'filter_negatives': 0, 'db_checks': 0, 'false_positives': 0}
+
+    def invalidate(self):
+        """Force a full rebuild on the next refresh"""
+        self.built_at = None
+
+    def _ensure_fresh(self):
+        """Whether the filters can answer lookups, refreshing them first if that is up to this request"""
+        if settings.AVAILABILITY_FILTER_THREAD:
+            if self.refresher is None:
+                self.start_refresher()
+        elif self._is_due(time.monotonic()):
+            self.refresh()
+        return self.built_at is not None
+
+    def _is_due(self, now):
+        return (
+            self.built_at is None
+            or now - self.built_at > settings.AVAILABILITY_FILTER_REBUILD
+            or now - self.refreshed_at > settings.AVAILABILITY_FILTER_REFRESH
+        )
+
+    def refresh(self):
+        """Rebuild or catch up if either is due, deciding under the lock so that waiting callers don't repeat it"""
+        with self.refresh_lock:
+            now = time.monotonic()
+            if self.built_at is None or now - self.built_at > settings.AVAILABILITY_FILTER_REBUILD:
+                self._rebuild()
+            elif now - self.refreshed_at > settings.AVAILABILITY_FILTER_REFRESH:
+                self._catch_up()
+
+    def rebuild(self):
+        with self.refresh_lock:
+            self._rebuild()
+
+    def catch_up(self):
+        """Add users registered or changed since the last refresh, possibly by another process"""
+        with self.refresh_lock:
+            self._catch_up()
+
+    def _rebuild(self):
+        from .models import CustomUser
+
+        started = timezone.now()
+        capacity = max(
+            settings.AVAILABILITY_FILTER_MIN_CAPACITY,
+            CustomUser.objects.count() * 2,
+        )
+        emails = BloomFilter(capacity, settings.AVAILABILITY_FILTER_ERROR_RATE)
+        phones = BloomFilter(capacity, settings.AVAILABILITY_FILTER_ERROR_RATE)
+        rows = CustomUser.objects.order_by('id').values_list('email', 'phone')
+        for email, phone in rows.iterator(chunk_size=5000):
+            emails.add(normalize_email(email))
+            phones.add(normalize_phone(phone))
+        # Values added to the old filters meanwhile are caught up next time
+        with self.lock:
+            self.emails, self.phones, self.modified_since = emails, phones, started
+            self.built_at = self.refreshed_at = time.monotonic()
+
+    def _catch_up(self):
+        from .models import CustomUser
+
+        started = timezone.now()
+        rows = list(CustomUser.objects.filter(
+            updated_at__gte=self.modified_since - CATCH_UP_OVERLAP
+        ).values_list('email', 'phone'))
+        with self.lock:
+            for email, phone in rows:
+                # The overlap reads some users again; do not count them twice
+                for bloom, value in ((self.emails, normalize_email(email)), (self.phones, normalize_phone(phone))):
+                    if value not in bloom:
+                        bloom.add(value)
+            self.modified_since = started
+            self.refreshed_at = time.monotonic()
+
+    def start_refresher(self):
+        with self.lock:
+            if self.refresher is not None:
+                return
+            self.stopping.clear()
+            self.refresher = threading.Thread(target=self.run_refresher, name='availability-refresher', daemon=True)
+            self.refresher.start()
+
+    def run_refresher(self):
+        """Build the filters at once, then refresh them every AVAILABILITY_FILTER_REFRESH seconds"""
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Availability filter refresh failed')
+            finally:
+                close_old_connections()
+            if self.stopping.wait(settings.AVAILABILITY_FILTER_REFRESH):
+                break
+
+    def stop_refresher(self):
+        self.stopping.set()
+        if self.refresher is not None:
+            self.refresher.join()
+            self.refresher = None
+
+    def add(self, email, phone):
+        if self.built_at is None:
+            return
+        with self.lock:
+            self.emails.add(normalize_email(email))
+            self.phones.add(normalize_phone(phone))
+
+    def is_email_available(self, email):
+        return self._is_available(email, normalize_email, 'emails', 'email')
+
+    def is_phone_available(self, phone):
+        return self._is_available(phone, normalize_phone, 'phones', 'phone')
+
+    def _is_available(self, value, normalize, filter_name, field):
+        from .models import CustomUser
+
+        ready = self._ensure_fresh()
+        self.counters['lookups'] += 1
+        if ready and normalize(value) not in getattr(self, filter_name):
+            self.counters['filter_negatives'] += 1
+            CACHE_REQUESTS.inc(cache='availability_filter', result='hit')
+            return True
+        CACHE_REQUESTS.inc(cache='availability_filter', result='miss')
+
+        self.counters['db_checks'] += 1
+        available = not CustomUser.objects.filter(**{field: value}).exists()
+        if available and ready:
+            self.counters['false_positives'] += 1
+        return available
+
+    def stats(self):
+        ready = self._ensure_fresh()
+        filters = {}
+        for name in ('emails', 'phones') if ready else ():
+            bloom = getattr(self, name)
+            filters[name] = {
+                'items': bloom.items,
+                'bits': bloom.bit_count,
+                'hash_count': bloom.hash_count,
+                'memory_bytes': len(bloom.bits),
+                'estimated_false_positive_rate': round(bloom.estimated_error_rate, 6),
+            }
+        db_checks = self.counters['db_checks']
+        return {
+            'filters': filters,
+            **self.counters,
+            'observed_false_positive_rate': (
+                round(self.counters['false_positives'] / db_checks, 6) if db_checks else None
+            ),
+            'age_seconds': round(time.monotonic() - self.built_at, 1) if ready else None,
+        }
+
+
+availability_index = AvailabilityIndex()
@@ -0,0 +1 @@
+# This file makes Django treat the directory as a package
\ No newline at end of file
@@ -0,0 +1,112 @@
+import shutil
+import tempfile
+import time
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from PIL import Image
+
+from accounts.models import CustomUser
+from accounts.serializers import UserRegistrationSerializer
+from cars.models import CarBrand, CarModel, CarVariant, CarType, Car, CarPhoto
+
+
+class Command(BaseCommand):
+    help = 'Measure registrations per second for the legacy and current registration paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10,
+                            help='Registrations to run for each path')
+        parser.add_argument('--photos', type=int, default=3,
+                            help='Photos submitted with each registration')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        # Run against a throwaway test database so the real one is untouched
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                self.run(options['count'], options['photos'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def run(self, count, photo_count):
+        brand = CarBrand.objects.create(name='Audi')
+        model = CarModel.objects.create(brand=brand, name='Q5')
+        variant = CarVariant.objects.create(model=model, name='SQ5')
+        car_type = CarType.objects.create(name='SUV')
+        catalog = {
+            'car_brand': brand.id, 'car_model': model.id,
+            'car_variant': variant.id, 'car_type': car_type.id,
+        }
+
+        results = {}
+        for label, register in [('legacy', self.register_legacy), ('current', self.register_current)]:
+            payloads = [self.payload(label, i, catalog, photo_count) for i in range(count)]
+            start = time.perf_counter()
+            for payload in payloads:
+                register(payload)
+            elapsed = time.perf_counter() - start
+            results[label] = count / elapsed
+            self.stdout.write(
+                f'{label:>8}: {count} registrations in {elapsed:.2f}s '
+                f'({results[label]:.2f}/s, {elapsed / count * 1000:.0f} ms each)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Speedup: {results["current"] / results["legacy"]:.2f}x'
+        ))
+
+    def payload(self, label, i, catalog, photo_count):
+        photos = []
+        for n in range(photo_count):
+            buffer = BytesIO()
+            Image.new('RGB', (640, 480), (i % 256, n * 40 % 256, len(label))).save(buffer, format='JPEG')
+            photos.append(SimpleUploadedFile(f'photo{n}.jpg', buffer.getvalue(), content_type='image/jpeg'))
+        return {
+            'email': f'{label}{i}@bench.example.com',
+            'name': f'Bench {label} {i}',
+            'phone': f'+1555{len(label)}{i:06d}',
+            'password': 'Bench-pass-123!',
+            'password_confirm': 'Bench-pass-123!',
+            'photos': photos,
+            **catalog,
+        }
+
+    def register_current(self, payload):
+        serializer = UserRegistrationSerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def register_legacy(self, payload):
+        """
+        The registration path before it was restructured: separate uniqueness
+        and catalog queries, serial image decoding, two password hashes and
+        per-photo inserts with file writes, all inside one transaction.
+        """
+        for _ in range(2):  # model UniqueValidator plus validate_email/validate_phone
+            CustomUser.objects.filter(email=payload['email']).exists()
+            CustomUser.objects.filter(phone=payload['phone']).exists()
+        brand = CarBrand.objects.get(pk=payload['car_brand'])
+        model = CarModel.objects.get(pk=payload['car_model'])
+        variant = CarVariant.objects.get(pk=payload['car_variant'])
+        car_type = CarType.objects.get(pk=payload['car_type'])
+        for photo in payload['photos']:
+            with Image.open(photo) as image:
+                image.verify()
+            photo.seek(0)
+
+        with transaction.atomic():
+            user = CustomUser.objects.create_user(
+                email=payload['email'], name=payload['name'], phone=payload['phone'],
+                password=payload['password'],
+            )
+            user.set_password(payload['password'])
+            user.save()
+            car = Car.objects.create(user=user, brand=brand, model=model, variant=variant, car_type=car_type)
+            for photo in payload['photos']:
+                CarPhoto.objects.create(car=car, photo=photo)
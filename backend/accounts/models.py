@@ -21,6 +21,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Lets the availability filters of other processes catch up on changed emails and phones
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = CustomUserManager()
 
@@ -1,9 +1,14 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.password_validation import validate_password
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch, Q, aprefetch_related_objects
+from django.utils import timezone
+from backend.serializers import ProfiledModelSerializer
 from .models import CustomUser
-from cars.models import CarBrand, CarModel, CarVariant, CarType, Car, CarPhoto
+from cars.models import CarVariant, CarType, Car
+from cars.photos import store_car_photos, create_car_photos
 
 
 class PhotoListField(serializers.Field):
@@ -41,21 +46,22 @@ class PhotoListField(serializers.Field):
             
             validated_photos.append(photo)
         
-        return validated_photos
+        # Verify image contents concurrently and store them before any rows are written
+        return store_car_photos(validated_photos)
     
     def to_representation(self, value):
         """Convert internal value to representation (not needed for write-only field)"""
         return None
 
 
-class UserRegistrationSerializer(serializers.ModelSerializer):
+class UserRegistrationSerializer(ProfiledModelSerializer):
     password = serializers.CharField(write_only=True, validators=[validate_password])
     password_confirm = serializers.CharField(write_only=True)
     
-    # Car information fields
-    car_brand = serializers.PrimaryKeyRelatedField(queryset=CarBrand.objects.all(), write_only=True)
-    car_model = serializers.PrimaryKeyRelatedField(queryset=CarModel.objects.all(), write_only=True)
-    car_variant = serializers.PrimaryKeyRelatedField(queryset=CarVariant.objects.all(), write_only=True)
+    # Car information fields; brand, model and variant are resolved together in validate()
+    car_brand = serializers.IntegerField(write_only=True)
+    car_model = serializers.IntegerField(write_only=True)
+    car_variant = serializers.IntegerField(write_only=True)
     car_type = serializers.PrimaryKeyRelatedField(queryset=CarType.objects.all(), write_only=True)
     
     # Photos field - use custom field to handle file validation properly
@@ -68,39 +74,52 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             'car_brand', 'car_model', 'car_variant', 'car_type', 'photos'
         ]
         extra_kwargs = {
-            'tier': {'required': False}
+            'tier': {'required': False},
+            # Uniqueness is checked for both fields in a single query in validate()
+            'email': {'validators': []},
+            'phone': {'validators': []},
         }
 
     def validate(self, attrs):
         if attrs['password'] != attrs['password_confirm']:
             raise serializers.ValidationError("Password and confirm password do not match.")
+        self._validate_unique_email_and_phone(attrs)
+        self._resolve_car_catalog(attrs)
         return attrs
 
-    def validate_email(self, value):
-        if CustomUser.objects.filter(email=value).exists():
-            raise serializers.ValidationError("A user with this email already exists.")
-        return value
-
-    def validate_phone(self, value):
-        if CustomUser.objects.filter(phone=value).exists():
-            raise serializers.ValidationError("A user with this phone number already exists.")
-        return value
+    def _validate_unique_email_and_phone(self, attrs):
+        email = CustomUser.objects.normalize_email(attrs['email'])
+        phone = attrs['phone']
+        errors = {}
+        taken = CustomUser.objects.filter(Q(email=email) | Q(phone=phone)).values_list('email', 'phone')
+        for taken_email, taken_phone in taken:
+            if taken_email == email:
+                errors['email'] = ["A user with this email already exists."]
+            if taken_phone == phone:
+                errors['phone'] = ["A user with this phone number already exists."]
+        if errors:
+            raise serializers.ValidationError(errors)
+        attrs['email'] = email
+
+    def _resolve_car_catalog(self, attrs):
+        """Load the variant with its model and brand in one query and check they line up"""
+        variant = CarVariant.objects.select_related('model__brand').filter(pk=attrs['car_variant']).first()
+        if variant is None:
+            raise serializers.ValidationError({
+                'car_variant': [f'Invalid pk "{attrs["car_variant"]}" - object does not exist.']
+            })
+        if variant.model_id != attrs['car_model']:
+            raise serializers.ValidationError({
+                'car_variant': ["Selected variant does not belong to the selected model."]
+            })
+        if variant.model.brand_id != attrs['car_brand']:
+            raise serializers.ValidationError({
+                'car_model': ["Selected model does not belong to the selected brand."]
+            })
+        attrs['car_variant'] = variant
+        attrs['car_model'] = variant.model
+        attrs['car_brand'] = variant.model.brand
 
-    def validate_car_model(self, value):
-        # Ensure the model belongs to the selected brand
-        car_brand = self.initial_data.get('car_brand')
-        if car_brand and value.brand.id != int(car_brand):
-            raise serializers.ValidationError("Selected model does not belong to the selected brand.")
-        return value
-
-    def validate_car_variant(self, value):
-        # Ensure the variant belongs to the selected model
-        car_model = self.initial_data.get('car_model')
-        if car_model and value.model.id != int(car_model):
-            raise serializers.ValidationError("Selected variant does not belong to the selected model.")
-        return value
-
-    @transaction.atomic
     def create(self, validated_data):
         # Extract car and photo data
         car_brand = validated_data.pop('car_brand')
@@ -109,27 +128,25 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         car_type = validated_data.pop('car_type')
         photos_data = validated_data.pop('photos')
         
-        # Extract password data
+        # Hash the password once, before taking the database write lock
         validated_data.pop('password_confirm')
-        password = validated_data.pop('password')
-        
-        # Create user
-        user = CustomUser.objects.create_user(**validated_data)
-        user.set_password(password)
-        user.save()
-        
-        # Create car registration
-        car = Car.objects.create(
-            user=user,
-            brand=car_brand,
-            model=car_model,
-            variant=car_variant,
-            car_type=car_type
-        )
+        user = CustomUser(password=make_password(validated_data.pop('password')), **validated_data)
         
-        # Create car photos (only if photos were provided)
-        for photo in photos_data:
-            CarPhoto.objects.create(car=car, photo=photo)
+        # Photos were stored during validation, so the transaction only covers the inserts
+        try:
+            with transaction.atomic():
+                user.save()
+                car = Car.objects.create(
+                    user=user,
+                    brand=car_brand,
+                    model=car_model,
+                    variant=car_variant,
+                    car_type=car_type
+                )
+                create_car_photos(car, photos_data)
+        except IntegrityError:
+            # Lost a race with a concurrent registration for the same email or phone
+            raise serializers.ValidationError("A user with this email or phone number already exists.")
         
         return user
 
@@ -155,7 +172,31 @@ class UserLoginSerializer(serializers.Serializer):
             raise serializers.ValidationError('Must include email and password')
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+def start_of_month():
+    return timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+async def aprefetch_profiles(users):
+    """
+    Load the cars and monthly trip counts UserProfileSerializer shows for
+    ``users`` through the async ORM, so serializing them runs no queries
+    """
+    from roadtrips.models import RoadTrip
+
+    users = [user for user in users if user is not None]
+    if not users:
+        return
+    cars = Car.objects.select_related('brand', 'model', 'variant', 'car_type').prefetch_related('photos')
+    await aprefetch_related_objects(users, Prefetch('cars', queryset=cars))
+    counts = RoadTrip.objects.filter(
+        organizer__in={user.id for user in users}, created_at__gte=start_of_month()
+    ).order_by().values('organizer').annotate(count=Count('id'))
+    monthly = {row['organizer']: row['count'] async for row in counts}
+    for user in users:
+        user.monthly_trip_count = monthly.get(user.id, 0)
+
+
+class UserProfileSerializer(ProfiledModelSerializer):
     cars = serializers.SerializerMethodField()
     stats = serializers.SerializerMethodField()
     
@@ -169,20 +210,13 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return CarSerializer(obj.cars.all(), many=True).data
     
     def get_stats(self, obj):
-        # Calculate user stats dynamically
+        # Calculate user stats dynamically, unless aprefetch_profiles() has
         from roadtrips.models import RoadTrip
-        from datetime import datetime, timedelta
-        from django.utils import timezone
-        
-        # Calculate current month's trip count
-        now = timezone.now()
-        start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        monthly_trips = RoadTrip.objects.filter(
-            organizer=obj,
-            created_at__gte=start_of_month
-        ).count()
-        
+
+        monthly_trips = getattr(obj, 'monthly_trip_count', None)
+        if monthly_trips is None:
+            monthly_trips = RoadTrip.objects.filter(organizer=obj, created_at__gte=start_of_month()).count()
+
         return {
             'monthlyTrips': monthly_trips,
             'notificationsReceived': 0,  # TODO: Implement notification tracking
@@ -190,7 +224,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         }
 
 
-class UserProfileUpdateSerializer(serializers.ModelSerializer):
+class UserProfileUpdateSerializer(ProfiledModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['name', 'phone']
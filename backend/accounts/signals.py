@@ -0,0 +1,33 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import invalidate_token
+from .availability import availability_index
+from .models import CustomUser
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """
+    Drop cached authentication for tokens removed by logout or password change
+    """
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    """
+    Drop cached authentication when a user changes, e.g. on deactivation
+    """
+    if created:
+        return
+    for key in Token.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+@receiver(post_save, sender=CustomUser)
+def add_user_to_availability_index(sender, instance, **kwargs):
+    """
+    Mark a new or changed email and phone as taken for the availability checks
+    """
+    availability_index.add(instance.email, instance.phone)
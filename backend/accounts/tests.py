@@ -1,3 +1,307 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient, APIRequestFactory
+
+from cars.models import CarBrand, CarModel, CarVariant, CarType
+from .authentication import CachedTokenAuthentication
+from .availability import BloomFilter, availability_index
+from .models import CustomUser
+from .serializers import UserRegistrationSerializer
+from .throttling import LocalMemoryBucketBackend, SQLiteBucketBackend
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        # Tokens are only cached in a cache that every worker shares
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        shared_cache = override_settings(
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir},
+            },
+            TOKEN_AUTH_CACHE='shared',
+        )
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        self.user = CustomUser.objects.create_user(
+            email='driver@example.com', password='Sup3r-secret!', name='Driver', phone='+15550000001'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def authenticate(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return CachedTokenAuthentication().authenticate(request)
+
+    def test_cached_lookup_costs_no_queries(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.email, 'driver@example.com')
+        self.assertEqual(user._state.db, 'default')
+        self.assertEqual(token.key, self.token.key)
+
+    @override_settings(TOKEN_AUTH_CACHE='default')
+    def test_process_local_cache_is_not_used(self):
+        self.authenticate()
+        with self.assertNumQueries(1):
+            user, token = self.authenticate()
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_logout_invalidates_cached_token(self):
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+
+    def test_deactivation_invalidates_cached_token(self):
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+
+    def test_change_password_with_cached_user(self):
+        self.client.get('/api/auth/profile/')
+        response = self.client.post('/api/auth/change-password/', {
+            'old_password': 'Sup3r-secret!',
+            'new_password': 'An0ther-secret!',
+            'new_password_confirm': 'An0ther-secret!',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, 401)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('An0ther-secret!'))
+
+    def test_profile_update_with_cached_user_keeps_other_fields(self):
+        self.client.get('/api/auth/profile/')
+        response = self.client.patch('/api/auth/profile/update/', {'name': 'Renamed'})
+        self.assertEqual(response.status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'Renamed')
+        self.assertTrue(self.user.check_password('Sup3r-secret!'))
+        self.assertEqual(self.client.get('/api/auth/profile/').data['name'], 'Renamed')
+
+    def test_login_does_not_create_session_by_default(self):
+        response = APIClient().post('/api/auth/login/', {
+            'email': 'driver@example.com', 'password': 'Sup3r-secret!'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('sessionid', response.cookies)
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class RegistrationTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+        self.brand = CarBrand.objects.create(name='Audi')
+        self.model = CarModel.objects.create(brand=self.brand, name='Q5')
+        self.variant = CarVariant.objects.create(model=self.model, name='SQ5')
+        self.car_type = CarType.objects.create(name='SUV')
+
+    def payload(self, **overrides):
+        photos = []
+        for color in ('red', 'blue'):
+            buffer = BytesIO()
+            Image.new('RGB', (8, 8), color).save(buffer, format='PNG')
+            photos.append(SimpleUploadedFile(f'{color}.png', buffer.getvalue(), content_type='image/png'))
+        data = {
+            'email': 'new@example.com', 'name': 'New Driver', 'phone': '+15550000009',
+            'password': 'Sup3r-secret!', 'password_confirm': 'Sup3r-secret!',
+            'car_brand': self.brand.id, 'car_model': self.model.id,
+            'car_variant': self.variant.id, 'car_type': self.car_type.id,
+            'photos': photos,
+        }
+        data.update(overrides)
+        return data
+
+    def test_register_creates_user_car_and_photos(self):
+        response = APIClient().post('/api/auth/register/', self.payload(), format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+
+        user = CustomUser.objects.get(email='new@example.com')
+        self.assertTrue(user.check_password('Sup3r-secret!'))
+        self.assertEqual(user.cars.get().variant, self.variant)
+        self.assertEqual(user.cars.get().photos.count(), 2)
+        self.assertEqual(response.data['token'], user.auth_token.key)
+
+    def test_validation_uses_one_uniqueness_and_one_catalog_query(self):
+        serializer = UserRegistrationSerializer(data=self.payload())
+        # uniqueness, variant/model/brand, car type
+        with self.assertNumQueries(3):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_duplicate_email_and_phone_are_reported_per_field(self):
+        CustomUser.objects.create_user(
+            email='new@example.com', password='x', name='Existing', phone='+15550000009'
+        )
+        serializer = UserRegistrationSerializer(data=self.payload())
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(set(serializer.errors), {'email', 'phone'})
+
+    def test_variant_must_belong_to_model(self):
+        other_model = CarModel.objects.create(brand=self.brand, name='Q7')
+        serializer = UserRegistrationSerializer(data=self.payload(car_model=other_model.id))
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('car_variant', serializer.errors)
+
+
+@override_settings(PERF_SAMPLE_RATE=0, AVAILABILITY_FILTER_THREAD=False)
+class AvailabilityFilterTests(TestCase):
+    def setUp(self):
+        availability_index.invalidate()
+        self.addCleanup(availability_index.invalidate)
+        CustomUser.objects.create_user(
+            email='Taken@Example.com', password='x', name='Taken', phone='+15550000001'
+        )
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        values = [f'user{i}@example.com' for i in range(1000)]
+        for value in values:
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in values))
+        misses = sum(f'other{i}@example.com' in bloom for i in range(10000))
+        self.assertLess(misses, 300)
+
+    def test_unknown_email_is_answered_without_queries(self):
+        availability_index.rebuild()
+        with self.assertNumQueries(0):
+            response = APIClient().get('/api/auth/check-email/', {'email': 'free@example.com'})
+        self.assertTrue(response.data['available'])
+
+    def test_taken_values_fall_through_to_database(self):
+        client = APIClient()
+        self.assertFalse(client.get('/api/auth/check-email/', {'email': 'Taken@example.com'}).data['available'])
+        self.assertFalse(client.get('/api/auth/check-phone/', {'phone': '+15550000001'}).data['available'])
+
+    def test_users_saved_after_build_are_added(self):
+        availability_index.rebuild()
+        CustomUser.objects.create_user(email='late@example.com', password='x', name='Late', phone='+15550000002')
+        self.assertFalse(availability_index.is_email_available('late@example.com'))
+
+    def test_values_changed_by_another_process_are_caught_up(self):
+        availability_index.rebuild()
+        # A profile update saved by another worker: no signal reaches this process
+        CustomUser.objects.filter(phone='+15550000001').update(phone='+15550000009', updated_at=timezone.now())
+        self.assertTrue(availability_index.is_phone_available('+15550000009'))
+
+        with self.assertNumQueries(1):
+            availability_index.catch_up()
+        self.assertIn('+15550000009', availability_index.phones)
+        self.assertFalse(availability_index.is_phone_available('+15550000009'))
+
+    def test_due_refresh_runs_once_for_waiting_lookups(self):
+        availability_index.rebuild()
+        availability_index.refreshed_at -= settings.AVAILABILITY_FILTER_REFRESH + 1
+        # A lookup that was waiting on the lock while another caught up
+        with availability_index.refresh_lock:
+            availability_index._catch_up()
+        with self.assertNumQueries(0):
+            availability_index.refresh()
+
+    def test_stats_are_staff_only(self):
+        staff = CustomUser.objects.create_user(
+            email='staff@example.com', password='x', name='Staff', phone='+15550000003', is_staff=True
+        )
+        client = APIClient()
+        self.assertEqual(client.get('/api/auth/check-availability/stats/').status_code, 401)
+        client.force_authenticate(staff)
+        response = client.get('/api/auth/check-availability/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('memory_bytes', response.data['filters']['emails'])
+
+
+
+@override_settings(AVAILABILITY_FILTER_THREAD=True)
+class AvailabilityRefresherTests(TransactionTestCase):
+    def setUp(self):
+        availability_index.invalidate()
+        self.addCleanup(availability_index.invalidate)
+        self.addCleanup(availability_index.stop_refresher)
+        CustomUser.objects.create_user(email='taken@example.com', password='x', name='Taken', phone='+15550000001')
+
+    def test_lookups_use_the_database_until_the_thread_has_built_the_filters(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(availability_index.is_email_available('free@example.com'))
+        self.assertEqual(availability_index.refresher.name, 'availability-refresher')
+
+        deadline = time.monotonic() + 5
+        while availability_index.built_at is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self.assertNumQueries(0):
+            self.assertTrue(availability_index.is_email_available('free@example.com'))
+        self.assertFalse(availability_index.is_email_available('taken@example.com'))
+
+@override_settings(PERF_SAMPLE_RATE=0, AVAILABILITY_FILTER_THREAD=False)
+class TokenBucketThrottleTests(TestCase):
+    def test_memory_bucket_refills_over_time(self):
+        backend = LocalMemoryBucketBackend()
+        self.assertEqual([backend.consume('k', 2, 1.0, 100.0)[0] for _ in range(3)], [True, True, False])
+        allowed, retry_after = backend.consume('k', 2, 1.0, 100.0)
+        self.assertAlmostEqual(retry_after, 1.0)
+        self.assertTrue(backend.consume('k', 2, 1.0, 101.0)[0])
+
+    def test_memory_bucket_evicts_least_recently_used_keys(self):
+        backend = LocalMemoryBucketBackend(max_keys=2)
+        self.assertTrue(backend.consume('throttled', 1, 0.01, 100.0)[0])
+        backend.consume('old', 1, 0.01, 100.0)
+        self.assertFalse(backend.consume('throttled', 1, 0.01, 100.0)[0])
+        backend.consume('new', 1, 0.01, 100.0)
+        self.assertEqual(list(backend.buckets), ['throttled', 'new'])
+        self.assertFalse(backend.consume('throttled', 1, 0.01, 100.0)[0])
+
+    def test_sqlite_bucket_is_shared_between_instances(self):
+        path = os.path.join(tempfile.mkdtemp(), 'throttle.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        first, second = SQLiteBucketBackend(path), SQLiteBucketBackend(path)
+        self.assertTrue(first.consume('k', 1, 0.5, 100.0)[0])
+        allowed, retry_after = second.consume('k', 1, 0.5, 100.0)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 2.0)
+
+    def test_rejection_sets_retry_after(self):
+        rates = {'availability': '2/min'}
+        backend = {'BACKEND': 'accounts.throttling.LocalMemoryBucketBackend'}
+        with override_settings(THROTTLE_BACKEND=backend), \
+                mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, rates):
+            client = APIClient()
+            codes = [client.get('/api/auth/check-email/', {'email': 'a@example.com'}).status_code for _ in range(2)]
+            response = client.get('/api/auth/check-email/', {'email': 'a@example.com'})
+
+        self.assertEqual(codes, [200, 200])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_login_is_throttled_per_email(self):
+        rates = {'login_identity': '1/min'}
+        backend = {'BACKEND': 'accounts.throttling.LocalMemoryBucketBackend'}
+        with override_settings(THROTTLE_BACKEND=backend), \
+                mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, rates):
+            first = APIClient(REMOTE_ADDR='10.0.0.1').post('/api/auth/login/', {'email': 'X@example.com', 'password': 'x'})
+            second = APIClient(REMOTE_ADDR='10.0.0.2').post('/api/auth/login/', {'email': 'x@example.com', 'password': 'x'})
+
+        self.assertEqual(first.status_code, 400)
+        self.assertEqual(second.status_code, 429)
@@ -0,0 +1,187 @@
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class LocalMemoryBucketBackend:
+    """
+    Token buckets held in this process only; fine for a single worker.
+
+    Past ``max_keys`` the least recently used buckets are dropped, so a flood
+    of new keys cannot reset the buckets of clients being throttled.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.max_keys = max_keys
+
+    def consume(self, key, capacity, refill_rate, now):
+        with self.lock:
+            if key in self.buckets:
+                self.buckets.move_to_end(key)
+            else:
+                while len(self.buckets) >= self.max_keys:
+                    self.buckets.popitem(last=False)
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return True, 0
+            self.buckets[key] = (tokens, now)
+            return False, (1 - tokens) / refill_rate
+
+
+class SQLiteBucketBackend:
+    """
+    Token buckets in a SQLite file shared by every worker on the host.
+
+    Each consume is one short IMMEDIATE transaction. If the file is busy for
+    longer than ``timeout`` the request is let through rather than queued
+    behind the lock. A Redis backend only needs the same ``consume`` method.
+    """
+
+    def __init__(self, path, timeout=0.05, purge_after=3600):
+        self.path = str(path)
+        self.timeout = timeout
+        self.purge_after = purge_after
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            self.local.conn = conn
+        return conn
+
+    def consume(self, key, capacity, refill_rate, now):
+        try:
+            conn = self.connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                tokens = min(capacity, tokens + (now - updated) * refill_rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                conn.execute(
+                    'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                    (key, tokens, now)
+                )
+                if random.random() < 0.001:
+                    conn.execute('DELETE FROM buckets WHERE updated < ?', (now - self.purge_after,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.OperationalError:
+            return True, 0
+        return allowed, 0 if allowed else (1 - tokens) / refill_rate
+
+
+_backend = None
+_backend_config = None
+
+
+def get_bucket_backend():
+    """Return the configured bucket backend, rebuilding it if the setting changed"""
+    global _backend, _backend_config
+    config = settings.THROTTLE_BACKEND
+    if _backend is None or _backend_config != config:
+        _backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        _backend_config = config
+    return _backend
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token-bucket throttle whose rate comes from DEFAULT_THROTTLE_RATES[scope].
+
+    A rate of "10/min" allows bursts of 10 requests and refills one token
+    every 6 seconds. Subclasses decide what the bucket is keyed on.
+    """
+    scope = None
+
+    def get_bucket_key(self, request, view):
+        raise NotImplementedError('.get_bucket_key() must be overridden')
+
+    def parse_rate(self, rate):
+        num, period = rate.split('/')
+        duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+        return int(num), duration
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        key = self.get_bucket_key(request, view)
+        if rate is None or key is None:
+            return True
+
+        capacity, duration = self.parse_rate(rate)
+        allowed, retry_after = get_bucket_backend().consume(
+            f'{self.scope}:{key}', capacity, capacity / duration, time.time()
+        )
+        if not allowed:
+            self.retry_after = retry_after
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """Bucket per client IP address"""
+
+    def get_bucket_key(self, request, view):
+        return f'ip:{self.get_ident(request)}'
+
+
+class IdentityTokenBucketThrottle(TokenBucketThrottle):
+    """Bucket per account: the authenticated user, or the email being logged in or registered"""
+
+    def get_bucket_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if email:
+            return f'email:{email.strip().lower()}'
+        return None
+
+
+class LoginRateThrottle(IPTokenBucketThrottle):
+    scope = 'login'
+
+
+class LoginIdentityRateThrottle(IdentityTokenBucketThrottle):
+    scope = 'login_identity'
+
+
+class RegisterRateThrottle(IPTokenBucketThrottle):
+    scope = 'register'
+
+
+class AvailabilityRateThrottle(IPTokenBucketThrottle):
+    scope = 'availability'
+
+
+class WriteRateThrottle(IdentityTokenBucketThrottle):
+    scope = 'write'
+
+
+class TelemetryRateThrottle(IdentityTokenBucketThrottle):
+    scope = 'telemetry'
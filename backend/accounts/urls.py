@@ -17,4 +17,5 @@ urlpatterns = [
     # Utility endpoints
     path('check-email/', views.check_email_availability, name='check_email'),
     path('check-phone/', views.check_phone_availability, name='check_phone'),
+    path('check-availability/stats/', views.availability_filter_stats, name='availability_stats'),
 ]
\ No newline at end of file
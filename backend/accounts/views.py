@@ -1,9 +1,12 @@
+import logging
+
 from django.shortcuts import render
-from rest_framework import status, generics, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework import status, generics, permissions, serializers
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import login, logout
+from backend.routers import pin_issued_token
 from .serializers import (
     UserRegistrationSerializer, 
     UserLoginSerializer, 
@@ -11,11 +14,21 @@ from .serializers import (
     UserProfileUpdateSerializer,
     ChangePasswordSerializer
 )
+from .availability import availability_index
+from .throttling import (
+    LoginRateThrottle,
+    LoginIdentityRateThrottle,
+    RegisterRateThrottle,
+    AvailabilityRateThrottle
+)
 from .models import CustomUser
 
+logger = logging.getLogger(__name__)
+
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([RegisterRateThrottle])
 def register_user(request):
     """
     Register a new user with car information and photos
@@ -30,15 +43,14 @@ def register_user(request):
     
     serializer = UserRegistrationSerializer(data=data)
     
-    # Temporary debug logging to see what's failing
     if not serializer.is_valid():
-        print("DEBUG: Serializer validation failed")
-        print("DEBUG: Serializer errors:", serializer.errors)
+        logger.info('Registration rejected, invalid fields: %s', sorted(serializer.errors))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     try:
         user = serializer.save()
-        token, created = Token.objects.get_or_create(user=user)
+        token = Token.objects.create(user=user)
+        pin_issued_token(token.key)
         
         # Get the user's car information for response
         user_car = user.cars.first()  # Get the car we just created
@@ -53,10 +65,10 @@ def register_user(request):
             'car': car_data,
             'token': token.key
         }, status=status.HTTP_201_CREATED)
+    except serializers.ValidationError as e:
+        return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        print("DEBUG: Error during user creation:", str(e))
-        import traceback
-        print("DEBUG: Full traceback:", traceback.format_exc())
+        logger.exception('Error during user creation')
         return Response({
             'error': 'An error occurred during registration',
             'details': str(e)
@@ -65,6 +77,7 @@ def register_user(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([LoginRateThrottle, LoginIdentityRateThrottle])
 def login_user(request):
     """
     Login user and return token
@@ -73,7 +86,10 @@ def login_user(request):
     if serializer.is_valid():
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
-        login(request, user)
+        pin_issued_token(token.key)
+        # Token clients don't need a DB-backed session; browser clients can opt in
+        if request.data.get('session') in (True, 'true', '1'):
+            login(request, user)
         return Response({
             'message': 'Login successful',
             'user': UserProfileSerializer(user).data,
@@ -149,6 +165,7 @@ def change_password(request):
         except:
             pass
         token = Token.objects.create(user=user)
+        pin_issued_token(token.key)
         
         return Response({
             'message': 'Password changed successfully',
@@ -159,6 +176,7 @@ def change_password(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([AvailabilityRateThrottle])
 def check_email_availability(request):
     """
     Check if email is available for registration
@@ -167,12 +185,14 @@ def check_email_availability(request):
     if not email:
         return Response({'error': 'Email parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
     
-    is_available = not CustomUser.objects.filter(email=email).exists()
+    # Bloom filter answers "available" without a query; possible matches hit the index
+    is_available = availability_index.is_email_available(email)
     return Response({'available': is_available}, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([AvailabilityRateThrottle])
 def check_phone_availability(request):
     """
     Check if phone number is available for registration
@@ -181,5 +201,15 @@ def check_phone_availability(request):
     if not phone:
         return Response({'error': 'Phone parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
     
-    is_available = not CustomUser.objects.filter(phone=phone).exists()
+    is_available = availability_index.is_phone_available(phone)
     return Response({'available': is_available}, status=status.HTTP_200_OK)
+
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def availability_filter_stats(request):
+    """
+    Memory and false-positive statistics for the availability Bloom filters
+    """
+    return Response(availability_index.stats(), status=status.HTTP_200_OK)
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class BackendConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'backend'
+
+    def ready(self):
+        from . import checks  # noqa: F401
+        from .query_hooks import install_dispatch
+
+        connection_created.connect(install_dispatch)
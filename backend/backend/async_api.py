@@ -0,0 +1,90 @@
+"""
+Helpers for the async read endpoints served natively under ASGI.
+
+DRF views are synchronous, so the async endpoints are plain Django async
+views. async_api_view() authenticates like the DRF views (token, then
+session) and turns DRF exceptions into the same error payloads;
+AsyncPageNumberPagination pages like PageNumberPagination. The database and
+cache are reached through their async APIs and responses are rendered with
+DRF's JSONRenderer, so a client cannot tell the two variants apart.
+"""
+import functools
+
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponse
+from rest_framework import exceptions
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+
+from accounts.authentication import CachedTokenAuthentication
+
+
+def render(data, status=200, headers=None):
+    renderer = JSONRenderer()
+    return HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type, headers=headers)
+
+
+async def authenticate(request):
+    """The request's user: by token, then by session, as the DRF authentication classes do"""
+    result = await CachedTokenAuthentication().aauthenticate(request)
+    if result is not None:
+        return result[0]
+    return await request.auser()
+
+
+def async_api_view(login_required=True):
+    """
+    Decorate an async read-only (GET) view taking a DRF Request.
+
+    The request's user is set before the view runs, and an APIException or
+    Http404 raised by authentication or the view becomes DRF's error response.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            api_request = Request(request)
+            try:
+                if request.method not in ('GET', 'HEAD'):
+                    raise exceptions.MethodNotAllowed(request.method)
+                api_request.user = await authenticate(request)
+                if login_required and not api_request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                return await view(api_request, *args, **kwargs)
+            except (exceptions.APIException, Http404) as exc:
+                if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    exc.auth_header = CachedTokenAuthentication().authenticate_header(api_request)
+                response = exception_handler(exc, {'request': api_request})
+                headers = {key: value for key, value in response.items() if key != 'Content-Type'}
+                return render(response.data, response.status_code, headers)
+        return wrapper
+    return decorator
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """PageNumberPagination with the count and page loaded through the async ORM"""
+
+    async def apaginate_queryset(self, queryset, request):
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        # Paginator.count is cached, so setting it spares the synchronous count()
+        paginator.count = await self.acount(queryset, request)
+        return [obj async for obj in self.load_page(paginator, request).object_list]
+
+    async def acount(self, queryset, request):
+        return await queryset.acount()
+
+    def load_page(self, paginator, request):
+        """The requested page of ``paginator``, as PageNumberPagination.paginate_queryset() finds it"""
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise exceptions.NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return self.page
+
+    def get_paginated_data(self, data):
+        return self.get_paginated_response(data).data
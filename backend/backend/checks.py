@@ -0,0 +1,25 @@
+"""
+System checks for settings that only work when every worker process sees
+the same cache.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+
+def is_process_local(alias):
+    """Whether the cache ``alias`` lives in this process's memory, out of the other workers' sight"""
+    return isinstance(caches[alias], LocMemCache)
+
+
+@register()
+def check_replica_pin_cache(app_configs, **kwargs):
+    if settings.DATABASE_REPLICAS and is_process_local(settings.REPLICA_PIN_CACHE):
+        return [Error(
+            f'REPLICA_PIN_CACHE ({settings.REPLICA_PIN_CACHE!r}) is a per-process LocMemCache.',
+            hint='Point it at a cache shared by all workers (e.g. Redis, Memcached or the database cache), '
+                 'or a client that wrote may read stale rows from a replica through another worker.',
+            id='backend.E001',
+        )]
+    return []
@@ -0,0 +1,44 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def copy_database(source, target, pages=1024):
+    """Copy one SQLite file onto another with the online backup API"""
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst, pages=pages)
+
+
+class Command(BaseCommand):
+    help = (
+        'Stand-in for replication: copy the primary SQLite database onto each '
+        'replica in DATABASE_REPLICAS, once or every --interval seconds'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep copying with this many seconds between rounds')
+        parser.add_argument('--source', help='Primary database file (default: the default alias)')
+        parser.add_argument('--target', action='append', dest='targets',
+                            help='Replica database file; may be repeated (default: DATABASE_REPLICAS)')
+
+    def handle(self, *args, **options):
+        source = options['source'] or settings.DATABASES['default']['NAME']
+        targets = options['targets'] or [
+            settings.DATABASES[alias]['NAME'] for alias in settings.DATABASE_REPLICAS
+        ]
+        if not targets:
+            raise CommandError('No replicas: set SQLITE_REPLICA or DATABASE_REPLICAS, or pass --target')
+
+        while True:
+            started = time.perf_counter()
+            for target in targets:
+                copy_database(str(source), str(target))
+            self.stdout.write(
+                f'Copied {source} to {len(targets)} replica(s) in {(time.perf_counter() - started) * 1000:.0f} ms'
+            )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,323 @@
+"""
+Process-aggregated counters and histograms in the Prometheus text format.
+
+Every thread records into its own shard, so recording takes no lock. A
+scrape merges the shards of this process, writes them to METRICS_DIR as
+this process's snapshot and adds the snapshots left there by the other
+worker processes. Processes also refresh their snapshot every
+METRICS_FLUSH_INTERVAL seconds while serving requests, which bounds how
+stale another worker's numbers can be. Snapshots of processes that have
+exited are deleted by the next scrape, so a restarted worker is not counted
+twice and the directory does not grow with every worker ever started.
+"""
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .query_hooks import request_execute_wrapper
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.local = threading.local()
+        # (thread, shard) pairs; shards of finished threads are folded into `retired`
+        self.shards = []
+        self.retired = {}
+        self.compact_lock = threading.Lock()
+        self.flushed_at = 0.0
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = {}
+            self.shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _merge_into(self, merged, shard):
+        for (name, labels), value in shard.copy().items():
+            series = merged.setdefault(name, {})
+            series[labels] = self.metrics[name].merge(series.get(labels), value)
+
+    def _merge_into_series(self, merged, other):
+        """Add a {name: {labels_json: value}} snapshot into merged"""
+        for name, series in other.items():
+            if name in self.metrics:
+                target = merged.setdefault(name, {})
+                for labels, value in series.items():
+                    target[labels] = self.metrics[name].merge(target.get(labels), value)
+
+    def _compact(self):
+        """Fold the shards of finished threads into one, so thread churn does not grow memory"""
+        for pair in [pair for pair in self.shards if not pair[0].is_alive()]:
+            self.shards.remove(pair)
+            self._merge_into(self.retired, pair[1])
+
+    def snapshot(self):
+        """Merge every thread's shard into {name: {labels_json: value}}"""
+        merged = {}
+        with self.compact_lock:
+            self._compact()
+            self._merge_into_series(merged, self.retired)
+        for thread, shard in list(self.shards):
+            self._merge_into(merged, shard)
+        return merged
+
+    def snapshot_path(self, pid=None):
+        return Path(settings.METRICS_DIR) / f'metrics-{pid or os.getpid()}.json'
+
+    def flush(self):
+        """Write this process's snapshot where the other workers can read it"""
+        if not settings.METRICS_DIR:
+            return
+        self.flushed_at = time.monotonic()
+        path = self.snapshot_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # A temporary file of its own, since threads of this process may flush at once
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, prefix=f'{path.stem}-', suffix='.tmp',
+                                         delete=False) as f:
+            try:
+                json.dump(self.snapshot(), f)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed_at > settings.METRICS_FLUSH_INTERVAL:
+            self.flushed_at = time.monotonic()
+            with self.compact_lock:
+                self._compact()
+            self.flush()
+
+    def collect(self):
+        """Snapshot of this process plus the latest snapshots of every other process"""
+        merged = self.snapshot()
+        if not settings.METRICS_DIR:
+            return merged
+        self.flush()
+        own = self.snapshot_path()
+        for path in Path(settings.METRICS_DIR).glob('metrics-*.json'):
+            if path == own:
+                continue
+            if not process_exists(path.stem.removeprefix('metrics-')):
+                path.unlink(missing_ok=True)
+                continue
+            try:
+                with open(path) as f:
+                    other = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._merge_into_series(merged, other)
+        return merged
+
+    def exposition(self):
+        merged = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labels, value in sorted(merged.get(name, {}).items()):
+                lines.extend(metric.lines(json.loads(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def process_exists(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        # Alive, but run by another user
+        return True
+    return True
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def key(self, labels):
+        return self.name, json.dumps([labels[name] for name in self.labelnames])
+
+    def label_dict(self, values):
+        return dict(zip(self.labelnames, values))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = registry.shard()
+        key = self.key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def merge(self, total, value):
+        return (total or 0) + value
+
+    def lines(self, values, value):
+        return [f'{self.name}{format_labels(self.label_dict(values))} {value:g}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = registry.shard()
+        key = self.key(labels)
+        # Per-bucket (not cumulative) counts, then sum and count
+        state = shard.get(key)
+        if state is None:
+            state = shard[key] = [0] * (len(self.buckets) + 3)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def merge(self, total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def lines(self, values, state):
+        labels = self.label_dict(values)
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), state):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(f'{self.name}_bucket{format_labels({**labels, "le": le})} {cumulative}')
+        lines.append(f'{self.name}_sum{format_labels(labels)} {state[-2]:g}')
+        lines.append(f'{self.name}_count{format_labels(labels)} {state[-1]}')
+        return lines
+
+
+# -------------------------
+# Application metrics
+# -------------------------
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route', ['route', 'method'],
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries per request by route', ['route'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+NOTIFICATION_FANOUT_SIZE = Histogram(
+    'trip_notification_fanout_size', 'Notifications created per trip event', ['event'],
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000),
+)
+NOTIFICATION_FANOUT_DURATION = Histogram(
+    'trip_notification_fanout_duration_seconds', 'Time spent fanning out notifications per trip event', ['event'],
+)
+TRIP_JOINS = Counter(
+    'trip_join_total', 'Trip join attempts by outcome', ['outcome'],
+)
+UPLOAD_BYTES = Counter(
+    'upload_bytes_total', 'Bytes of accepted uploads', ['kind'],
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit or miss)', ['cache', 'result'],
+)
+TELEMETRY_POINTS = Counter(
+    'telemetry_points_total', 'GPS fixes accepted, stored as track segments, and dropped from full buffers',
+    ['outcome'],
+)
+DB_BUSY_RETRIES = Counter(
+    'db_busy_retries_total', 'Statements retried because SQLite was busy, and retries that gave up',
+    ['database', 'outcome'],
+)
+
+
+class timed:
+    """Context manager observing the elapsed seconds into a histogram"""
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class MetricsMiddleware:
+    """Record latency and query count per route for every request"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with request_execute_wrapper(counter):
+            response = self.get_response(request)
+        self.record(request, started, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with request_execute_wrapper(counter):
+            response = await self.get_response(request)
+        self.record(request, started, counter)
+        return response
+
+    def record(self, request, started, counter):
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route=route, method=request.method)
+        REQUEST_QUERIES.observe(counter.queries, route=route)
+        registry.maybe_flush()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
@@ -0,0 +1,197 @@
+import json
+import logging
+import random
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .query_hooks import request_execute_wrapper
+
+logger = logging.getLogger('backend.performance')
+
+# Profile of the request being handled in this thread or task, if it was sampled
+current_profile = ContextVar('current_profile', default=None)
+
+# Modules whose execute wrappers sit between project code and every query
+INSTRUMENTATION = {
+    str(Path(__file__).with_name(name)) for name in ('middleware.py', 'metrics.py', 'profiling.py', 'query_hooks.py')
+}
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def query_shape(sql):
+    """SQL with its IN lists collapsed, so the same query with other parameters matches"""
+    return IN_LIST.sub('IN (...)', sql)
+
+
+def call_site():
+    """First frame in this project's code outside the instrumentation, as 'path:line in function'"""
+    base_dir = str(settings.BASE_DIR)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base_dir) and filename not in INSTRUMENTATION and 'site-packages' not in filename:
+            return f'{filename[len(base_dir) + 1:]}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+class RequestProfile:
+    """SQL and phase timings for one sampled request; also a database execute wrapper"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.timings = defaultdict(float)
+        self.view_started = None
+        self.serializing = False
+        self.shapes = Counter()
+        self.call_sites = {}
+        self.threshold = settings.PERF_N_PLUS_ONE_THRESHOLD
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            shape = query_shape(sql)
+            self.shapes[shape] += 1
+            # Walking the stack is the costly part, so only do it once per repeated shape
+            if self.shapes[shape] == self.threshold:
+                self.call_sites[shape] = call_site()
+
+    def repeated_queries(self):
+        return [
+            {'sql': shape, 'count': count, 'call_site': self.call_sites.get(shape)}
+            for shape, count in self.shapes.most_common()
+            if count >= self.threshold
+        ]
+
+
+def run_inline(hook):
+    """
+    ``hook`` as a coroutine function. Django runs the synchronous hooks of an
+    async middleware in a thread; these take microseconds and do no I/O.
+    """
+    async def ahook(*args):
+        return hook(*args)
+    return ahook
+
+
+class PerformanceMiddleware:
+    """
+    Record query count and time, view, rendering and total time for a sample
+    of requests (PERF_SAMPLE_RATE). The view phase runs from the view's call
+    to its response: for DRF views authentication, fetching and serializing.
+    Serializers built on backend.serializers also report the serialize phase
+    within it. Async views render their response themselves, inside the view
+    phase.
+
+    Results go out as a Server-Timing header and one JSON log line on the
+    'backend.performance' logger. Query shapes repeated at least
+    PERF_N_PLUS_ONE_THRESHOLD times in one request are listed with the
+    project code that issued them, and the line is logged as a warning.
+    Unsampled requests pass straight through.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            self.process_view = run_inline(self.process_view)
+            self.process_template_response = run_inline(self.process_template_response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.PERF_SAMPLE_RATE:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            with request_execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.PERF_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            with request_execute_wrapper(profile):
+                response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        now = time.perf_counter()
+        total = now - profile.started
+        if profile.view_started is not None and 'view' not in profile.timings:
+            # A response without deferred rendering: the view has only just returned
+            profile.timings['view'] = now - profile.view_started
+        if settings.PERF_SERVER_TIMING:
+            response['Server-Timing'] = self.server_timing(profile, total)
+        self.log(request, response, profile, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+        return None
+
+    def process_template_response(self, request, response):
+        profile = current_profile.get()
+        if profile is not None:
+            start = time.perf_counter()
+            if profile.view_started is not None:
+                profile.timings['view'] += start - profile.view_started
+
+            def rendered(response):
+                profile.timings['render'] += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def server_timing(self, profile, total):
+        metrics = [f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"']
+        metrics += [f'{name};dur={duration * 1000:.1f}' for name, duration in profile.timings.items()]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def log(self, request, response, profile, total):
+        match = request.resolver_match
+        repeated = profile.repeated_queries()
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_queries': profile.queries,
+            'db_ms': round(profile.db_time * 1000, 1),
+            **{f'{name}_ms': round(duration * 1000, 1) for name, duration in profile.timings.items()},
+        }
+        if repeated:
+            record['repeated_queries'] = repeated
+        logger.log(logging.WARNING if repeated else logging.INFO, json.dumps(record))
@@ -0,0 +1,193 @@
+"""
+Pagination that avoids counting every row of large tables.
+
+PageNumberPagination runs a COUNT(*) over the whole filtered queryset, joins
+and DISTINCT included, for every page. API viewsets choose instead, with
+pagination_class:
+
+- CachedCountPageNumberPagination: the count is cached for
+  PAGINATION_COUNT_CACHE_TTL seconds per user, endpoint and set of filters,
+  so paging through a list or reordering it counts once.
+- UncountedPageNumberPagination: no count at all. A page fetches one row
+  more than it shows to know whether there is a next one, and "count" is
+  null.
+
+Both keep PageNumberPagination's {count, next, previous, results} response
+and serve the async endpoints too.
+
+Admin changelists count their rows for the paginator and once more, unfiltered,
+for the "N total" link. EstimatedCountMixin drops the second count and
+gives the changelist an EstimatedCountPaginator, which takes the count of an
+unfiltered changelist from the database's own statistics once they put the
+table above ADMIN_ESTIMATED_COUNT_THRESHOLD rows. Page numbers near the end
+are then approximate; a page past the real end is empty.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .async_api import AsyncPageNumberPagination
+from .metrics import CACHE_REQUESTS
+
+
+def estimated_count(model, using='default'):
+    """
+    The number of rows in ``model``'s table according to the database,
+    without counting them, or None where there is no cheap estimate
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Kept by VACUUM and ANALYZE; -1 until the table is first analyzed
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)', [table])
+                row = cursor.fetchone()
+                return int(row[0]) if row and row[0] >= 0 else None
+            if connection.vendor == 'sqlite':
+                # The last rowid, read from the end of the table's b-tree. It
+                # counts deleted rows too, which is close enough for paging.
+                cursor.execute(f'SELECT MAX(_rowid_) FROM {table}')
+                return cursor.fetchone()[0] or 0
+    except DatabaseError:
+        # E.g. a table without a rowid
+        return None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        # Table statistics only describe an unfiltered, unsliced table
+        if query is not None and not query.where and not query.is_sliced and not query.distinct:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class EstimatedCountMixin:
+    """ModelAdmin mixin for tables too large to count on every changelist page"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class CachedCountPageNumberPagination(AsyncPageNumberPagination):
+    """
+    PageNumberPagination with the count cached. Only the count is: rows
+    added or removed show in the pages at once and in the count within
+    PAGINATION_COUNT_CACHE_TTL seconds.
+    """
+    # Parameters that do not change which rows are counted
+    uncounted_query_params = ('ordering', 'format')
+
+    def count_key(self, request):
+        """The cache key of the count: the user, the path and the filtering parameters, sorted"""
+        ignored = {self.page_query_param, self.page_size_query_param, *self.uncounted_query_params}
+        params = sorted(
+            (name, value) for name, values in request.query_params.lists() if name not in ignored
+            for value in values if value != ''
+        )
+        user_id = request.user.pk if request.user.is_authenticated else None
+        digest = hashlib.sha256(json.dumps([user_id, request.path, params]).encode()).hexdigest()
+        return f'pagination:count:{digest}'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        cache, key = caches[settings.PAGINATION_COUNT_CACHE], self.count_key(request)
+        count = cache.get(key)
+        if count is None:
+            CACHE_REQUESTS.inc(cache='page_count', result='miss')
+            count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TTL)
+        else:
+            CACHE_REQUESTS.inc(cache='page_count', result='hit')
+        paginator.count = count
+        return list(self.load_page(paginator, request).object_list)
+
+    async def acount(self, queryset, request):
+        cache, key = caches[settings.PAGINATION_COUNT_CACHE], self.count_key(request)
+        count = await cache.aget(key)
+        if count is None:
+            CACHE_REQUESTS.inc(cache='page_count', result='miss')
+            count = await queryset.acount()
+            await cache.aset(key, count, settings.PAGINATION_COUNT_CACHE_TTL)
+        else:
+            CACHE_REQUESTS.inc(cache='page_count', result='hit')
+        return count
+
+
+class UncountedPageNumberPagination(AsyncPageNumberPagination):
+    """
+    Page numbers without a count: each page reads page_size + 1 rows and
+    the last one only tells whether there is a next page. "count" is null
+    and ?page=last is not supported.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        start, end = self.bounds(request)
+        return self.take_page(request, list(queryset[start:end]))
+
+    async def apaginate_queryset(self, queryset, request):
+        start, end = self.bounds(request)
+        return self.take_page(request, [obj async for obj in queryset[start:end]])
+
+    def bounds(self, request):
+        """The slice of rows to read: the page, and the first row of the next one"""
+        self.size = self.get_page_size(request)
+        page_number = request.query_params.get(self.page_query_param) or 1
+        try:
+            self.number = int(page_number)
+        except ValueError:
+            self.number = 0
+        if self.number < 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message='That page number is not a positive integer'
+            ))
+        start = (self.number - 1) * self.size
+        return start, start + self.size + 1
+
+    def take_page(self, request, rows):
+        if not rows and self.number > 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=self.number, message='That page contains no results'
+            ))
+        self.request = request
+        self.has_next = len(rows) > self.size
+        return rows[:self.size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if self.number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.number - 1)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': None,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {'type': 'integer', 'nullable': True, 'example': None}
+        return response_schema
@@ -0,0 +1,243 @@
+"""
+On-demand profiling of single requests for staff.
+
+A staff user (session or token) sends ``X-Profile: 1`` or ``?_profile=1``
+and the request is run under a stack sampler. The samples are written to
+PROFILER_DIR as collapsed stacks (``.folded``, which speedscope and
+flamegraph.pl read directly), next to a ``.json`` file with the request
+summary and the SQL it ran. Sample count, query count and file size are
+capped, and only the newest PROFILER_KEEP_FILES profiles are kept.
+"""
+import json
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+
+from accounts.authentication import CachedTokenAuthentication
+from .query_hooks import request_execute_wrapper
+
+
+def frame_label(code, base_dir):
+    filename = code.co_filename
+    if filename.startswith(base_dir):
+        filename = filename[len(base_dir) + 1:]
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages', 1)[1].lstrip('/\\')
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class StackSampler(threading.Thread):
+    """Samples another thread's Python stack every ``interval`` seconds"""
+
+    def __init__(self, thread_id, interval, max_samples):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_samples = max_samples
+        self.stacks = Counter()
+        self.samples = 0
+        self.done = threading.Event()
+        self.base_dir = str(settings.BASE_DIR)
+
+    def run(self):
+        labels = {}
+        while not self.done.wait(self.interval) and self.samples < self.max_samples:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code not in labels:
+                    labels[code] = frame_label(code, self.base_dir)
+                stack.append(labels[code])
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+
+class QueryRecorder:
+    """Database execute wrapper keeping the first ``limit`` queries"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.queries = []
+        self.dropped = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < self.limit:
+                self.queries.append({'sql': sql, 'ms': round((time.perf_counter() - start) * 1000, 3)})
+            else:
+                self.dropped += 1
+
+
+class SwitchInterval:
+    """
+    The interpreter's thread switch interval, lowered while any profile runs.
+    It belongs to the whole process, so only the first profile to start
+    saves the original and only the last one to stop restores it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.original = None
+
+    def lower(self, interval):
+        with self.lock:
+            if self.active == 0:
+                self.original = sys.getswitchinterval()
+                # The sampler only runs when the GIL is handed over, every 5ms by default
+                sys.setswitchinterval(min(self.original, interval))
+            self.active += 1
+
+    def restore(self):
+        with self.lock:
+            self.active -= 1
+            if self.active == 0:
+                sys.setswitchinterval(self.original)
+
+
+switch_interval = SwitchInterval()
+
+
+def is_staff(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    try:
+        result = CachedTokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return bool(result and result[0].is_staff)
+
+
+def collapsed_stacks(stacks, max_bytes):
+    """Collapsed-stack lines, heaviest first, stopping before max_bytes"""
+    lines, size = [], 0
+    for stack, count in stacks.most_common():
+        line = f'{stack} {count}\n'
+        size += len(line.encode())
+        if size > max_bytes:
+            break
+        lines.append(line)
+    return ''.join(lines)
+
+
+class ProfilerMiddleware:
+    """
+    Profile requests from staff that ask for it; see the module docstring.
+
+    Under ASGI the event loop's thread is sampled, so work the request hands
+    to sync_to_async threads shows up as time spent waiting for them.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def requested(self, request):
+        requested = request.headers.get('X-Profile') == '1' or request.GET.get('_profile') == '1'
+        return settings.PROFILER_ENABLED and requested
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not (self.requested(request) and is_staff(request)):
+            return self.get_response(request)
+
+        profile = self.start()
+        try:
+            with request_execute_wrapper(profile['recorder']):
+                response = self.get_response(request)
+        finally:
+            self.stop(profile)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not (self.requested(request) and await sync_to_async(is_staff)(request)):
+            return await self.get_response(request)
+
+        profile = self.start()
+        try:
+            with request_execute_wrapper(profile['recorder']):
+                response = await self.get_response(request)
+        finally:
+            self.stop(profile)
+        return self.finish(request, response, profile)
+
+    def start(self):
+        profile = {
+            'sampler': StackSampler(
+                threading.get_ident(), settings.PROFILER_INTERVAL, settings.PROFILER_MAX_SAMPLES
+            ),
+            'recorder': QueryRecorder(settings.PROFILER_MAX_QUERIES),
+            'started': time.perf_counter(),
+        }
+        switch_interval.lower(settings.PROFILER_INTERVAL)
+        profile['sampler'].start()
+        return profile
+
+    def stop(self, profile):
+        profile['sampler'].stop()
+        switch_interval.restore()
+        profile['duration'] = time.perf_counter() - profile['started']
+
+    def finish(self, request, response, profile):
+        profile_id = self.save(request, response, profile['sampler'], profile['recorder'], profile['duration'])
+        response['X-Profile-Id'] = profile_id
+        return response
+
+    def save(self, request, response, sampler, recorder, duration):
+        directory = Path(settings.PROFILER_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-')[:80] or 'root'
+        profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10**9:09d}-{request.method}-{slug}'
+
+        max_bytes = settings.PROFILER_MAX_BYTES
+        (directory / f'{profile_id}.folded').write_text(collapsed_stacks(sampler.stacks, max_bytes))
+        summary = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'samples': sampler.samples,
+            'interval_ms': settings.PROFILER_INTERVAL * 1000,
+            'query_count': len(recorder.queries) + recorder.dropped,
+            'sql_ms': round(sum(query['ms'] for query in recorder.queries), 3),
+            'queries_dropped': recorder.dropped,
+            'queries': recorder.queries,
+        }
+        content = json.dumps(summary, indent=1)
+        while len(content.encode()) > max_bytes and summary['queries']:
+            # Keep the summary valid JSON under the cap by trimming the query list
+            kept = len(summary['queries']) // 2
+            summary['queries_dropped'] += len(summary['queries']) - kept
+            summary['queries'] = summary['queries'][:kept]
+            content = json.dumps(summary, indent=1)
+        (directory / f'{profile_id}.json').write_text(content)
+
+        profiles = sorted(directory.glob('*.json'))
+        for old in profiles[:-settings.PROFILER_KEEP_FILES]:
+            old.unlink(missing_ok=True)
+            old.with_suffix('.folded').unlink(missing_ok=True)
+        return profile_id
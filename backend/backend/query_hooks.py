@@ -0,0 +1,39 @@
+"""
+Database execute wrappers scoped to a request rather than a connection.
+
+connection.execute_wrapper() covers one connection object, and connections
+are per thread. Under ASGI a request reaches the database from
+sync_to_async threads, whose connections the request's own thread never
+sees. Wrappers added with request_execute_wrapper() are kept in a context
+variable instead, which asyncio tasks and sync_to_async threads inherit,
+and dispatch(), installed on every connection when it opens, runs them.
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+current_wrappers = ContextVar('current_execute_wrappers', default=())
+
+
+def dispatch(execute, sql, params, many, context):
+    wrappers = current_wrappers.get()
+    # Nested like connection.execute_wrapper(): the first added runs outermost
+    for wrapper in reversed(wrappers):
+        execute = functools.partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_dispatch(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(dispatch)
+
+
+@contextmanager
+def request_execute_wrapper(wrapper):
+    """Run wrapper around every query of the current request, whichever thread runs it"""
+    token = current_wrappers.set(current_wrappers.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        current_wrappers.reset(token)
@@ -0,0 +1,155 @@
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RequestRouting:
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+        # Pin keys of credentials issued by the request, e.g. a new token
+        self.issued_keys = []
+
+
+# Routing state of the request being handled; reads outside a request use the primary
+current_routing = ContextVar('current_routing', default=None)
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads from read-only requests to a DATABASE_REPLICAS alias and
+    everything else to 'default'.
+
+    Reads go to a replica only inside a request that ReplicaRoutingMiddleware
+    allowed to use one; management commands, signals run outside requests
+    and unsafe methods read from the primary. The first write in a request
+    pins the rest of it to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None and routing.use_replica and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.use_replica = False
+            routing.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+def credentials_key(credentials):
+    return f'db:pin:auth:{hashlib.sha256(credentials.encode()).hexdigest()[:32]}'
+
+
+def pin_cache_keys(request):
+    """
+    Keys identifying the client: its credentials (token or session), or its
+    address when it sent none. Clients behind one proxy or NAT share an
+    address, so pinning by it would send all of them to the primary.
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if credentials:
+        return [credentials_key(credentials)]
+    return [f'db:pin:ip:{request.META.get("REMOTE_ADDR")}']
+
+
+def pin_issued_token(key):
+    """
+    Pin the client that will authenticate with the token ``key`` issued by
+    this request, so its first requests with it do not reach a replica
+    that has no copy of the token yet
+    """
+    routing = current_routing.get()
+    if routing is not None:
+        routing.issued_keys.append(credentials_key(f'Token {key}'))
+
+
+def written_pin_keys(request, response, routing):
+    """The keys to pin after a request that wrote: the client's, and those of credentials it was given"""
+    keys = pin_cache_keys(request) + routing.issued_keys
+    session = response.cookies.get(settings.SESSION_COOKIE_NAME)
+    if session is not None and session.value:
+        keys.append(credentials_key(session.value))
+    return keys
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let read-only requests read from replicas, with read-your-writes.
+
+    A request that writes marks its client (see pin_cache_keys()) in
+    REPLICA_PIN_CACHE for REPLICA_PIN_SECONDS, and that client's requests
+    read from the primary until the mark expires, by which time the
+    replicas are expected to have caught up. Tokens and sessions issued by
+    the request are marked too, so a client that just signed in is pinned
+    under its new credentials. The cache has to be shared by all workers for
+    the pin to follow a client between them; a system check enforces it.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        cache = caches[settings.REPLICA_PIN_CACHE]
+        keys = pin_cache_keys(request)
+        pinned = request.method not in SAFE_METHODS or bool(cache.get_many(keys))
+        routing = RequestRouting(use_replica=not pinned)
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+
+        if routing.wrote:
+            cache.set_many(
+                {key: True for key in written_pin_keys(request, response, routing)}, settings.REPLICA_PIN_SECONDS
+            )
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+
+        cache = caches[settings.REPLICA_PIN_CACHE]
+        keys = pin_cache_keys(request)
+        pinned = request.method not in SAFE_METHODS or bool(await cache.aget_many(keys))
+        # sync_to_async threads inherit the context, so the router sees this too
+        routing = RequestRouting(use_replica=not pinned)
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+
+        if routing.wrote:
+            await cache.aset_many(
+                {key: True for key in written_pin_keys(request, response, routing)}, settings.REPLICA_PIN_SECONDS
+            )
+        return response
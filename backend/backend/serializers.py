@@ -0,0 +1,32 @@
+"""
+Serializer base classes that report to PerformanceMiddleware.
+
+The time a sampled request spends in to_representation() is recorded as its
+'serialize' phase, which falls inside the 'view' phase. Only the outermost
+serializer is timed: nested serializers, list items and serializers called
+from a SerializerMethodField count towards the one that called them.
+"""
+import time
+
+from rest_framework import serializers
+
+from .middleware import current_profile
+
+
+class ProfiledSerializerMixin:
+    def to_representation(self, instance):
+        profile = current_profile.get()
+        if profile is None or profile.serializing:
+            return super().to_representation(instance)
+
+        profile.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.timings['serialize'] += time.perf_counter() - start
+            profile.serializing = False
+
+
+class ProfiledModelSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    pass
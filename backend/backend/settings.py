@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -28,18 +29,23 @@ INSTALLED_APPS = [
     'corsheaders',
 
     # installed apps 
+    'backend',
     'accounts',
     'cars',
     'roadtrips',
 ]
 
 MIDDLEWARE = [
+    'backend.metrics.MetricsMiddleware',
+    'backend.middleware.PerformanceMiddleware',
+    'backend.routers.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'backend.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,6 +81,50 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile: WAL (readers no longer block the writer), tuned
+# pragmas on every connection, persistent connections, write transactions
+# that take the lock at BEGIN, and busy statements retried with backoff (see
+# backend.sqlite). `python -m benchmarks.sqlite_concurrency` compares it with
+# the stock settings.
+SQLITE_PRODUCTION = not DEBUG
+SQLITE_PRODUCTION_DATABASE = {
+    'ENGINE': 'backend.sqlite',
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'timeout': 5,  # seconds SQLite itself waits for a lock
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': ';'.join([
+            'PRAGMA journal_mode=WAL',
+            'PRAGMA synchronous=NORMAL',
+            'PRAGMA mmap_size=268435456',  # 256 MiB
+            'PRAGMA cache_size=-65536',  # 64 MiB
+            'PRAGMA temp_store=MEMORY',
+        ]),
+        'busy_retries': 5,
+        'busy_backoff': 0.05,  # seconds, doubled on each retry
+    },
+}
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update(SQLITE_PRODUCTION_DATABASE)
+
+# Aliases that serve reads for read-only requests (see backend.routers)
+DATABASE_ROUTERS = ['backend.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = []
+# Must be shared by all workers once there are replicas (check backend.E001)
+REPLICA_PIN_CACHE = 'default'
+REPLICA_PIN_SECONDS = 5  # how long a client that wrote keeps reading from the primary
+
+# Local replica: a second SQLite file refreshed by `manage.py sync_replicas`
+SQLITE_REPLICA = False
+if SQLITE_REPLICA:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS = ['replica']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -117,6 +167,17 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Car photo uploads are verified in a thread pool before being stored
+CAR_PHOTO_VERIFY_WORKERS = 4
+CAR_PHOTO_MAX_DIMENSION = 8000
+
+# Perceptual-hash matching for photos reused across accounts
+CAR_PHOTO_DUPLICATE_DISTANCE = 6  # max differing bits out of 64
+CAR_PHOTO_HASH_INDEX_REBUILD = 600  # seconds
+# Refresh the index and check new photos in a thread per process rather than
+# in requests; tests turn it off and check them when the transaction commits
+CAR_PHOTO_HASH_INDEX_THREAD = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -128,7 +189,7 @@ AUTH_USER_MODEL = 'accounts.CustomUser'
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -144,8 +205,123 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # Token-bucket rates for accounts.throttling; the count is also the burst size
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '10/min',
+        'login_identity': '5/min',
+        'register': '10/hour',
+        'availability': '120/min',
+        'write': '30/min',
+        'telemetry': '120/min',
+    },
 }
 
+# Where throttle buckets live. The SQLite file is shared by all workers on a
+# host; a Redis backend only needs to implement consume().
+THROTTLE_BACKEND = {
+    'BACKEND': (
+        'accounts.throttling.LocalMemoryBucketBackend' if DEBUG
+        else 'accounts.throttling.SQLiteBucketBackend'
+    ),
+    'OPTIONS': {} if DEBUG else {'path': BASE_DIR / 'throttle.sqlite3'},
+}
+
+# Token -> user lookups are cached by CachedTokenAuthentication, but only when
+# this cache is shared by all workers; with a LocMemCache every request reads the token
+TOKEN_AUTH_CACHE = 'default'
+TOKEN_AUTH_CACHE_TTL = 60  # seconds
+
+# Per-request query/view timings (Server-Timing header and the
+# 'backend.performance' logger) for this fraction of requests. Test classes
+# set it with override_settings: 0, or 1.0 where they look at the timings.
+PERF_SAMPLE_RATE = 1.0 if DEBUG else 0.05
+PERF_N_PLUS_ONE_THRESHOLD = 5  # identical query shapes in one request before it is reported
+PERF_SERVER_TIMING = True
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # One JSON line per sampled request; warnings flag repeated queries
+        'backend.performance': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Prometheus /metrics. Each worker process writes its counters to METRICS_DIR
+# every METRICS_FLUSH_INTERVAL seconds and a scrape merges them; without a
+# directory only the scraped process is reported. The scraper authenticates
+# with "Authorization: Bearer <METRICS_TOKEN>"; without a token only staff
+# sessions can read the endpoint.
+METRICS_DIR = None if DEBUG else BASE_DIR / 'metrics'
+METRICS_FLUSH_INTERVAL = 15  # seconds
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+# Staff-triggered request profiling (X-Profile: 1 or ?_profile=1)
+PROFILER_ENABLED = True
+PROFILER_DIR = BASE_DIR / 'profiles'
+PROFILER_INTERVAL = 0.001  # seconds between stack samples
+PROFILER_MAX_SAMPLES = 20000
+PROFILER_MAX_QUERIES = 2000
+PROFILER_MAX_BYTES = 2 * 1024 * 1024  # per output file
+PROFILER_KEEP_FILES = 50
+
+# Catalog endpoint responses, keyed by the version in cars.CatalogVersion
+# (bumped whenever the catalog changes), so this cache need not be shared
+CATALOG_CACHE = 'default'
+CATALOG_CACHE_TTL = 300  # seconds
+
+# Bloom filters answering check-email / check-phone without the database
+AVAILABILITY_FILTER_ERROR_RATE = 0.01
+AVAILABILITY_FILTER_MIN_CAPACITY = 10000
+AVAILABILITY_FILTER_REFRESH = 5  # seconds between catch-up queries for new users
+AVAILABILITY_FILTER_REBUILD = 600  # seconds between full rebuilds
+# Build and refresh the filters in a thread per process rather than in the
+# request that finds them due; tests turn it off and refresh inline
+AVAILABILITY_FILTER_THREAD = True
+
+# Page counts of the list endpoints using CachedCountPageNumberPagination,
+# cached per user, endpoint and filters (backend.pagination)
+PAGINATION_COUNT_CACHE = 'default'
+PAGINATION_COUNT_CACHE_TTL = 30  # seconds
+
+# Admin changelists of larger tables take their count from database
+# statistics instead of COUNT(*) (backend.pagination)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000  # rows
+
+# Personal trip feeds (?feed=true): a trip with a larger audience gets one
+# entry shared by all its readers instead of one entry per user
+TRIP_FEED_FANOUT_LIMIT = 5000  # users
+
+# Places trip meeting points and destinations are located in (roadtrips.geo).
+# The shipped file covers Israel; add the regions served from a GeoNames dump
+# with e.g. `manage.py load_gazetteer cities15000.zip --countries US,CA`.
+TRIP_GAZETTEER_PATH = BASE_DIR / 'roadtrips' / 'data' / 'gazetteer.csv'
+TRIP_NEAR_DEFAULT_RADIUS_KM = 25
+TRIP_NEAR_MAX_RADIUS_KM = 300
+
+# Live convoy positions (roadtrips.telemetry). Each trip's fixes are buffered
+# in memory and stored as track segments once there are TELEMETRY_FLUSH_POINTS
+# of them or the oldest is TELEMETRY_FLUSH_SECONDS old; beyond
+# TELEMETRY_BUFFER_POINTS the oldest are dropped. A thread per process flushes
+# trips by age; tests that buffer fixes turn it off and sweep by hand.
+TELEMETRY_MAX_BATCH_POINTS = 1000
+TELEMETRY_MAX_FIX_AGE = 3600  # seconds; older fixes are rejected
+TELEMETRY_BUFFER_POINTS = 50000
+TELEMETRY_FLUSH_POINTS = 2000
+TELEMETRY_FLUSH_SECONDS = 30
+TELEMETRY_LIVE_SECONDS = 600  # how far back stored fixes count as a car's latest position
+TELEMETRY_FLUSH_THREAD = True
+
+# Suggested meeting points (roadtrips.meeting), cached per destination, set
+# of member positions and objective
+MEETING_POINTS_CACHE = 'default'
+MEETING_POINTS_CACHE_TTL = 600  # seconds
+MEETING_POINTS_DEFAULT_LIMIT = 5
+MEETING_POINTS_MAX_LIMIT = 50
+
 # CORS settings for frontend integration
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
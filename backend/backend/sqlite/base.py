@@ -0,0 +1,75 @@
+"""
+SQLite backend for running in production (ENGINE 'backend.sqlite').
+
+It is Django's SQLite backend with statements retried when the database is
+busy. SQLite already waits up to ``timeout`` seconds for a lock; after that
+a statement is retried ``busy_retries`` more times with jittered exponential
+backoff starting at ``busy_backoff`` seconds, instead of failing the request
+with "database is locked".
+
+Only statements that run outside a transaction, including the BEGIN that
+opens one, are retried; after a failure nothing of theirs has taken effect.
+A statement that fails inside a transaction is raised as usual, since the
+transaction as a whole may have to be retried. With transaction_mode
+IMMEDIATE, write transactions take the write lock at BEGIN, which makes BEGIN
+the place where they wait.
+"""
+import random
+import time
+
+from django.db.backends.sqlite3 import base
+
+from backend.metrics import DB_BUSY_RETRIES
+
+MAX_BACKOFF = 1.0  # seconds
+
+
+def is_busy_error(error):
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    retries = 0
+    backoff = 0.05
+    alias = None
+
+    def execute(self, query, params=None):
+        return self.retrying(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        # A generator of parameters cannot be replayed
+        if self.retries and not isinstance(param_list, (list, tuple)):
+            param_list = list(param_list)
+        return self.retrying(super().executemany, query, param_list)
+
+    def retrying(self, execute, query, params):
+        attempt = 0
+        while True:
+            try:
+                return execute(query, params)
+            except base.Database.OperationalError as error:
+                if attempt >= self.retries or not is_busy_error(error) or self.connection.in_transaction:
+                    if attempt:
+                        DB_BUSY_RETRIES.inc(database=self.alias, outcome='failed')
+                    raise
+            delay = min(self.backoff * 2 ** attempt, MAX_BACKOFF)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            attempt += 1
+            DB_BUSY_RETRIES.inc(database=self.alias, outcome='retried')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # The rest of OPTIONS is passed on to sqlite3.connect()
+        self.busy_retries = kwargs.pop('busy_retries', 0)
+        self.busy_backoff = kwargs.pop('busy_backoff', 0.05)
+        return kwargs
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.retries = self.busy_retries
+        cursor.backoff = self.busy_backoff
+        cursor.alias = self.alias
+        return cursor
@@ -0,0 +1,546 @@
+import json
+import sqlite3
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from collections import Counter as StackCounter
+from urllib.parse import parse_qs, urlparse
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, router
+from django.db.utils import load_backend
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+
+from accounts.models import CustomUser
+from cars.models import Car, CarPhoto, CarType
+from cars.serializers import CarTypeSerializer
+from roadtrips.models import RoadTrip, TripNotification
+from .checks import check_replica_pin_cache
+from .metrics import CACHE_REQUESTS, DB_BUSY_RETRIES, REQUEST_LATENCY, Counter, Histogram, registry
+from .middleware import PerformanceMiddleware, query_shape
+from .pagination import EstimatedCountPaginator
+from .profiling import ProfilerMiddleware, collapsed_stacks
+from .routers import ReplicaRoutingMiddleware, pin_issued_token
+
+
+@override_settings(PERF_SAMPLE_RATE=1.0, PERF_N_PLUS_ONE_THRESHOLD=3)
+class PerformanceMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(4):
+            CustomUser.objects.create(email=f'u{i}@example.com', name=f'User {i}', phone=f'+1555000000{i}')
+        CarType.objects.create(name='SUV')
+
+    def run_view(self, view):
+        request = RequestFactory().get('/trips/')
+        request.resolver_match = None
+        middleware = PerformanceMiddleware(lambda request: middleware.process_view(request, view, (), {}) or view(request))
+        with self.assertLogs('backend.performance') as logs:
+            response = middleware(request)
+        return response, logs.records[0], json.loads(logs.records[0].getMessage())
+
+    def test_reports_queries_and_phases(self):
+        def view(request):
+            return HttpResponse(json.dumps(CarTypeSerializer(CarType.objects.all(), many=True).data))
+
+        response, record, data = self.run_view(view)
+        self.assertEqual(record.levelname, 'INFO')
+        self.assertEqual(data['db_queries'], 1)
+        self.assertIn('serialize_ms', data)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="1 queries", serialize;dur=[\d.]+, view;dur=[\d.]+, total;dur=',
+        )
+
+    def test_times_view_serialize_and_render_of_drf_responses(self):
+        self.client.force_login(CustomUser.objects.get(email='u0@example.com'))
+        with self.assertLogs('backend.performance') as logs:
+            response = self.client.get(reverse('cars:car_types'))
+        data = json.loads(logs.records[0].getMessage())
+        self.assertEqual(data['view'], 'cars:car_types')
+        self.assertIn('view_ms', data)
+        self.assertIn('render_ms', data)
+        self.assertLessEqual(data['serialize_ms'], data['view_ms'])
+        self.assertRegex(response['Server-Timing'], r'serialize;dur=[\d.]+, view;dur=[\d.]+, render;dur=')
+
+    def test_flags_repeated_query_shapes_with_call_site(self):
+        def view(request):
+            for user_id in CustomUser.objects.values_list('id', flat=True):
+                CustomUser.objects.get(id=user_id)
+            return Response({})
+
+        response, record, data = self.run_view(view)
+        self.assertEqual(record.levelname, 'WARNING')
+        [repeated] = data['repeated_queries']
+        self.assertEqual(repeated['count'], 4)
+        self.assertRegex(repeated['call_site'], r'^backend/tests\.py:\d+ in view$')
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_pass_through(self):
+        response = PerformanceMiddleware(lambda request: HttpResponse())(RequestFactory().get('/'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_query_shape_collapses_in_lists(self):
+        self.assertEqual(
+            query_shape('SELECT 1 WHERE id IN (%s, %s, %s) AND x IN (%s)'),
+            'SELECT 1 WHERE id IN (...) AND x IN (...)',
+        )
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.requests = Counter('test_requests_total', 'Test counter', ['outcome'])
+        cls.sizes = Histogram('test_size', 'Test histogram', buckets=(1, 10))
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+
+    def series(self, metric, **labels):
+        return registry.snapshot().get(metric.name, {}).get(metric.key(labels)[1])
+
+    def test_exposition_format(self):
+        before = self.series(self.requests, outcome='ok') or 0
+        self.requests.inc(outcome='ok')
+        self.requests.inc(2, outcome='ok')
+        self.sizes.observe(0.5)
+        self.sizes.observe(5)
+        self.sizes.observe(50)
+
+        text = registry.exposition()
+        self.assertIn('# TYPE test_requests_total counter', text)
+        self.assertIn(f'test_requests_total{{outcome="ok"}} {before + 3}', text)
+        self.assertIn('test_size_bucket{le="1"} 1\ntest_size_bucket{le="10"} 2\ntest_size_bucket{le="+Inf"} 3', text)
+        self.assertIn('test_size_sum 55.5\ntest_size_count 3', text)
+
+    def test_merges_snapshots_of_other_processes(self):
+        label = self.requests.key({'outcome': 'remote'})[1]
+        with open(os.path.join(self.metrics_dir, f'metrics-{os.getppid()}.json'), 'w') as f:
+            json.dump({'test_requests_total': {label: 7}, 'retired_metric': {'[]': 1}}, f)
+
+        with override_settings(METRICS_DIR=self.metrics_dir):
+            text = registry.exposition()
+        self.assertIn('test_requests_total{outcome="remote"} 7', text)
+        self.assertNotIn('retired_metric', text)
+        self.assertTrue(os.path.exists(os.path.join(self.metrics_dir, f'metrics-{os.getpid()}.json')))
+
+    def test_drops_snapshots_of_exited_processes(self):
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        label = self.requests.key({'outcome': 'exited'})[1]
+        path = os.path.join(self.metrics_dir, f'metrics-{exited.pid}.json')
+        with open(path, 'w') as f:
+            json.dump({'test_requests_total': {label: 7}}, f)
+
+        with override_settings(METRICS_DIR=self.metrics_dir):
+            text = registry.exposition()
+        self.assertNotIn('outcome="exited"', text)
+        self.assertFalse(os.path.exists(path))
+
+    def test_concurrent_flushes_do_not_share_a_temporary_file(self):
+        with override_settings(METRICS_DIR=self.metrics_dir):
+            threads = [threading.Thread(target=lambda: [registry.flush() for _ in range(20)]) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(os.listdir(self.metrics_dir), [f'metrics-{os.getpid()}.json'])
+        with open(os.path.join(self.metrics_dir, f'metrics-{os.getpid()}.json')) as f:
+            self.assertIsInstance(json.load(f), dict)
+
+    def test_endpoint_records_routes_and_is_restricted(self):
+        self.client.get(reverse('cars:car_types'))
+        self.client.get(reverse('cars:car_types'))
+        latency = self.series(REQUEST_LATENCY, route='api/cars/types/', method='GET')
+        self.assertGreaterEqual(latency[-1], 2)
+        self.assertGreaterEqual(self.series(CACHE_REQUESTS, cache='catalog', result='hit'), 1)
+
+        with override_settings(METRICS_TOKEN='scrape-secret'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(
+                'http_request_duration_seconds_count{route="api/cars/types/",method="GET"}', response.content.decode()
+            )
+            # Being on the same host, e.g. behind a local reverse proxy, is not enough
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer guess').status_code, 403)
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+        staff = CustomUser.objects.create_user(email='metrics@example.com', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class ProfilerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create(email='staff@example.com', name='Staff', phone='+15550000009', is_staff=True)
+        cls.member = CustomUser.objects.create(email='member@example.com', name='Member', phone='+15550000010')
+        CarType.objects.create(name='SUV')
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        override = override_settings(PROFILER_DIR=self.profile_dir, PROFILER_KEEP_FILES=2)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get(self, user, **extra):
+        token, _ = Token.objects.get_or_create(user=user)
+        return self.client.get(reverse('accounts:profile'), HTTP_AUTHORIZATION=f'Token {token.key}', **extra)
+
+    def test_staff_request_writes_stacks_and_sql(self):
+        response = self.get(self.staff, HTTP_X_PROFILE='1')
+        profile_id = response['X-Profile-Id']
+
+        with open(os.path.join(self.profile_dir, f'{profile_id}.json')) as f:
+            summary = json.load(f)
+        self.assertEqual(summary['status'], 200)
+        self.assertEqual(summary['query_count'], len(summary['queries']))
+        self.assertTrue(summary['queries'])
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir, f'{profile_id}.folded')))
+
+    def test_only_staff_can_profile(self):
+        response = self.get(self.member, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_keeps_newest_profiles_only(self):
+        for _ in range(3):
+            self.get(self.staff, HTTP_X_PROFILE='1')
+        self.assertEqual(len([name for name in os.listdir(self.profile_dir) if name.endswith('.json')]), 2)
+
+    def test_overlapping_profiles_restore_the_switch_interval_once(self):
+        original = sys.getswitchinterval()
+        middleware = ProfilerMiddleware(lambda request: None)
+        first, second = middleware.start(), middleware.start()
+        self.assertEqual(sys.getswitchinterval(), min(original, settings.PROFILER_INTERVAL))
+        # The first to start finishes first; the other is still sampling
+        middleware.stop(first)
+        self.assertEqual(sys.getswitchinterval(), min(original, settings.PROFILER_INTERVAL))
+        middleware.stop(second)
+        self.assertEqual(sys.getswitchinterval(), original)
+
+    def test_collapsed_stacks_respect_size_cap(self):
+        stacks = {'main;handler;query': 30, 'main;handler': 5, 'main;other': 1}
+        output = collapsed_stacks(StackCounter(stacks), max_bytes=40)
+        self.assertEqual(output, 'main;handler;query 30\nmain;handler 5\n')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], PERF_SAMPLE_RATE=0)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def request(self, method='get', writes=False, ip='10.0.0.1', token=None):
+        """Run a request through the middleware and return the alias reads went to"""
+        used = []
+
+        def view(request):
+            if writes:
+                router.db_for_write(CustomUser)
+            used.append(router.db_for_read(CustomUser))
+            return HttpResponse()
+
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        request = getattr(RequestFactory(), method)('/', REMOTE_ADDR=ip, **headers)
+        ReplicaRoutingMiddleware(view)(request)
+        return used[0]
+
+    def test_reads_use_replica_and_writes_use_primary(self):
+        self.assertEqual(self.request(), 'replica')
+        self.assertEqual(self.request('post'), 'default')
+        self.assertEqual(router.db_for_write(CustomUser), 'default')
+
+    def test_outside_requests_read_from_primary(self):
+        self.assertEqual(router.db_for_read(CustomUser), 'default')
+
+    def test_client_that_wrote_is_pinned_to_primary(self):
+        self.assertEqual(self.request(writes=True), 'default')
+        self.assertEqual(self.request(), 'default')
+        self.assertEqual(self.request(ip='10.0.0.2'), 'replica')
+
+        cache.clear()  # the pin expired
+        self.assertEqual(self.request(), 'replica')
+
+    def test_clients_behind_one_address_are_pinned_by_credentials(self):
+        self.assertEqual(self.request(writes=True, ip='127.0.0.1', token='a'), 'default')
+        self.assertEqual(self.request(ip='127.0.0.1', token='a'), 'default')
+        # Other clients of the same proxy, signed in or not, still read from replicas
+        self.assertEqual(self.request(ip='127.0.0.1', token='b'), 'replica')
+        self.assertEqual(self.request(ip='127.0.0.1'), 'replica')
+
+    def test_issued_tokens_are_pinned(self):
+        def sign_in(request):
+            router.db_for_write(CustomUser)
+            pin_issued_token('new-token')
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(sign_in)(RequestFactory().post('/', REMOTE_ADDR='127.0.0.1'))
+        # The client's next request carries the token it was just given
+        self.assertEqual(self.request(ip='127.0.0.1', token='new-token'), 'default')
+
+    def test_replicas_need_a_shared_pin_cache(self):
+        # The test settings keep the default LocMemCache
+        [error] = check_replica_pin_cache(None)
+        self.assertEqual(error.id, 'backend.E001')
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(check_replica_pin_cache(None), [])
+
+    def test_sync_replicas_copies_primary(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        primary, replica = os.path.join(directory, 'primary.sqlite3'), os.path.join(directory, 'replica.sqlite3')
+        with sqlite3.connect(primary) as conn:
+            conn.execute('CREATE TABLE trips (title TEXT)')
+            conn.execute("INSERT INTO trips VALUES ('Eilat')")
+
+        call_command('sync_replicas', source=primary, targets=[replica], stdout=StringIO())
+        with sqlite3.connect(replica) as conn:
+            self.assertEqual(conn.execute('SELECT title FROM trips').fetchall(), [('Eilat',)])
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class SQLiteProductionTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'db.sqlite3')
+        with sqlite3.connect(self.path) as conn:
+            conn.execute('CREATE TABLE seats (trip INTEGER)')
+
+    def connect(self, **options):
+        database = {
+            **settings.SQLITE_PRODUCTION_DATABASE,
+            'NAME': self.path,
+            'OPTIONS': {**settings.SQLITE_PRODUCTION_DATABASE['OPTIONS'], **options},
+        }
+        database = connections.configure_settings({'default': database})['default']
+        wrapper = load_backend(database['ENGINE']).DatabaseWrapper(database, 'sqlite_test')
+        self.addCleanup(wrapper.close)
+        # The first connection switches the file to WAL, which needs the lock
+        wrapper.ensure_connection()
+        return wrapper
+
+    def lock(self, seconds=None):
+        """Hold the write lock from another connection, releasing it after ``seconds``"""
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute('BEGIN IMMEDIATE')
+        if seconds is None:
+            self.addCleanup(conn.close)
+        else:
+            timer = threading.Timer(seconds, conn.close)
+            timer.start()
+            self.addCleanup(timer.join)
+
+    def retries(self, outcome):
+        return registry.snapshot().get(DB_BUSY_RETRIES.name, {}).get(
+            DB_BUSY_RETRIES.key({'database': 'sqlite_test', 'outcome': outcome})[1], 0
+        )
+
+    def test_pragmas_applied_to_every_connection(self):
+        wrapper = self.connect()
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+    def test_busy_write_retried_until_lock_released(self):
+        wrapper = self.connect(timeout=0.01, busy_retries=10, busy_backoff=0.02)
+        before = self.retries('retried')
+        self.lock(seconds=0.2)
+        with wrapper.cursor() as cursor:
+            cursor.execute('INSERT INTO seats VALUES (%s)', [1])
+        self.assertGreater(self.retries('retried'), before)
+        with sqlite3.connect(self.path) as conn:
+            self.assertEqual(conn.execute('SELECT trip FROM seats').fetchall(), [(1,)])
+
+    def test_gives_up_after_retries(self):
+        wrapper = self.connect(timeout=0.01, busy_retries=2, busy_backoff=0.01)
+        before = self.retries('failed')
+        self.lock()
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            with wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO seats VALUES (%s)', [1])
+        self.assertEqual(self.retries('failed'), before + 1)
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class AsyncStackTests(TestCase):
+    def test_middleware_runs_natively_under_asgi(self):
+        # A single sync-only middleware would put every ASGI request on a thread
+        for path in settings.MIDDLEWARE:
+            with self.subTest(middleware=path):
+                self.assertTrue(getattr(import_string(path), 'async_capable', False))
+
+    @override_settings(PERF_SAMPLE_RATE=1.0)
+    def test_queries_from_async_views_are_measured(self):
+        cache.clear()
+        user = CustomUser.objects.create(email='async@example.com', name='Async', phone='+15550001111')
+        token = Token.objects.create(user=user)
+        with self.assertLogs('backend.performance'):
+            response = async_to_sync(self.async_client.get)(
+                reverse('roadtrips:async_unread_count'), headers={'Authorization': f'Token {token.key}'}
+            )
+        self.assertEqual(json.loads(response.content), {'unread_count': 0})
+        # The token lookup and the count run in sync_to_async threads
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_cars', stdout=StringIO())
+        call_command('generate_dataset', users=40, trips=15, seed=3, stdout=StringIO())
+        CarPhoto.objects.bulk_create([
+            CarPhoto(car=car, photo=f'car_photos/seed/{car.id}-{n}.png') for car in Car.objects.all() for n in range(2)
+        ])
+        cls.admin_user = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass12345', name='Admin', phone='+15559990000'
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def changelist_queries(self, model, per_page):
+        model_admin = admin.site._registry[model]
+        url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+        with mock.patch.object(model_admin, 'list_per_page', per_page):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_the_page(self):
+        for model in admin.site._registry:
+            if not model.objects.exists():
+                continue
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.changelist_queries(model, 1), self.changelist_queries(model, 20))
+
+    def test_participant_and_photo_counts_are_annotated(self):
+        trip = RoadTrip.objects.filter(participants__status='confirmed').distinct().first()
+        queryset = admin.site._registry[RoadTrip].get_queryset(RequestFactory().get('/'))
+        self.assertEqual(queryset.get(pk=trip.pk).confirmed_total, trip.participant_count)
+        self.assertEqual(admin.site._registry[Car].get_queryset(RequestFactory().get('/')).first().photos_total, 2)
+        self.assertEqual(self.client.get(reverse('admin:roadtrips_roadtrip_change', args=[trip.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('admin:roadtrips_roadtrip_add')).status_code, 200)
+
+    def test_large_unfiltered_changelists_use_the_estimated_count(self):
+        latest = Car.objects.order_by('-id').first()
+        Car.objects.filter(id__gt=latest.id - 5).exclude(id=latest.id).delete()
+        total = Car.objects.count()
+        paginator = EstimatedCountPaginator(Car.objects.order_by('id'), 10)
+        self.assertEqual(paginator.count, total)
+
+        with override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=10):
+            # The last rowid also counts the deleted rows
+            self.assertEqual(EstimatedCountPaginator(Car.objects.order_by('id'), 10).count, latest.id)
+            filtered = Car.objects.filter(id__lt=latest.id).order_by('id')
+            self.assertEqual(EstimatedCountPaginator(filtered, 10).count, total - 1)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('admin:cars_car_changelist'))
+            self.assertFalse([query for query in queries if 'COUNT(*)' in query['sql'].upper()])
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class ApiPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email='pager@example.com', password='pass12345', name='Pager', phone='+15550002222'
+        )
+        cls.trips = [
+            RoadTrip.objects.create(
+                title=f'Trip {i}', destination='Eilat', meeting_point='Tel Aviv', description='A drive.',
+                organizer=cls.user, departure_date=timezone.now() + timedelta(days=i + 1),
+                status='published' if i % 2 else 'draft',
+            )
+            for i in range(25)
+        ]
+        TripNotification.objects.all().delete()
+        TripNotification.objects.bulk_create([
+            TripNotification(recipient=cls.user, trip=cls.trips[0], notification_type='trip_updated',
+                             title=f'Update {i}', message='Details changed.')
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get(self, route, **params):
+        """The page, and how many times the listed table was counted"""
+        table = (RoadTrip if route == 'roadtrips:roadtrip-list' else TripNotification)._meta.db_table
+        with mock.patch('backend.pagination.CACHE_REQUESTS') as requests:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(route), params)
+        self.assertEqual(response.status_code, 200)
+        if route == 'roadtrips:roadtrip-list':
+            # The serializer counts trips too
+            return response.json(), requests.inc.call_args_list.count(mock.call(cache='page_count', result='miss'))
+        counts = [query for query in queries if query['sql'].startswith(f'SELECT COUNT(*) AS "__count" FROM "{table}"')]
+        return response.json(), len(counts)
+
+    def test_counts_are_cached_per_user_and_filters(self):
+        page, counts = self.get('roadtrips:roadtrip-list', status='published', organized='true')
+        self.assertEqual((page['count'], len(page['results']), counts), (12, 12, 1))
+
+        # Other pages, orderings and parameter orders share the count
+        page, counts = self.get('roadtrips:roadtrip-list', organized='true', status='published',
+                                ordering='departure_date')
+        self.assertEqual((page['count'], counts), (12, 0))
+        page, counts = self.get('roadtrips:roadtrip-list', page=2)
+        self.assertEqual((page['count'], len(page['results']), counts), (25, 5, 1))
+        self.assertEqual(self.get('roadtrips:roadtrip-list')[1], 0)
+
+        # The rows are read afresh; the count catches up when it expires
+        self.trips[0].delete()
+        page, counts = self.get('roadtrips:roadtrip-list')
+        self.assertEqual((page['count'], len(page['results']), page['next'] is not None, counts), (25, 20, True, 0))
+        cache.clear()
+        self.assertEqual(self.get('roadtrips:roadtrip-list')[0]['count'], 24)
+
+    def test_uncounted_pages_look_one_row_ahead(self):
+        page, counts = self.get('roadtrips:tripnotification-list')
+        self.assertEqual((page['count'], len(page['results']), page['previous'], counts), (None, 20, None, 0))
+        self.assertEqual(parse_qs(urlparse(page['next']).query), {'page': ['2']})
+
+        page, _ = self.get('roadtrips:tripnotification-list', page=2)
+        self.assertEqual((len(page['results']), page['next']), (5, None))
+        self.assertNotIn('page=', page['previous'])
+        self.assertEqual([row['title'] for row in page['results']],
+                         list(TripNotification.objects.values_list('title', flat=True)[20:]))
+
+        for number in (3, 0, 'last', 'two'):
+            with self.subTest(page=number):
+                response = self.client.get(reverse('roadtrips:tripnotification-list'), {'page': number})
+                self.assertEqual(response.status_code, 404)
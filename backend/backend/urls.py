@@ -2,9 +2,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from cars.storage import serve_media
+from . import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', views.metrics, name='metrics'),
     path('api/auth/', include('accounts.urls')),
     path('api/cars/', include('cars.urls')),
     path('api/roadtrips/', include('roadtrips.urls')),
@@ -12,4 +15,4 @@ urlpatterns = [
 
 # Serve media files during development
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
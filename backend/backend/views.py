@@ -0,0 +1,26 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .metrics import registry
+
+
+def has_metrics_token(request):
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(
+        settings.METRICS_TOKEN and scheme.lower() == 'bearer'
+        and hmac.compare_digest(token.strip().encode(), settings.METRICS_TOKEN.encode())
+    )
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint, merged over every worker process on this host.
+
+    Open to a bearer METRICS_TOKEN (the scraper) and to staff sessions.
+    """
+    user = getattr(request, 'user', None)
+    if not has_metrics_token(request) and not (user and user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,68 @@
+"""
+Reading budgets and writing/comparing query-budget reports.
+
+Usage: python -m benchmarks.report old.json new.json
+"""
+import json
+import platform
+import subprocess
+import sys
+from pathlib import Path
+
+import django
+
+BUDGETS_PATH = Path(__file__).resolve().parent / 'query_budgets.json'
+
+
+def load_budgets():
+    with open(BUDGETS_PATH) as f:
+        return json.load(f)
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(path, results):
+    report = {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'endpoints': dict(sorted(results.items())),
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+
+
+def compare(old, new):
+    """Return printable lines describing per-endpoint changes between two reports"""
+    lines = [f'{"endpoint":<60} {"queries":>13} {"sql ms":>17} {"wall ms":>17} {"bytes":>17}']
+    for name in sorted(set(old['endpoints']) | set(new['endpoints'])):
+        before, after = old['endpoints'].get(name), new['endpoints'].get(name)
+        if before is None or after is None:
+            lines.append(f'{name:<60} {"added" if before is None else "removed"}')
+            continue
+        cells = [
+            f'{before[key]:>6}->{after[key]:<6}'.rjust(width)
+            for key, width in (('queries', 13), ('sql_ms', 17), ('wall_ms', 17), ('response_bytes', 17))
+        ]
+        marker = ' !' if after['queries'] > before['queries'] else ''
+        lines.append(f'{name:<60} ' + ' '.join(cells) + marker)
+    return lines
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__.strip())
+    with open(sys.argv[1]) as f:
+        old = json.load(f)
+    with open(sys.argv[2]) as f:
+        new = json.load(f)
+    print(f'{old.get("commit")} -> {new.get("commit")}')
+    print('\n'.join(compare(old, new)))
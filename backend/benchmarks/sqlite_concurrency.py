@@ -0,0 +1,158 @@
+"""
+Concurrent read/write throughput of the stock SQLite settings against the
+production profile (settings.SQLITE_PRODUCTION_DATABASE).
+
+Writer threads run trip joins: a transaction reading the trip, taking a
+seat, adding the participant and fanning out notifications. Reader threads
+count participants and list a user's latest notifications. Each profile
+runs on its own scratch database in a temporary directory.
+
+Usage: python -m benchmarks.sqlite_concurrency [--seconds 5] [--writers 4] [--readers 8]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import OperationalError, connections, transaction  # noqa: E402
+
+TRIPS = 200
+USERS = 2000
+FANOUT = 10
+
+SCHEMA = [
+    'CREATE TABLE trip (id INTEGER PRIMARY KEY, seats_taken INTEGER NOT NULL)',
+    'CREATE TABLE participant (id INTEGER PRIMARY KEY, trip_id INTEGER NOT NULL, user_id INTEGER NOT NULL)',
+    'CREATE INDEX participant_trip ON participant (trip_id)',
+    'CREATE TABLE notification (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, body TEXT NOT NULL)',
+    'CREATE INDEX notification_user ON notification (user_id, id)',
+]
+
+
+def profiles(directory):
+    stock = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': directory / 'stock.sqlite3'}
+    production = {**settings.SQLITE_PRODUCTION_DATABASE, 'NAME': directory / 'production.sqlite3'}
+    return {'bench_stock': stock, 'bench_production': production}
+
+
+def register(alias, database):
+    # Same defaults as the aliases in settings.DATABASES get
+    connections.settings[alias] = connections.configure_settings({'default': database})['default']
+
+
+def create_schema(alias):
+    with connections[alias].cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        cursor.executemany('INSERT INTO trip (id, seats_taken) VALUES (%s, 0)', [(i,) for i in range(TRIPS)])
+    connections[alias].close()
+
+
+def join_trip(alias, rng):
+    trip_id = rng.randrange(TRIPS)
+    user_id = rng.randrange(USERS)
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        cursor.execute('SELECT seats_taken FROM trip WHERE id = %s', [trip_id])
+        cursor.fetchone()
+        cursor.execute('UPDATE trip SET seats_taken = seats_taken + 1 WHERE id = %s', [trip_id])
+        cursor.execute('INSERT INTO participant (trip_id, user_id) VALUES (%s, %s)', [trip_id, user_id])
+        cursor.executemany(
+            'INSERT INTO notification (user_id, body) VALUES (%s, %s)',
+            [(rng.randrange(USERS), f'User {user_id} joined trip {trip_id}') for _ in range(FANOUT)],
+        )
+
+
+def read_feed(alias, rng):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM participant WHERE trip_id = %s', [rng.randrange(TRIPS)])
+        cursor.fetchone()
+        cursor.execute(
+            'SELECT id, body FROM notification WHERE user_id = %s ORDER BY id DESC LIMIT 20',
+            [rng.randrange(USERS)],
+        )
+        cursor.fetchall()
+
+
+class Worker(threading.Thread):
+    def __init__(self, alias, operation, deadline, seed):
+        super().__init__()
+        self.alias = alias
+        self.operation = operation
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        try:
+            while time.monotonic() < self.deadline:
+                started = time.perf_counter()
+                try:
+                    self.operation(self.alias, self.rng)
+                except OperationalError:
+                    self.errors += 1
+                else:
+                    self.latencies.append(time.perf_counter() - started)
+        finally:
+            connections[self.alias].close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(alias, seconds, writers, readers):
+    deadline = time.monotonic() + seconds
+    workers = [Worker(alias, join_trip, deadline, i) for i in range(writers)]
+    workers += [Worker(alias, read_feed, deadline, writers + i) for i in range(readers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    results = {}
+    for kind, group in (('writes', workers[:writers]), ('reads', workers[writers:])):
+        latencies = [latency for worker in group for latency in worker.latencies]
+        results[kind] = {
+            'per_second': len(latencies) / seconds,
+            'errors': sum(worker.errors for worker in group),
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f'{args.writers} writers, {args.readers} readers, {args.seconds:g}s per profile')
+    print(f'{"profile":<18} {"kind":<7} {"ops/s":>9} {"locked":>7} {"p50 ms":>8} {"p99 ms":>8}')
+    with tempfile.TemporaryDirectory() as directory:
+        for alias, database in profiles(Path(directory)).items():
+            register(alias, database)
+            create_schema(alias)
+            for kind, result in run(alias, args.seconds, args.writers, args.readers).items():
+                print(
+                    f'{alias.removeprefix("bench_"):<18} {kind:<7} {result["per_second"]:>9.1f} '
+                    f'{result["errors"]:>7} {result["p50_ms"]:>8.2f} {result["p99_ms"]:>8.2f}'
+                )
+
+
+if __name__ == '__main__':
+    main()
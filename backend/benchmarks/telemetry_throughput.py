@@ -0,0 +1,106 @@
+"""
+Ingestion throughput of live convoy telemetry (roadtrips.telemetry).
+
+Cars of one trip send batches of GPS fixes to the telemetry endpoint, in
+turn, through the DRF view: request parsing, the membership check,
+validation and the in-memory buffer, with flushes to track segments as they
+come due. Runs on a scratch database in a temporary directory.
+
+Usage: python -m benchmarks.telemetry_throughput [--cars 50] [--batches 40] [--batch-size 50]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+
+from accounts.models import CustomUser  # noqa: E402
+from roadtrips import telemetry  # noqa: E402
+from roadtrips.models import RoadTrip, TrackSegment, TripParticipant  # noqa: E402
+from roadtrips.views import RoadTripViewSet  # noqa: E402
+
+
+def use_scratch_database(directory):
+    connections['default'].settings_dict['NAME'] = Path(directory) / 'telemetry.sqlite3'
+    call_command('migrate', verbosity=0)
+
+
+def create_convoy(cars):
+    organizer, *drivers = CustomUser.objects.bulk_create([
+        CustomUser(email=f'car{i}@bench.example.com', name=f'Car {i}', phone=f'+1777{i:07d}')
+        for i in range(cars)
+    ])
+    trip = RoadTrip.objects.create(
+        title='Telemetry benchmark', destination='Eilat', meeting_point='Central station, Tel Aviv',
+        description='Convoy sending positions.', organizer=organizer,
+        departure_date=timezone.now() + timedelta(days=3),
+    )
+    TripParticipant.objects.bulk_create([
+        TripParticipant(trip=trip, user=driver, status='confirmed') for driver in drivers
+    ])
+    return trip, [organizer, *drivers]
+
+
+def batches(users, count, size):
+    """(user, points) batches, cars in turn, each driving its own line a second per fix"""
+    start = int(time.time()) - count * size
+    for batch in range(count):
+        for n, user in enumerate(users):
+            yield user, [
+                [32.0 + n * 0.01 + i * 0.0001, 34.8 + i * 0.0001, start + i]
+                for i in range(batch * size, (batch + 1) * size)
+            ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cars', type=int, default=50)
+    parser.add_argument('--batches', type=int, default=40, help='Batches sent by each car')
+    parser.add_argument('--batch-size', type=int, default=50, help='Fixes per batch')
+    args = parser.parse_args()
+
+    # One car sends more batches than the production rate allows
+    settings.THROTTLE_BACKEND = {'BACKEND': 'accounts.throttling.LocalMemoryBucketBackend'}
+    settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['telemetry'] = '1000000/min'
+    with tempfile.TemporaryDirectory() as directory:
+        use_scratch_database(directory)
+        trip, users = create_convoy(args.cars)
+        view = RoadTripViewSet.as_view({'post': 'telemetry'})
+        factory = APIRequestFactory()
+        requests = []
+        for user, points in batches(users, args.batches, args.batch_size):
+            request = factory.post(f'/api/trips/{trip.id}/telemetry/', {'points': points}, format='json')
+            force_authenticate(request, user)
+            requests.append(request)
+
+        started = time.perf_counter()
+        for request in requests:
+            response = view(request, pk=trip.id)
+            assert response.status_code == 202, response.data
+        telemetry.buffer.flush()
+        elapsed = time.perf_counter() - started
+
+        points = len(requests) * args.batch_size
+        stored = sum(TrackSegment.objects.values_list('point_count', flat=True))
+        encoded = sum(len(text) for text in TrackSegment.objects.values_list('points', flat=True))
+        print(f'{args.cars} cars, {len(requests)} batches of {args.batch_size} fixes')
+        print(f'{points / elapsed:,.0f} fixes/s ({len(requests) / elapsed:,.0f} batches/s, {elapsed:.2f}s)')
+        print(f'{stored:,} fixes stored in {TrackSegment.objects.count():,} segments, '
+              f'{encoded / max(stored, 1):.1f} bytes per fix')
+        connections['default'].close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Query-budget suite for every API endpoint.
+
+Seeds a realistic dataset, calls each route in accounts, cars and roadtrips
+through DRF's test client, and records query count, SQL time, wall time and
+response size. The test fails when an endpoint runs more queries than its
+budget in query_budgets.json, which is how N+1 regressions in the nested
+serializers show up.
+
+Set QUERY_BUDGET_REPORT=path/to/report.json to write the measurements, and
+compare two reports with ``python -m benchmarks.report old.json new.json``.
+"""
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.availability import availability_index
+from accounts.models import CustomUser
+from cars.catalog import bump_catalog_version
+from cars.models import CarBrand, CarModel, CarType, Car, CarPhoto
+from roadtrips import feed, telemetry
+from roadtrips.models import RoadTrip, TripEligibility, TripMembership, TripParticipant
+from .report import load_budgets, write_report
+
+USERS = 40
+TRIPS = 15
+PARTICIPANTS_PER_TRIP = 6
+PASSWORD = 'Bench-pass-123!'
+
+
+def make_photo(name, color):
+    buffer = BytesIO()
+    Image.new('RGB', (32, 24), color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_cars', stdout=StringIO())
+        brands = list(CarBrand.objects.order_by('id'))
+        models = list(CarModel.objects.select_related('brand').prefetch_related('variants').order_by('id'))
+        car_types = list(CarType.objects.order_by('id'))
+
+        # One hash shared by every seeded user keeps setup fast
+        password = make_password(PASSWORD)
+        CustomUser.objects.bulk_create([
+            CustomUser(email=f'user{i}@bench.example.com', name=f'User {i}',
+                       phone=f'+1555{i:07d}', password=password)
+            for i in range(USERS)
+        ])
+        users = list(CustomUser.objects.order_by('id'))
+        Car.objects.bulk_create([
+            Car(user=user, brand=models[i % len(models)].brand, model=models[i % len(models)],
+                variant=models[i % len(models)].variants.all()[0], car_type=car_types[i % len(car_types)])
+            for i, user in enumerate(users)
+        ])
+        CarPhoto.objects.bulk_create([
+            CarPhoto(car=car, photo=f'car_photos/seed/{car.id}-{n}.png')
+            for car in Car.objects.all() for n in range(3)
+        ])
+
+        departure = timezone.now() + timedelta(days=10)
+        for i in range(TRIPS):
+            # Published trips fan out notifications through the post_save signal
+            trip = RoadTrip.objects.create(
+                title=f'Trip {i}', destination=f'Destination {i}', meeting_point=f'Meeting point {i}',
+                description='A long scenic drive with friends.', organizer=users[i % 5],
+                departure_date=departure + timedelta(days=i), estimated_distance='300 km',
+            )
+            eligibility = TripEligibility.objects.create(trip=trip, open_to_all=i % 3 == 0)
+            if i % 3 == 1:
+                eligibility.eligible_brands.set(brands[:3])
+            elif i % 3 == 2:
+                eligibility.eligible_types.set(car_types[:4])
+                eligibility.eligible_models.set(models[:5])
+            feed.publish(trip)
+            TripParticipant.objects.bulk_create([
+                TripParticipant(trip=trip, user=users[5 + (i + n) % (USERS - 5)], status='confirmed')
+                for n in range(PARTICIPANTS_PER_TRIP)
+            ])
+        # bulk_create() skips the signals that keep memberships
+        TripMembership.objects.rebuild(RoadTrip.objects.all())
+
+        cls.users = users
+        cls.organizer = users[0]
+        cls.member = users[10]
+        cls.brand = brands[0]
+        cls.model = models[0]
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        # Keep the availability filter from refreshing mid-run so counts are stable,
+        # leave request instrumentation and the telemetry flusher out of the
+        # measurements, and give token lookups the shared cache they are only
+        # cached in
+        override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            PERF_SAMPLE_RATE=0,
+            TELEMETRY_FLUSH_THREAD=False,
+            AVAILABILITY_FILTER_THREAD=False,
+            CAR_PHOTO_HASH_INDEX_THREAD=False,
+            AVAILABILITY_FILTER_REFRESH=3600,
+            AVAILABILITY_FILTER_REBUILD=3600,
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'shared': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': os.path.join(self.media_root, 'cache'),
+                },
+            },
+            TOKEN_AUTH_CACHE='shared',
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(availability_index.invalidate)
+        availability_index.rebuild()
+        cache.clear()
+        # Positions sent in one run must not show up in the next
+        patcher = mock.patch.object(telemetry, 'buffer', telemetry.TelemetryBuffer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.results = {}
+
+    def client_for(self, user):
+        client = APIClient()
+        token, created = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        # Warm the cached token lookup so budgets measure the steady state
+        client.get(reverse('accounts:profile'))
+        return client
+
+    def measure(self, route, method, url, client, data=None, format=None, expected=200, label=None):
+        name = f'{method.upper()} {route}' + (f' [{label}]' if label else '')
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data, format=format)
+            wall_time = time.perf_counter() - start
+        self.assertEqual(response.status_code, expected, f'{name}: {getattr(response, "data", "")}')
+        self.results[name] = {
+            'route': route,
+            'method': method.upper(),
+            'status': response.status_code,
+            'queries': len(queries),
+            'sql_ms': round(sum(float(q['time']) for q in queries.captured_queries) * 1000, 2),
+            'wall_ms': round(wall_time * 1000, 2),
+            'response_bytes': len(response.content),
+        }
+        return response
+
+    def run_scenario(self):
+        anonymous = APIClient()
+        organizer = self.client_for(self.organizer)
+        member = self.client_for(self.member)
+        trip = RoadTrip.objects.filter(organizer=self.organizer).order_by('id').first()
+        open_trip = RoadTrip.objects.filter(eligibility__open_to_all=True).exclude(
+            organizer=self.member
+        ).exclude(participants__user=self.member).order_by('id').first()
+        car = self.member.cars.first()
+        notification = self.member.trip_notifications.exclude(trip=trip).order_by('id').first()
+
+        # Catalog, measured cold: one read of the catalog version plus the build
+        bump_catalog_version()
+        self.measure('cars:brands', 'get', reverse('cars:brands'), anonymous)
+        self.measure('cars:brands_with_models', 'get', reverse('cars:brands_with_models'), anonymous)
+        self.measure('cars:models_for_brand', 'get', reverse('cars:models_for_brand', args=[self.brand.id]), anonymous)
+        self.measure('cars:variants_for_model', 'get', reverse('cars:variants_for_model', args=[self.model.id]), anonymous)
+        self.measure('cars:car_types', 'get', reverse('cars:car_types'), anonymous)
+        bump_catalog_version()  # the async views share the catalog cache; measure them cold too
+        self.measure('cars:async_brands', 'get', reverse('cars:async_brands'), anonymous)
+        self.measure('cars:async_brands_with_models', 'get', reverse('cars:async_brands_with_models'), anonymous)
+        self.measure('cars:async_models_for_brand', 'get',
+                     reverse('cars:async_models_for_brand', args=[self.brand.id]), anonymous)
+        self.measure('cars:async_variants_for_model', 'get',
+                     reverse('cars:async_variants_for_model', args=[self.model.id]), anonymous)
+        self.measure('cars:async_car_types', 'get', reverse('cars:async_car_types'), anonymous)
+
+        # Accounts
+        self.measure('accounts:check_email', 'get', reverse('accounts:check_email'), anonymous,
+                     {'email': self.member.email})
+        self.measure('accounts:check_phone', 'get', reverse('accounts:check_phone'), anonymous,
+                     {'phone': '+10000000000'})
+        self.measure('accounts:profile', 'get', reverse('accounts:profile'), member)
+        self.measure('accounts:profile_update', 'patch', reverse('accounts:profile_update'), member,
+                     {'name': 'Renamed Member'})
+        self.measure('accounts:login', 'post', reverse('accounts:login'), anonymous,
+                     {'email': self.organizer.email, 'password': PASSWORD})
+        variant = self.model.variants.first()
+        self.measure('accounts:register', 'post', reverse('accounts:register'), anonymous, {
+            'email': 'new@bench.example.com', 'name': 'New User', 'phone': '+19990000000',
+            'password': PASSWORD, 'password_confirm': PASSWORD,
+            'car_brand': self.brand.id, 'car_model': self.model.id, 'car_variant': variant.id,
+            'car_type': CarType.objects.first().id,
+            'photos': [make_photo('a.png', 'red'), make_photo('b.png', 'blue')],
+        }, format='multipart', expected=201)
+
+        # Cars
+        self.measure('cars:user_cars', 'get', reverse('cars:user_cars'), member)
+        self.measure('cars:car_detail', 'get', reverse('cars:car_detail', args=[car.id]), member)
+        self.measure('cars:update_car', 'patch', reverse('cars:update_car', args=[car.id]), member,
+                     {'car_type': CarType.objects.last().id})
+        self.measure('cars:add_car_photos', 'post', reverse('cars:add_car_photos', args=[car.id]), member,
+                     {'photos': [make_photo('c.png', 'green')]}, format='multipart', expected=201)
+        photo = car.photos.order_by('id').first()
+        self.measure('cars:delete_car_photo', 'delete',
+                     reverse('cars:delete_car_photo', args=[car.id, photo.id]), member)
+        self.measure('cars:register_car', 'post', reverse('cars:register_car'), member, {
+            'brand': self.brand.id, 'model': self.model.id,
+            'photos': [make_photo('d.png', 'yellow'), make_photo('e.png', 'white')],
+        }, format='multipart', expected=201)
+        spare_car = self.member.cars.order_by('-id').first()
+        self.measure('cars:delete_car', 'delete', reverse('cars:delete_car', args=[spare_car.id]), member)
+
+        # Trips
+        self.measure('roadtrips:roadtrip-list', 'get', reverse('roadtrips:roadtrip-list'), member)
+        self.measure('roadtrips:roadtrip-list', 'get', reverse('roadtrips:roadtrip-list'), member,
+                     {'my_trips': 'true'}, label='my_trips')
+        self.measure('roadtrips:roadtrip-list', 'get', reverse('roadtrips:roadtrip-list'), member,
+                     {'feed': 'true'}, label='feed')
+        self.measure('roadtrips:roadtrip-detail', 'get', reverse('roadtrips:roadtrip-detail', args=[trip.id]), member)
+        self.measure('roadtrips:async_trip_list', 'get', reverse('roadtrips:async_trip_list'), member)
+        self.measure('roadtrips:async_trip_list', 'get', reverse('roadtrips:async_trip_list'), member,
+                     {'feed': 'true'}, label='feed')
+        self.measure('roadtrips:async_trip_detail', 'get',
+                     reverse('roadtrips:async_trip_detail', args=[trip.id]), member)
+        self.measure('roadtrips:roadtrip-participants', 'get',
+                     reverse('roadtrips:roadtrip-participants', args=[trip.id]), member)
+        self.measure('roadtrips:roadtrip-join', 'post', reverse('roadtrips:roadtrip-join', args=[open_trip.id]),
+                     member, {}, expected=201)
+        self.measure('roadtrips:roadtrip-leave', 'post', reverse('roadtrips:roadtrip-leave', args=[open_trip.id]),
+                     member, {})
+        telemetry_url = reverse('roadtrips:roadtrip-telemetry', args=[trip.id])
+        started = int(time.time()) - 60
+        self.measure('roadtrips:roadtrip-telemetry', 'post', telemetry_url, organizer, {
+            'points': [[32.0853 + i * 0.0005, 34.7818 + i * 0.0002, started + i] for i in range(50)],
+        }, format='json', expected=202)
+        self.measure('roadtrips:roadtrip-telemetry', 'get', telemetry_url, organizer)
+        self.measure('roadtrips:roadtrip-track', 'get', reverse('roadtrips:roadtrip-track', args=[trip.id]), organizer)
+        participant = trip.participants.order_by('id').first()
+        self.measure('roadtrips:roadtrip-home-area', 'post', reverse('roadtrips:roadtrip-home-area', args=[trip.id]),
+                     self.client_for(participant.user), {'home_area': 'Haifa'})
+        self.measure('roadtrips:roadtrip-meeting-points', 'get',
+                     reverse('roadtrips:roadtrip-meeting-points', args=[trip.id]), organizer)
+        self.measure('roadtrips:roadtrip-update-participant-status', 'post',
+                     reverse('roadtrips:roadtrip-update-participant-status', args=[trip.id]), organizer,
+                     {'participant_id': participant.id, 'status': 'declined'})
+        self.measure('roadtrips:roadtrip-list', 'post', reverse('roadtrips:roadtrip-list'), organizer, {
+            'title': 'Benchmark Trip', 'destination': 'Somewhere far', 'meeting_point': 'Main square',
+            'description': 'Benchmark trip description.', 'max_participants': 10,
+            'departure_date': (timezone.now() + timedelta(days=20)).isoformat(),
+            'eligibility': {'open_to_all': True},
+        }, format='json', expected=201)
+        self.measure('roadtrips:roadtrip-detail', 'patch',
+                     reverse('roadtrips:roadtrip-detail', args=[trip.id]), organizer,
+                     {'description': 'Updated trip description.'}, format='json')
+        self.measure('roadtrips:roadtrip-detail', 'delete',
+                     reverse('roadtrips:roadtrip-detail', args=[trip.id]), organizer, expected=204)
+
+        # Notifications
+        self.measure('roadtrips:tripnotification-list', 'get', reverse('roadtrips:tripnotification-list'), member)
+        self.measure('roadtrips:tripnotification-detail', 'get',
+                     reverse('roadtrips:tripnotification-detail', args=[notification.id]), member)
+        self.measure('roadtrips:tripnotification-unread-count', 'get',
+                     reverse('roadtrips:tripnotification-unread-count'), member)
+        self.measure('roadtrips:async_notification_list', 'get', reverse('roadtrips:async_notification_list'), member)
+        self.measure('roadtrips:async_unread_count', 'get', reverse('roadtrips:async_unread_count'), member)
+        self.measure('roadtrips:tripnotification-mark-read', 'post',
+                     reverse('roadtrips:tripnotification-mark-read', args=[notification.id]), member)
+        self.measure('roadtrips:tripnotification-mark-all-read', 'post',
+                     reverse('roadtrips:tripnotification-mark-all-read'), member)
+
+        # Staff-only and session-ending endpoints last
+        self.organizer.is_staff = True
+        self.organizer.save()
+        organizer = self.client_for(self.organizer)
+        self.measure('accounts:availability_stats', 'get', reverse('accounts:availability_stats'), organizer)
+        self.measure('accounts:change_password', 'post', reverse('accounts:change_password'), member, {
+            'old_password': PASSWORD, 'new_password': 'Changed-pass-456!',
+            'new_password_confirm': 'Changed-pass-456!',
+        })
+        self.measure('accounts:logout', 'post', reverse('accounts:logout'), organizer)
+
+    def test_query_budgets(self):
+        self.run_scenario()
+
+        report_path = os.environ.get('QUERY_BUDGET_REPORT')
+        if report_path:
+            write_report(report_path, self.results)
+
+        budgets = load_budgets()
+        for name, result in self.results.items():
+            with self.subTest(endpoint=name):
+                self.assertIn(name, budgets, f'{name} has no committed query budget')
+                self.assertLessEqual(
+                    result['queries'], budgets[name],
+                    f'{name} ran {result["queries"]} queries, budget is {budgets[name]}'
+                )
+
+    def test_every_route_is_measured(self):
+        self.run_scenario()
+        measured = {result['route'] for result in self.results.values()}
+        resolver = get_resolver()
+        routes = set()
+        for namespace in ('accounts', 'cars', 'roadtrips'):
+            prefix, sub_resolver = resolver.namespace_dict[namespace]
+            for name in sub_resolver.reverse_dict:
+                if isinstance(name, str) and name != 'api-root':
+                    routes.add(f'{namespace}:{name}')
+        self.assertEqual(routes - measured, set())
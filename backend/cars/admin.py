@@ -1,4 +1,10 @@
 from django.contrib import admin
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+from backend.pagination import EstimatedCountMixin
 from .models import CarBrand, CarModel, CarVariant, CarType, Car, CarPhoto
 
 
@@ -23,6 +29,7 @@ class CarVariantAdmin(admin.ModelAdmin):
     list_filter = ['model__brand']
     search_fields = ['name', 'model__name', 'model__brand__name']
     ordering = ['model__brand__name', 'model__name', 'name']
+    list_select_related = ['model__brand']
     
     def get_brand(self, obj):
         return obj.model.brand.name
@@ -43,21 +50,60 @@ class CarPhotoInline(admin.TabularInline):
 
 
 @admin.register(Car)
-class CarAdmin(admin.ModelAdmin):
+class CarAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ['__str__', 'user', 'brand', 'model', 'variant', 'car_type', 'photo_count']
     list_filter = ['brand', 'car_type']
     search_fields = ['user__name', 'user__email', 'brand__name', 'model__name']
     inlines = [CarPhotoInline]
     ordering = ['-id']
+    # Car, CarModel and CarVariant names include their parents'
+    list_select_related = ['user', 'brand', 'model__brand', 'variant__model__brand', 'car_type']
+    
+    def get_queryset(self, request):
+        # Counted per row of the page only, rather than grouping the whole table
+        photos = CarPhoto.objects.filter(car=OuterRef('pk')).order_by().values('car').annotate(
+            count=Count('pk')
+        ).values('count')
+        return super().get_queryset(request).annotate(photos_total=Coalesce(Subquery(photos), 0))
     
     def photo_count(self, obj):
-        return obj.photos.count()
+        return obj.photos_total
     photo_count.short_description = 'Photos'
+    photo_count.admin_order_field = 'photos_total'
+
+
+class ReusedPhotoFilter(admin.SimpleListFilter):
+    """Photos that closely match a photo registered by another account, by their stored flag"""
+    title = 'reused across accounts'
+    parameter_name = 'reused'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Yes')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(reused=True)
+        return queryset
 
 
 @admin.register(CarPhoto)
-class CarPhotoAdmin(admin.ModelAdmin):
+class CarPhotoAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ['id', 'car', 'uploaded_at']
-    list_filter = ['uploaded_at', 'car__brand']
-    search_fields = ['car__user__name', 'car__brand__name']
+    list_filter = [ReusedPhotoFilter, 'uploaded_at', 'car__brand']
+    search_fields = ['car__user__name', 'car__brand__name', 'perceptual_hash']
+    readonly_fields = ['perceptual_hash', 'near_duplicates']
     ordering = ['-uploaded_at']
+    list_select_related = ['car__brand', 'car__model__brand']
+
+    def near_duplicates(self, obj):
+        matches = obj.near_duplicates() if obj.perceptual_hash else []
+        if not matches:
+            return '-'
+        return format_html_join(
+            mark_safe('<br>'), '<a href="{}">Photo {}</a> ({})',
+            (
+                (reverse('admin:cars_carphoto_change', args=[match.id]), match.id, match.car.user.email)
+                for match in matches
+            )
+        )
+    near_duplicates.short_description = 'Near duplicates on other accounts'
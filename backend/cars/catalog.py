@@ -0,0 +1,294 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from backend.metrics import CACHE_REQUESTS
+
+from .models import CarBrand, CarModel, CarVariant, CarType, CatalogVersion
+
+# Catalog models in dependency order, with the field pointing at their parent
+CATALOG_LEVELS = [
+    (CarType, None),
+    (CarBrand, None),
+    (CarModel, 'brand'),
+    (CarVariant, 'model'),
+]
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def catalog_cache():
+    return caches[settings.CATALOG_CACHE]
+
+
+def bump_catalog_version():
+    """
+    Start a new catalog version, orphaning every cached catalog response.
+
+    The version lives in the database rather than the cache so that a bump
+    from import_catalog or seed_cars, which run in their own process, reaches
+    every web worker even when CATALOG_CACHE is per-process.
+    """
+    version = time.time_ns()
+    CatalogVersion.objects.update_or_create(pk=1, defaults={'version': version})
+    return version
+
+
+def catalog_version():
+    version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+    return bump_catalog_version() if version is None else version
+
+
+def cached_catalog(name, build):
+    """
+    Return build() for a catalog endpoint, cached until the catalog changes.
+
+    A hit costs one primary-key read of the catalog version; entries also
+    expire after CATALOG_CACHE_TTL seconds so old versions don't pile up.
+    """
+    cache = catalog_cache()
+    key = f'cars:catalog:{catalog_version()}:{name}'
+    data = cache.get(key)
+    if data is None:
+        CACHE_REQUESTS.inc(cache='catalog', result='miss')
+        data = build()
+        cache.set(key, data, settings.CATALOG_CACHE_TTL)
+    else:
+        CACHE_REQUESTS.inc(cache='catalog', result='hit')
+    return data
+
+
+async def acatalog_version():
+    version = await CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).afirst()
+    if version is None:
+        version = time.time_ns()
+        await CatalogVersion.objects.aupdate_or_create(pk=1, defaults={'version': version})
+    return version
+
+
+async def acached_catalog(name, build):
+    """cached_catalog() for async views; build is a coroutine function"""
+    cache = catalog_cache()
+    key = f'cars:catalog:{await acatalog_version()}:{name}'
+    data = await cache.aget(key)
+    if data is None:
+        CACHE_REQUESTS.inc(cache='catalog', result='miss')
+        data = await build()
+        await cache.aset(key, data, settings.CATALOG_CACHE_TTL)
+    else:
+        CACHE_REQUESTS.inc(cache='catalog', result='hit')
+    return data
+
+
+# -------------------------
+# Reading catalog files
+# -------------------------
+
+def rows_from_tree(tree):
+    """
+    Flatten {"types": [...], "brands": {brand: {model: [variant, ...]}}}
+    into catalog rows.
+    """
+    rows = [{'type': name} for name in tree.get('types', [])]
+    for brand, models in tree.get('brands', {}).items():
+        rows.append({'brand': brand})
+        for model, variants in models.items():
+            rows.append({'brand': brand, 'model': model})
+            rows.extend({'brand': brand, 'model': model, 'variant': variant} for variant in variants)
+    return rows
+
+
+def read_catalog(path, file_format=None):
+    """
+    Read catalog rows from a JSON, JSONL or CSV file.
+
+    Each row names a type, or a brand with optionally a model and variant,
+    and may carry the existing row's id (type_id, brand_id, model_id,
+    variant_id) so that a changed name is applied as a rename. JSON files
+    may also hold the nested tree accepted by rows_from_tree().
+    """
+    path = Path(path)
+    file_format = (file_format or path.suffix.lstrip('.')).lower()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'json':
+            data = json.load(f)
+            return rows_from_tree(data) if isinstance(data, dict) else data
+        if file_format in ('jsonl', 'ndjson'):
+            return [json.loads(line) for line in f if line.strip()]
+        if file_format == 'csv':
+            return list(csv.DictReader(f))
+    raise CatalogError(f'Unsupported catalog format "{file_format}"; use json, jsonl or csv.')
+
+
+def _clean_row(number, row):
+    cleaned = {}
+    for level in ('type', 'brand', 'model', 'variant'):
+        name = (row.get(level) or '').strip()
+        raw_id = row.get(f'{level}_id')
+        try:
+            cleaned[level] = (name, int(raw_id) if raw_id not in (None, '') else None)
+        except (TypeError, ValueError):
+            raise CatalogError(f'Row {number}: {level}_id "{raw_id}" is not an integer.')
+    if cleaned['variant'][0] and not cleaned['model'][0]:
+        raise CatalogError(f'Row {number}: a variant needs a model.')
+    if cleaned['model'][0] and not cleaned['brand'][0]:
+        raise CatalogError(f'Row {number}: a model needs a brand.')
+    if not cleaned['type'][0] and not cleaned['brand'][0]:
+        raise CatalogError(f'Row {number}: expected a type or a brand.')
+    return cleaned
+
+
+def _add_node(number, nodes, level, name, row_id):
+    node = nodes.setdefault(name, {'id': None, 'children': {}})
+    if row_id is not None:
+        if node['id'] not in (None, row_id):
+            raise CatalogError(f'Row {number}: {level} "{name}" has two different ids.')
+        node['id'] = row_id
+    return node
+
+
+def build_catalog_tree(rows):
+    """Group rows into nested {name: {'id', 'children'}} nodes, one tree for types and one for brands"""
+    types, brands = {}, {}
+    for number, row in enumerate(rows, 1):
+        cleaned = _clean_row(number, row)
+        if cleaned['type'][0]:
+            _add_node(number, types, 'type', *cleaned['type'])
+        nodes = brands
+        for level in ('brand', 'model', 'variant'):
+            name, row_id = cleaned[level]
+            if not name:
+                break
+            nodes = _add_node(number, nodes, level, name, row_id)['children']
+    return types, brands
+
+
+# -------------------------
+# Diffing and applying
+# -------------------------
+
+class CatalogDiff:
+    """Rows to create, rename (or move) and delete, per catalog model"""
+
+    def __init__(self):
+        self.created = {model: [] for model, _ in CATALOG_LEVELS}
+        self.changed = {model: [] for model, _ in CATALOG_LEVELS}
+        self.deleted = {model: [] for model, _ in CATALOG_LEVELS}
+
+    def is_empty(self):
+        return not any(
+            rows for changes in (self.created, self.changed, self.deleted) for rows in changes.values()
+        )
+
+    def summary(self):
+        lines = []
+        for model, _ in CATALOG_LEVELS:
+            label = model._meta.verbose_name_plural
+            lines.append(
+                f'{label}: {len(self.created[model])} added, '
+                f'{len(self.changed[model])} renamed, {len(self.deleted[model])} deleted'
+            )
+            lines.extend(f'  + {obj.name}' for obj in self.created[model])
+            lines.extend(f'  ~ {old} -> {obj.name}' for obj, old in self.changed[model])
+            lines.extend(f'  - {obj.name}' for obj in self.deleted[model])
+        return lines
+
+
+def _diff_level(diff, model, parent_field, nodes, parent, existing, matched):
+    """Match desired nodes under one parent to existing rows, yielding (node, instance) pairs"""
+    by_id, by_parent_name = existing
+    parent_id = getattr(parent, 'pk', None)
+    for name, node in nodes.items():
+        if node['id'] is not None:
+            obj = by_id.get(node['id'])
+            if obj is None:
+                raise CatalogError(f'{model.__name__} id {node["id"]} does not exist.')
+        else:
+            obj = by_parent_name.get((parent_id, name)) if parent is None or parent_id else None
+
+        if obj is None:
+            obj = model(name=name, **({parent_field: parent} if parent_field else {}))
+            diff.created[model].append(obj)
+        else:
+            if obj.pk in matched:
+                raise CatalogError(f'{model.__name__} "{obj.name}" is matched by more than one row.')
+            moved = parent_field and getattr(obj, f'{parent_field}_id') != parent_id
+            if obj.name != name or moved:
+                diff.changed[model].append((obj, obj.name))
+                obj.name = name
+                if moved:
+                    setattr(obj, parent_field, parent)
+        matched.add(obj.pk)
+        yield node, obj
+
+
+def diff_catalog(rows, delete_missing=True):
+    """Compare catalog rows with the database in memory, using one query per catalog model"""
+    types, brands = build_catalog_tree(rows)
+    diff = CatalogDiff()
+
+    existing, matched = {}, {}
+    for model, parent_field in CATALOG_LEVELS:
+        objs = list(model.objects.all())
+        existing[model] = (
+            {obj.pk: obj for obj in objs},
+            {(getattr(obj, f'{parent_field}_id') if parent_field else None, obj.name): obj for obj in objs},
+        )
+        matched[model] = set()
+
+    def walk(level, nodes, parent):
+        model, parent_field = CATALOG_LEVELS[level]
+        pairs = list(_diff_level(diff, model, parent_field, nodes, parent, existing[model], matched[model]))
+        if level + 1 < len(CATALOG_LEVELS) and CATALOG_LEVELS[level + 1][1]:
+            for node, obj in pairs:
+                walk(level + 1, node['children'], obj)
+
+    walk(0, types, None)
+    walk(1, brands, None)
+
+    if delete_missing:
+        for model, _ in CATALOG_LEVELS:
+            by_id = existing[model][0]
+            diff.deleted[model] = [obj for pk, obj in by_id.items() if pk not in matched[model]]
+    return diff
+
+
+def apply_catalog_diff(diff):
+    """
+    Apply a diff in one transaction. Renames run before deletes so a model
+    moved off a deleted brand survives the cascade; inserts run last, parents
+    before children.
+    """
+    def fields(parent_field):
+        return ['name', parent_field] if parent_field else ['name']
+
+    with transaction.atomic():
+        waiting = {}
+        for model, parent_field in CATALOG_LEVELS:
+            ready = []
+            for obj, _ in diff.changed[model]:
+                # Rows moved under a new parent wait until that parent is inserted
+                if parent_field and getattr(obj, f'{parent_field}_id') is None:
+                    waiting.setdefault(model, []).append(obj)
+                else:
+                    ready.append(obj)
+            if ready:
+                model.objects.bulk_update(ready, fields(parent_field), batch_size=500)
+        for model, _ in reversed(CATALOG_LEVELS):
+            if diff.deleted[model]:
+                model.objects.filter(pk__in=[obj.pk for obj in diff.deleted[model]]).delete()
+        for model, parent_field in CATALOG_LEVELS:
+            if diff.created[model]:
+                # Parents were inserted first, so their new primary keys are already set
+                model.objects.bulk_create(diff.created[model], batch_size=500)
+            if model in waiting:
+                model.objects.bulk_update(waiting[model], fields(parent_field), batch_size=500)
+        if not diff.is_empty():
+            transaction.on_commit(bump_catalog_version)
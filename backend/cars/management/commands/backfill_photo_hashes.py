@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from cars.models import CarPhoto
+from cars.phash import dhash_file, photo_hash_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute perceptual hashes for car photos that do not have one, refresh '
+        'the reused flags and report reused photos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Number of photos hashed per bulk update')
+        parser.add_argument('--no-report', action='store_true',
+                            help='Skip refreshing the reused flags and listing photos reused across accounts')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        hashed = failed = 0
+        last_id = 0
+
+        while True:
+            batch = list(
+                CarPhoto.objects.filter(id__gt=last_id, perceptual_hash='').select_related('car').order_by('id')[
+                    :batch_size
+                ]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            updated = []
+            for car_photo in batch:
+                try:
+                    with car_photo.photo.open('rb') as file:
+                        car_photo.perceptual_hash = dhash_file(file)
+                except (OSError, SyntaxError, ValueError) as e:
+                    failed += 1
+                    self.stderr.write(f'Could not hash photo {car_photo.id} ({car_photo.photo.name}): {e}')
+                    continue
+                updated.append(car_photo)
+            CarPhoto.objects.bulk_update(updated, ['perceptual_hash'])
+            photo_hash_index.mark_reused(
+                (car_photo.id, car_photo.perceptual_hash, car_photo.car.user_id) for car_photo in updated
+            )
+            hashed += len(updated)
+            self.stdout.write(f'Hashed {hashed} photos...')
+
+        self.stdout.write(self.style.SUCCESS(f'Hashed {hashed} photos, {failed} failed.'))
+
+        if options['no_report']:
+            return
+
+        # Also clears the flags of photos whose counterparts were deleted since
+        total = photo_hash_index.sync_reused(batch_size)
+        reused = CarPhoto.objects.filter(reused=True).select_related('car__user').order_by('perceptual_hash')
+        for car_photo in reused.iterator(chunk_size=2000):
+            self.stdout.write(
+                f'Photo {car_photo.id} ({car_photo.car.user.email}) hash {car_photo.perceptual_hash}'
+            )
+        self.stdout.write(f'{total} photos are shared with another account.')
@@ -0,0 +1,79 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from cars.models import CarPhoto
+from cars.storage import hash_from_name
+
+
+class Command(BaseCommand):
+    help = 'Delete car photo blobs that are no longer referenced by any CarPhoto row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of blobs checked per reference query')
+        parser.add_argument('--grace-seconds', type=int, default=3600,
+                            help='Skip blobs written or re-used more recently than this')
+        parser.add_argument('--include-legacy', action='store_true',
+                            help='Also reclaim unreferenced files stored under their upload names')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted without deleting anything')
+
+    def handle(self, *args, **options):
+        storage = CarPhoto._meta.get_field('photo').storage
+        upload_to = CarPhoto._meta.get_field('photo').upload_to.strip('/')
+        root = storage.path(upload_to)
+        cutoff = time.time() - options['grace_seconds']
+
+        scanned = deleted = reclaimed_bytes = 0
+        batch = []
+        for name in self._iter_blobs(storage, root):
+            if not options['include_legacy'] and not hash_from_name(name):
+                continue
+            scanned += 1
+            batch.append(name)
+            if len(batch) >= options['batch_size']:
+                d, b = self._collect(storage, batch, cutoff, options['dry_run'])
+                deleted += d
+                reclaimed_bytes += b
+                batch = []
+        if batch:
+            d, b = self._collect(storage, batch, cutoff, options['dry_run'])
+            deleted += d
+            reclaimed_bytes += b
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Scanned {scanned} blobs. {verb} {deleted} unreferenced blobs '
+                f'({reclaimed_bytes / (1024 * 1024):.1f} MB).'
+            )
+        )
+
+    def _iter_blobs(self, storage, root):
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                yield os.path.relpath(full_path, storage.location).replace('\\', '/')
+
+    def _collect(self, storage, names, cutoff, dry_run):
+        """Delete the unreferenced, out-of-grace blobs from one batch"""
+        referenced = set(
+            CarPhoto.objects.filter(photo__in=names).values_list('photo', flat=True)
+        )
+        deleted = reclaimed_bytes = 0
+        for name in names:
+            if name in referenced:
+                continue
+            full_path = storage.path(name)
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                storage.delete(name)
+            deleted += 1
+            reclaimed_bytes += stat.st_size
+        return deleted, reclaimed_bytes
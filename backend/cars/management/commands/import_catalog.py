@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from cars.catalog import apply_catalog_diff, diff_catalog, read_catalog
+
+
+class Command(BaseCommand):
+    help = 'Sync the car catalog (types, brands, models, variants) with a JSON, JSONL or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file')
+        parser.add_argument('--format', choices=['json', 'jsonl', 'csv'],
+                            help='File format (default: from the file extension)')
+        parser.add_argument('--keep-missing', action='store_true',
+                            help='Do not delete catalog rows that are missing from the file')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the diff without changing anything')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            rows = read_catalog(options['path'], options['format'])
+            diff = diff_catalog(rows, delete_missing=not options['keep_missing'])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        self.stdout.write('\n'.join(diff.summary()))
+        if diff.is_empty():
+            self.stdout.write(self.style.SUCCESS('Catalog is already up to date'))
+            return
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run: nothing was changed'))
+            return
+
+        try:
+            apply_catalog_diff(diff)
+        except IntegrityError as e:
+            raise CommandError(f'Catalog rolled back: {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {len(rows)} rows in {time.perf_counter() - started:.2f}s'
+        ))
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from cars.catalog import apply_catalog_diff, diff_catalog, rows_from_tree
 from cars.models import CarBrand, CarModel, CarVariant, CarType
 
 
@@ -78,53 +79,20 @@ class Command(BaseCommand):
             'Hybrid'
         ]
 
-        # Create car types
-        self.stdout.write('Creating car types...')
-        for car_type_name in car_types:
-            car_type, created = CarType.objects.get_or_create(name=car_type_name)
-            if created:
-                self.stdout.write(f'Created car type: {car_type_name}')
-
-        # Create brands, models, and variants
-        brands_created = 0
-        models_created = 0
-        variants_created = 0
-
-        for brand_name, models_dict in car_database.items():
-            # Create or get brand
-            brand, brand_created = CarBrand.objects.get_or_create(name=brand_name)
-            if brand_created:
-                brands_created += 1
-                self.stdout.write(f'Created brand: {brand_name}')
-
-            for model_name, variants_list in models_dict.items():
-                # Create or get model
-                model, model_created = CarModel.objects.get_or_create(
-                    brand=brand,
-                    name=model_name
-                )
-                if model_created:
-                    models_created += 1
-                    self.stdout.write(f'Created model: {brand_name} {model_name}')
-
-                for variant_name in variants_list:
-                    # Create or get variant
-                    variant, variant_created = CarVariant.objects.get_or_create(
-                        model=model,
-                        name=variant_name
-                    )
-                    if variant_created:
-                        variants_created += 1
-                        self.stdout.write(f'Created variant: {brand_name} {model_name} {variant_name}')
+        diff = diff_catalog(
+            rows_from_tree({'types': car_types, 'brands': car_database}), delete_missing=False
+        )
+        apply_catalog_diff(diff)
 
         # Summary
         self.stdout.write(
             self.style.SUCCESS(
                 f'\nSuccessfully seeded car database!\n'
-                f'Created: {brands_created} brands, {models_created} models, {variants_created} variants\n'
+                f'Created: {len(diff.created[CarBrand])} brands, {len(diff.created[CarModel])} models, '
+                f'{len(diff.created[CarVariant])} variants, {len(diff.created[CarType])} car types\n'
                 f'Total car types: {CarType.objects.count()}\n'
                 f'Total brands: {CarBrand.objects.count()}\n'
                 f'Total models: {CarModel.objects.count()}\n'
                 f'Total variants: {CarVariant.objects.count()}'
             )
-        )
\ No newline at end of file
+        )
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:45
+
+import cars.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='carphoto',
+            name='photo',
+            field=models.ImageField(db_index=True, storage=cars.storage.car_photo_storage, upload_to='car_photos/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0002_carphoto_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carphoto',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0003_carphoto_perceptual_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='car',
+            name='brand',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cars.carbrand'),
+        ),
+        migrations.AlterField(
+            model_name='car',
+            name='car_type',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cars.cartype'),
+        ),
+        migrations.AlterField(
+            model_name='car',
+            name='model',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cars.carmodel'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['brand', 'user'], name='cars_car_brand_i_3689bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['model', 'user'], name='cars_car_model_i_405b9c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['car_type', 'user'], name='cars_car_car_typ_4e8ce6_idx'),
+        ),
+    ]
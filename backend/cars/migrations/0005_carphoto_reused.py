@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0004_car_owner_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carphoto',
+            name='reused',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from accounts.models import CustomUser
+from .storage import car_photo_storage
 
 # Models 
 class CarBrand(models.Model):
@@ -38,15 +39,30 @@ class CarType(models.Model):
         return self.name
 
 
+class CatalogVersion(models.Model):
+    """Single row naming the current catalog version, read by every worker and command"""
+    version = models.BigIntegerField()
+
+
 # -------------------------
 # Car registered by user
 # -------------------------
 class Car(models.Model):
     user = models.ForeignKey(CustomUser, related_name="cars", on_delete=models.CASCADE)
-    brand = models.ForeignKey(CarBrand, on_delete=models.SET_NULL, null=True)
-    model = models.ForeignKey(CarModel, on_delete=models.SET_NULL, null=True, blank=True)
+    # brand, model and car_type are indexed together with user in Meta.indexes
+    brand = models.ForeignKey(CarBrand, on_delete=models.SET_NULL, null=True, db_index=False)
+    model = models.ForeignKey(CarModel, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
     variant = models.ForeignKey(CarVariant, on_delete=models.SET_NULL, null=True, blank=True)
-    car_type = models.ForeignKey(CarType, on_delete=models.SET_NULL, null=True, blank=True)
+    car_type = models.ForeignKey(CarType, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+
+    class Meta:
+        indexes = [
+            # New-trip fan-out looks up the owners of cars by brand, model or
+            # type; with user in the index the car rows are never read
+            models.Index(fields=["brand", "user"]),
+            models.Index(fields=["model", "user"]),
+            models.Index(fields=["car_type", "user"]),
+        ]
 
     def __str__(self):
         return f"{self.brand} {self.model or ''}".strip()
@@ -54,8 +70,30 @@ class Car(models.Model):
 
 class CarPhoto(models.Model):
     car = models.ForeignKey(Car, related_name="photos", on_delete=models.CASCADE)
-    photo = models.ImageField(upload_to="car_photos/")
+    # Stored by content hash, so identical uploads share one blob
+    photo = models.ImageField(upload_to="car_photos/", storage=car_photo_storage, db_index=True)
+    # 64-bit difference hash as hex, used to spot the same photo on other accounts
+    perceptual_hash = models.CharField(max_length=16, blank=True, db_index=True)
+    # Set when a near duplicate is uploaded to another account; cleared of
+    # deleted counterparts by backfill_photo_hashes
+    reused = models.BooleanField(default=False, db_index=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Photo for {self.car}"
\ No newline at end of file
+        return f"Photo for {self.car}"
+
+    @property
+    def reference_count(self):
+        """Number of CarPhoto rows sharing this photo's stored blob"""
+        return CarPhoto.objects.filter(photo=self.photo.name).count()
+
+    def near_duplicates(self, max_distance=None):
+        """Photos on other accounts that look like this one"""
+        from .phash import photo_hash_index
+
+        matches = photo_hash_index.near_duplicates(
+            self.perceptual_hash, max_distance, exclude_user_id=self.car.user_id
+        )
+        return CarPhoto.objects.filter(
+            id__in=[photo_id for distance, photo_id in matches]
+        ).select_related('car__user')
\ No newline at end of file
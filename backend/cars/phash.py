@@ -0,0 +1,261 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+HASH_SIZE = 8
+
+
+def dhash(image):
+    """
+    Return the 64-bit difference hash of a PIL image.
+
+    The image is reduced to a 9x8 grayscale thumbnail and each bit records
+    whether a pixel is brighter than its right-hand neighbour, so resizing,
+    recompression and small colour shifts leave most bits unchanged.
+    """
+    thumbnail = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = list(thumbnail.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_file(file):
+    """Return the hex difference hash of an image file, leaving it rewound"""
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            # Let the JPEG decoder downscale while decoding; no-op for other formats
+            image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+            return format(dhash(image), '016x')
+    finally:
+        file.seek(0)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes using Hamming distance"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Return (distance, item) pairs within max_distance of value"""
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            # Triangle inequality: only subtrees in this band can hold matches
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+class PhotoHashIndex:
+    """
+    Process-local index of CarPhoto perceptual hashes.
+
+    The tree is extended incrementally with rows newer than the last one seen
+    and rebuilt from scratch every CAR_PHOTO_HASH_INDEX_REBUILD seconds so
+    deleted photos drop out. Items are (photo_id, user_id) tuples.
+
+    New photos are checked for reuse once their transaction commits. With
+    CAR_PHOTO_HASH_INDEX_THREAD that, and every refresh of the tree, happens
+    on a refresher thread rather than in a request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tree = BKTree()
+        self.last_id = 0
+        self.built_at = None
+        self.pending = []
+        self.refresher = None
+        self.ready = threading.Event()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+
+    def invalidate(self):
+        """Force a full rebuild on the next lookup"""
+        self.built_at = None
+
+    def refresh(self):
+        from .models import CarPhoto
+
+        with self.lock:
+            if self.built_at is None or time.monotonic() - self.built_at > settings.CAR_PHOTO_HASH_INDEX_REBUILD:
+                self.tree = BKTree()
+                self.last_id = 0
+                self.built_at = time.monotonic()
+
+            rows = CarPhoto.objects.filter(id__gt=self.last_id).exclude(
+                perceptual_hash=''
+            ).order_by('id').values_list('id', 'perceptual_hash', 'car__user_id')
+            for photo_id, perceptual_hash, user_id in rows.iterator(chunk_size=2000):
+                self.tree.add(int(perceptual_hash, 16), (photo_id, user_id))
+                self.last_id = photo_id
+        self.ready.set()
+
+    def near_duplicates(self, perceptual_hash, max_distance=None, exclude_user_id=None):
+        """Return (distance, photo_id) pairs near the given hex hash, closest first"""
+        if not perceptual_hash:
+            return []
+        if settings.CAR_PHOTO_HASH_INDEX_THREAD:
+            self.start_refresher()
+            self.ready.wait()
+        else:
+            self.refresh()
+        return self._search(perceptual_hash, max_distance, exclude_user_id)
+
+    def mark_reused_on_commit(self, photos):
+        """
+        mark_reused() once the current transaction commits, so the photos of
+        a rolled back upload never reach the tree or flag other photos
+        """
+        photos = [photo for photo in photos if photo[1]]
+        if photos:
+            transaction.on_commit(lambda: self.submit(photos))
+
+    def submit(self, photos):
+        if not settings.CAR_PHOTO_HASH_INDEX_THREAD:
+            self.mark_reused(photos)
+            return
+        with self.lock:
+            self.pending.extend(photos)
+        self.start_refresher()
+        self.wake.set()
+
+    def mark_reused(self, photos):
+        """
+        Flag new photos, given as (photo_id, perceptual_hash, user_id), and
+        the photos of other accounts they nearly duplicate as reused
+        """
+        from .models import CarPhoto
+
+        photos = [photo for photo in photos if photo[1]]
+        if not photos:
+            return
+        self.refresh()
+        reused = set()
+        for photo_id, perceptual_hash, user_id in photos:
+            matches = self._search(perceptual_hash, None, exclude_user_id=user_id)
+            if matches:
+                reused.add(photo_id)
+                reused.update(match_id for distance, match_id in matches)
+        if reused:
+            CarPhoto.objects.filter(id__in=reused, reused=False).update(reused=True)
+
+    def sync_reused(self, batch_size=2000):
+        """
+        Recompute every photo's reused flag, in batches of ``batch_size``
+        rows, and return how many are reused. Clears the flags of photos
+        whose counterparts have been deleted.
+        """
+        from .models import CarPhoto
+
+        self.refresh()
+        total = 0
+        last_id = 0
+        while True:
+            rows = list(
+                CarPhoto.objects.filter(id__gt=last_id).order_by('id').values_list(
+                    'id', 'perceptual_hash', 'car__user_id', 'reused'
+                )[:batch_size]
+            )
+            if not rows:
+                return total
+            last_id = rows[-1][0]
+            # Matching is symmetric, so a photo's own search settles its flag
+            reused = {
+                photo_id for photo_id, perceptual_hash, user_id, flag in rows
+                if perceptual_hash and self._search(perceptual_hash, None, exclude_user_id=user_id)
+            }
+            total += len(reused)
+            flagged = {photo_id for photo_id, perceptual_hash, user_id, flag in rows if flag}
+            if reused - flagged:
+                CarPhoto.objects.filter(id__in=reused - flagged).update(reused=True)
+            if flagged - reused:
+                CarPhoto.objects.filter(id__in=flagged - reused).update(reused=False)
+
+    def start_refresher(self):
+        with self.lock:
+            if self.refresher is not None:
+                return
+            self.stopping.clear()
+            self.refresher = threading.Thread(target=self.run_refresher, name='photo-hash-refresher', daemon=True)
+            self.refresher.start()
+
+    def run_refresher(self):
+        """
+        Refresh the tree and check submitted photos whenever some arrive, and
+        at least every CAR_PHOTO_HASH_INDEX_REBUILD seconds for the rebuild
+        """
+        while not self.stopping.is_set():
+            self.wake.clear()
+            with self.lock:
+                photos, self.pending = self.pending, []
+            try:
+                if photos:
+                    self.mark_reused(photos)
+                else:
+                    self.refresh()
+            except Exception:
+                # backfill_photo_hashes recomputes every flag
+                logger.exception('Could not check %d photos for reuse', len(photos))
+            finally:
+                close_old_connections()
+            self.wake.wait(settings.CAR_PHOTO_HASH_INDEX_REBUILD)
+
+    def stop_refresher(self):
+        self.stopping.set()
+        self.wake.set()
+        if self.refresher is not None:
+            self.refresher.join()
+            self.refresher = None
+
+    def _search(self, perceptual_hash, max_distance, exclude_user_id):
+        if max_distance is None:
+            max_distance = settings.CAR_PHOTO_DUPLICATE_DISTANCE
+        matches = self.tree.search(int(perceptual_hash, 16), max_distance)
+        return sorted(
+            (distance, photo_id) for distance, (photo_id, user_id) in matches
+            if user_id != exclude_user_id
+        )
+
+
+photo_hash_index = PhotoHashIndex()
@@ -0,0 +1,113 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import Image
+from rest_framework import serializers
+
+from backend.metrics import UPLOAD_BYTES
+from .models import CarPhoto
+from .phash import dhash_file, photo_hash_index
+
+
+StoredPhoto = namedtuple('StoredPhoto', ['name', 'perceptual_hash'])
+
+
+# Leading bytes of the image formats we accept, checked before Pillow opens the file
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+]
+
+
+def sniff_format(header):
+    """Return the image format implied by the first bytes of a file, or None"""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def verify_photo(photo):
+    """
+    Check that an uploaded file is a real image within the configured limits.
+
+    Returns an error message, or None if the photo is acceptable.
+    """
+    photo.seek(0)
+    image_format = sniff_format(photo.read(16))
+    if image_format is None:
+        return 'is not a supported image format (JPEG, PNG, WEBP or GIF).'
+
+    photo.seek(0)
+    try:
+        with Image.open(photo) as image:
+            # Pillow reports multi-picture JPEGs from phone cameras as MPO
+            if image.format != image_format and not (image.format == 'MPO' and image_format == 'JPEG'):
+                return 'has a file signature that does not match its contents.'
+            width, height = image.size
+            image.verify()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return 'is not a valid image or is corrupted.'
+    finally:
+        photo.seek(0)
+
+    max_dimension = settings.CAR_PHOTO_MAX_DIMENSION
+    if width > max_dimension or height > max_dimension:
+        return f'is too large ({width}x{height}). Maximum dimension is {max_dimension}px.'
+    return None
+
+
+def _verify_and_store(photo):
+    error = verify_photo(photo)
+    if error:
+        return None, error
+    perceptual_hash = dhash_file(photo)
+    field = CarPhoto._meta.get_field('photo')
+    name = field.generate_filename(None, photo.name)
+    name = field.storage.save(name, photo, max_length=field.max_length)
+    return StoredPhoto(name, perceptual_hash), None
+
+
+def store_car_photos(photos):
+    """
+    Verify, hash and store uploaded photos concurrently, returning StoredPhotos.
+
+    Each worker writes its file as soon as it has been verified, so writes for
+    one photo overlap with verification of the others. If any photo is
+    rejected a ValidationError is raised; blobs already written for the other
+    photos are left for ``gc_car_photos`` to reclaim.
+    """
+    if not photos:
+        return []
+
+    workers = min(len(photos), settings.CAR_PHOTO_VERIFY_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_verify_and_store, photos))
+
+    errors = [
+        f'Photo {i + 1} {error}' for i, (name, error) in enumerate(results) if error
+    ]
+    if errors:
+        raise serializers.ValidationError(errors)
+    UPLOAD_BYTES.inc(sum(photo.size for photo in photos), kind='car_photo')
+    return [stored for stored, error in results]
+
+
+def create_car_photos(car, stored_photos):
+    """
+    Create CarPhoto rows for already-stored photos with a single INSERT; the
+    ones reused across accounts are flagged once the transaction commits
+    """
+    car_photos = CarPhoto.objects.bulk_create([
+        CarPhoto(car=car, photo=stored.name, perceptual_hash=stored.perceptual_hash)
+        for stored in stored_photos
+    ])
+    photo_hash_index.mark_reused_on_commit(
+        (car_photo.id, car_photo.perceptual_hash, car.user_id) for car_photo in car_photos
+    )
+    return car_photos
@@ -1,26 +1,28 @@
 from rest_framework import serializers
+from backend.serializers import ProfiledModelSerializer
 from .models import CarBrand, CarModel, CarVariant, CarType, Car, CarPhoto
+from .photos import store_car_photos, create_car_photos
 
 
-class CarTypeSerializer(serializers.ModelSerializer):
+class CarTypeSerializer(ProfiledModelSerializer):
     class Meta:
         model = CarType
         fields = ['id', 'name']
 
 
-class CarBrandSerializer(serializers.ModelSerializer):
+class CarBrandSerializer(ProfiledModelSerializer):
     class Meta:
         model = CarBrand
         fields = ['id', 'name']
 
 
-class CarVariantSerializer(serializers.ModelSerializer):
+class CarVariantSerializer(ProfiledModelSerializer):
     class Meta:
         model = CarVariant
         fields = ['id', 'name']
 
 
-class CarModelSerializer(serializers.ModelSerializer):
+class CarModelSerializer(ProfiledModelSerializer):
     variants = CarVariantSerializer(many=True, read_only=True)
     brand_name = serializers.CharField(source='brand.name', read_only=True)
     
@@ -29,7 +31,7 @@ class CarModelSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'brand', 'brand_name', 'variants']
 
 
-class CarModelSimpleSerializer(serializers.ModelSerializer):
+class CarModelSimpleSerializer(ProfiledModelSerializer):
     brand_name = serializers.CharField(source='brand.name', read_only=True)
     
     class Meta:
@@ -37,7 +39,7 @@ class CarModelSimpleSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'brand', 'brand_name']
 
 
-class CarBrandWithModelsSerializer(serializers.ModelSerializer):
+class CarBrandWithModelsSerializer(ProfiledModelSerializer):
     models = CarModelSimpleSerializer(many=True, read_only=True)
     
     class Meta:
@@ -45,13 +47,13 @@ class CarBrandWithModelsSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'models']
 
 
-class CarPhotoSerializer(serializers.ModelSerializer):
+class CarPhotoSerializer(ProfiledModelSerializer):
     class Meta:
         model = CarPhoto
         fields = ['id', 'photo', 'uploaded_at']
 
 
-class CarSerializer(serializers.ModelSerializer):
+class CarSerializer(ProfiledModelSerializer):
     brand_name = serializers.CharField(source='brand.name', read_only=True)
     model_name = serializers.CharField(source='model.name', read_only=True)
     variant_name = serializers.CharField(source='variant.name', read_only=True)
@@ -71,9 +73,9 @@ class CarSerializer(serializers.ModelSerializer):
         read_only_fields = ['user']
 
 
-class CarCreateSerializer(serializers.ModelSerializer):
+class CarCreateSerializer(ProfiledModelSerializer):
     photos = serializers.ListField(
-        child=serializers.ImageField(),
+        child=serializers.FileField(),
         write_only=True,
         required=True,
         min_length=2,
@@ -95,23 +97,23 @@ class CarCreateSerializer(serializers.ModelSerializer):
             if photo.size > 10 * 1024 * 1024:  # 10MB
                 raise serializers.ValidationError(f"Photo {photo.name} is too large. Maximum size is 10MB.")
         
-        return value
+        # Verify image contents concurrently and store them before any rows are written
+        return store_car_photos(value)
 
     def create(self, validated_data):
         photos_data = validated_data.pop('photos')
         validated_data['user'] = self.context['request'].user
         car = super().create(validated_data)
         
-        # Create car photos
-        for photo in photos_data:
-            CarPhoto.objects.create(car=car, photo=photo)
+        # Create car photos (files were stored during validation)
+        create_car_photos(car, photos_data)
         
         return car
 
 
-class CarUpdateSerializer(serializers.ModelSerializer):
+class CarUpdateSerializer(ProfiledModelSerializer):
     photos = serializers.ListField(
-        child=serializers.ImageField(),
+        child=serializers.FileField(),
         write_only=True,
         required=False,
         min_length=2,
@@ -134,7 +136,8 @@ class CarUpdateSerializer(serializers.ModelSerializer):
                 if photo.size > 10 * 1024 * 1024:  # 10MB
                     raise serializers.ValidationError(f"Photo {photo.name} is too large. Maximum size is 10MB.")
         
-        return value
+        # Verify image contents concurrently and store them before any rows are written
+        return store_car_photos(value)
 
     def update(self, instance, validated_data):
         photos_data = validated_data.pop('photos', None)
@@ -144,8 +147,7 @@ class CarUpdateSerializer(serializers.ModelSerializer):
         if photos_data is not None:
             # Delete existing photos
             instance.photos.all().delete()
-            # Create new photos
-            for photo in photos_data:
-                CarPhoto.objects.create(car=instance, photo=photo)
+            # Create new photos; replaced blobs are reclaimed by gc_car_photos
+            create_car_photos(instance, photos_data)
         
         return instance
\ No newline at end of file
@@ -0,0 +1,19 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .models import CarBrand, CarModel, CarVariant, CarType
+
+
+@receiver(post_save, sender=CarBrand)
+@receiver(post_save, sender=CarModel)
+@receiver(post_save, sender=CarVariant)
+@receiver(post_save, sender=CarType)
+@receiver(post_delete, sender=CarBrand)
+@receiver(post_delete, sender=CarModel)
+@receiver(post_delete, sender=CarVariant)
+@receiver(post_delete, sender=CarType)
+def invalidate_catalog(sender, **kwargs):
+    """Single-row edits, e.g. from the admin; bulk imports bump the version themselves"""
+    transaction.on_commit(bump_catalog_version)
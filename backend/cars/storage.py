@@ -0,0 +1,84 @@
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# <prefix>/<2 hex chars>/<64 hex chars>.<ext>
+CONTENT_ADDRESSED_NAME = re.compile(r'(?:^|/)([0-9a-f]{2})/(\1[0-9a-f]{62})(\.[A-Za-z0-9]+)?$')
+
+
+def content_hash(content):
+    """Return the sha256 hex digest of a file-like object, leaving it rewound"""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def hash_from_name(name):
+    """Return the content hash encoded in a stored name, or None for legacy names"""
+    match = CONTENT_ADDRESSED_NAME.search(name or '')
+    return match.group(2) if match else None
+
+
+@deconstructible(path='cars.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Filesystem storage that names files by the sha256 of their content.
+
+    Identical uploads map to the same blob, so saving a duplicate is a no-op
+    and the resulting URL never changes meaning. Blobs are shared between
+    CarPhoto rows and reclaimed by the ``gc_car_photos`` command once no row
+    references them.
+    """
+
+    def __init__(self, **kwargs):
+        # Two writers racing on the same name are writing the same bytes
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def hashed_name(self, name, digest):
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        return '/'.join(part for part in (directory, digest[:2], digest + ext) if part)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        validate_file_name(name, allow_relative_path=True)
+        name = self.hashed_name(name, content_hash(content))
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # Refresh mtime so garbage collection treats the blob as recently used
+            os.utime(full_path)
+            return name
+        return self._save(name, content)
+
+
+def car_photo_storage():
+    return ContentAddressedStorage()
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    Development media view that marks content-addressed files as immutable
+    """
+    response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if hash_from_name(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -1,3 +1,377 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from .catalog import bump_catalog_version
+from .models import CarBrand, CarModel, CarVariant, CarType, Car, CarPhoto, CatalogVersion
+from .phash import BKTree, hamming, photo_hash_index
+from .photos import store_car_photos, create_car_photos
+from .storage import ContentAddressedStorage, hash_from_name
+
+
+class MediaRootMixin:
+    """Point MEDIA_ROOT at a throwaway directory for the duration of a test"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class ContentAddressedStorageTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = CustomUser.objects.create_user(
+            email='owner@example.com', password='pass12345', name='Owner', phone='+15550000001'
+        )
+        self.car = Car.objects.create(user=user, brand=CarBrand.objects.create(name='Audi'))
+
+    def test_identical_uploads_share_one_blob(self):
+        first = CarPhoto.objects.create(car=self.car, photo=SimpleUploadedFile('a.jpg', b'same-bytes'))
+        second = CarPhoto.objects.create(car=self.car, photo=SimpleUploadedFile('b.JPG', b'same-bytes'))
+
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertIsNotNone(hash_from_name(first.photo.name))
+        self.assertTrue(first.photo.name.endswith('.jpg'))
+        self.assertEqual(first.reference_count, 2)
+
+    def test_different_content_gets_different_names(self):
+        storage = ContentAddressedStorage()
+        a = storage.save('car_photos/x.png', SimpleUploadedFile('x.png', b'one'))
+        b = storage.save('car_photos/x.png', SimpleUploadedFile('x.png', b'two'))
+        self.assertNotEqual(a, b)
+
+    def test_gc_reclaims_only_unreferenced_blobs(self):
+        kept = CarPhoto.objects.create(car=self.car, photo=SimpleUploadedFile('a.jpg', b'kept'))
+        dropped = CarPhoto.objects.create(car=self.car, photo=SimpleUploadedFile('b.jpg', b'dropped'))
+        dropped_path = dropped.photo.path
+        dropped.delete()
+
+        call_command('gc_car_photos', grace_seconds=0, stdout=StringIO())
+
+        self.assertTrue(os.path.exists(kept.photo.path))
+        self.assertFalse(os.path.exists(dropped_path))
+
+    def test_gc_respects_grace_period(self):
+        photo = CarPhoto.objects.create(car=self.car, photo=SimpleUploadedFile('a.jpg', b'recent'))
+        path = photo.photo.path
+        photo.delete()
+
+        call_command('gc_car_photos', stdout=StringIO())
+
+        self.assertTrue(os.path.exists(path))
+
+
+def make_image(name='photo.png', size=(8, 8), image_format='PNG', color='red'):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format=image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(PERF_SAMPLE_RATE=0, CAR_PHOTO_HASH_INDEX_THREAD=False)
+class CarPhotoUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = CustomUser.objects.create_user(
+            email='owner@example.com', password='pass12345', name='Owner', phone='+15550000001'
+        )
+        self.car = Car.objects.create(user=user, brand=CarBrand.objects.create(name='Audi'))
+        photo_hash_index.invalidate()
+
+    def test_store_and_bulk_create(self):
+        stored = store_car_photos([make_image(color='red'), make_image(color='blue')])
+        self.assertEqual(len(stored), 2)
+
+        # One INSERT; the hash index catches up to look for reuse after the commit
+        with self.assertNumQueries(1):
+            photos = create_car_photos(self.car, stored)
+        self.assertEqual([p.photo.name for p in photos], [s.name for s in stored])
+        self.assertTrue(all(p.pk for p in photos))
+
+    def test_rejects_non_images_with_photo_index(self):
+        with self.assertRaises(ValidationError) as ctx:
+            store_car_photos([make_image(), SimpleUploadedFile('fake.png', b'not an image')])
+        self.assertEqual(len(ctx.exception.detail), 1)
+        self.assertTrue(str(ctx.exception.detail[0]).startswith('Photo 2 '))
+
+    def test_rejects_mismatched_signature(self):
+        upload = make_image(image_format='PNG')
+        upload.file.seek(0)
+        data = b'\xff\xd8\xff' + upload.read()[3:]
+        with self.assertRaises(ValidationError):
+            store_car_photos([SimpleUploadedFile('x.jpg', data)])
+
+    @override_settings(CAR_PHOTO_MAX_DIMENSION=4)
+    def test_rejects_oversized_dimensions(self):
+        with self.assertRaises(ValidationError):
+            store_car_photos([make_image(size=(8, 2))])
+
+    def test_register_car_endpoint(self):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.car.user)
+        response = client.post('/api/cars/register/', {
+            'brand': self.car.brand_id,
+            'photos': [make_image(color='red'), make_image(color='green')],
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data['car']['photos']), 2)
+
+
+@override_settings(PERF_SAMPLE_RATE=0, CAR_PHOTO_HASH_INDEX_THREAD=False)
+class PerceptualHashTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        photo_hash_index.invalidate()
+
+    def make_gradient(self, name, size=(64, 48)):
+        from PIL import Image
+
+        image = Image.new('L', (64, 48))
+        image.putdata([(x * 3 + (y * y) // 12) % 256 for y in range(48) for x in range(64)])
+        buffer = BytesIO()
+        image.resize(size).save(buffer, format='PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def make_car(self, email, phone):
+        user = CustomUser.objects.create_user(email=email, password='pass12345', name=email, phone=phone)
+        return Car.objects.create(user=user)
+
+    def upload(self, car, *photos):
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_car_photos(car, store_car_photos(list(photos)))
+
+    def test_bk_tree_matches_linear_scan(self):
+        import random
+
+        rng = random.Random(7)
+        values = [rng.getrandbits(64) for _ in range(500)]
+        tree = BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+
+        query = values[0] ^ 0b1011
+        expected = sorted(i for i, v in enumerate(values) if hamming(query, v) <= 10)
+        self.assertEqual(sorted(i for d, i in tree.search(query, 10)), expected)
+
+    def test_resized_copy_is_near_duplicate_across_accounts(self):
+        first_car = self.make_car('a@example.com', '+15550000001')
+        second_car = self.make_car('b@example.com', '+15550000002')
+
+        original, = self.upload(first_car, self.make_gradient('a.png'))
+        resized, = self.upload(second_car, self.make_gradient('b.png', size=(128, 96)))
+
+        photo_hash_index.invalidate()
+        self.assertNotEqual(original.photo.name, resized.photo.name)
+        self.assertEqual(list(original.near_duplicates()), [resized])
+        self.assertEqual(set(CarPhoto.objects.filter(reused=True).values_list('id', flat=True)), {original.id, resized.id})
+
+    def test_sync_clears_flags_of_deleted_counterparts(self):
+        first_car = self.make_car('a@example.com', '+15550000001')
+        second_car = self.make_car('b@example.com', '+15550000002')
+        original, = self.upload(first_car, self.make_gradient('a.png'))
+        resized, = self.upload(second_car, self.make_gradient('b.png', size=(128, 96)))
+        self.assertTrue(CarPhoto.objects.get(id=original.id).reused)
+        resized.delete()
+
+        photo_hash_index.invalidate()
+        self.assertEqual(photo_hash_index.sync_reused(batch_size=1), 0)
+        original.refresh_from_db()
+        self.assertFalse(original.reused)
+
+    def test_rolled_back_uploads_are_not_indexed(self):
+        first_car = self.make_car('a@example.com', '+15550000001')
+        second_car = self.make_car('b@example.com', '+15550000002')
+        original, = self.upload(first_car, self.make_gradient('a.png'))
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    create_car_photos(second_car, store_car_photos([self.make_gradient('b.png', size=(128, 96))]))
+                    raise RuntimeError('registration failed')
+        self.assertEqual(callbacks, [])
+        self.assertFalse(CarPhoto.objects.filter(reused=True).exists())
+        self.assertEqual(photo_hash_index.tree.size, 1)
+
+    def test_same_account_is_not_reported(self):
+        car = self.make_car('a@example.com', '+15550000001')
+        photo, = self.upload(car, self.make_gradient('a.png'))
+        self.upload(car, self.make_gradient('b.png', size=(128, 96)))
+
+        photo_hash_index.invalidate()
+        self.assertEqual(list(photo.near_duplicates()), [])
+
+
+
+@override_settings(CAR_PHOTO_HASH_INDEX_THREAD=True)
+class PhotoHashRefresherTests(MediaRootMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        photo_hash_index.invalidate()
+        self.addCleanup(photo_hash_index.invalidate)
+        self.addCleanup(photo_hash_index.stop_refresher)
+
+    def test_new_photos_are_checked_on_the_refresher_thread(self):
+        cars = [
+            Car.objects.create(user=CustomUser.objects.create_user(
+                email=f'{name}@example.com', password='pass12345', name=name, phone=f'+155500000{n}'
+            ))
+            for n, name in enumerate(['a', 'b'])
+        ]
+        checked, mark_reused = threading.Event(), photo_hash_index.mark_reused
+        checked_by = []
+
+        def checking(photos):
+            mark_reused(photos)
+            checked_by.append(threading.current_thread().name)
+            checked.set()
+
+        with mock.patch.object(photo_hash_index, 'mark_reused', checking):
+            for car, color in zip(cars, ['red', 'red']):
+                checked.clear()
+                # Autocommit: the photos are submitted as soon as they are inserted
+                create_car_photos(car, store_car_photos([make_image(color=color)]))
+                self.assertTrue(checked.wait(5))
+        self.assertEqual(checked_by, ['photo-hash-refresher'] * 2)
+        self.assertEqual(CarPhoto.objects.filter(reused=True).count(), 2)
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def import_catalog(self, path, **options):
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_is_idempotent(self):
+        path = self.write('catalog.json', json.dumps({
+            'types': ['SUV', 'Sedan'],
+            'brands': {'Audi': {'Q5': ['Q5', 'SQ5'], 'A4': ['S4']}, 'BMW': {'X3': []}},
+        }))
+        self.import_catalog(path)
+        self.assertEqual(CarType.objects.count(), 2)
+        self.assertEqual(CarModel.objects.filter(brand__name='Audi').count(), 2)
+        self.assertEqual(CarVariant.objects.filter(model__name='Q5').count(), 2)
+
+        # One query per catalog model to diff, nothing to write
+        with self.assertNumQueries(4):
+            output = self.import_catalog(path)
+        self.assertIn('already up to date', output)
+
+    def test_renames_and_deletions_from_csv(self):
+        call_command('import_catalog', self.write('first.jsonl', '\n'.join([
+            '{"type": "SUV"}',
+            '{"brand": "Audi", "model": "Q5", "variant": "SQ5"}',
+            '{"brand": "Audi", "model": "A4", "variant": "RS4"}',
+        ])), stdout=StringIO())
+        q5 = CarModel.objects.get(name='Q5')
+        user = CustomUser.objects.create_user(
+            email='owner@example.com', password='pass12345', name='Owner', phone='+15550000001'
+        )
+        car = Car.objects.create(user=user, brand=q5.brand, model=q5)
+
+        path = self.write('second.csv', (
+            'type,brand,model,model_id,variant\n'
+            'SUV,,,,\n'
+            f',Audi,Q5 Sportback,{q5.id},SQ5\n'
+        ))
+        output = self.import_catalog(path, dry_run=True)
+        self.assertIn('~ Q5 -> Q5 Sportback', output)
+        self.assertTrue(CarModel.objects.filter(name='A4').exists())
+
+        self.import_catalog(path)
+        car.refresh_from_db()
+        self.assertEqual(car.model.name, 'Q5 Sportback')
+        self.assertEqual(list(CarVariant.objects.values_list('name', flat=True)), ['SQ5'])
+        self.assertFalse(CarModel.objects.filter(name='A4').exists())
+
+    def test_keep_missing_and_invalid_rows(self):
+        CarBrand.objects.create(name='Legacy')
+        self.import_catalog(self.write('a.json', '[{"brand": "Audi"}]'), keep_missing=True)
+        self.assertEqual(CarBrand.objects.count(), 2)
+
+        with self.assertRaisesMessage(CommandError, 'Row 1: a variant needs a model.'):
+            self.import_catalog(self.write('b.json', '[{"brand": "Audi", "variant": "S4"}]'))
+
+    def test_catalog_endpoints_are_cached_until_the_catalog_changes(self):
+        cache.clear()
+        CarBrand.objects.create(name='Audi')
+        client = APIClient()
+        self.assertEqual([b['name'] for b in client.get(reverse('cars:brands')).data], ['Audi'])
+        # Only the catalog version is read, so a bump from another process is seen at once
+        with self.assertNumQueries(1):
+            client.get(reverse('cars:brands'))
+
+        # A bump from another process never touches this process's cache
+        CarBrand.objects.filter(name='Audi').update(name='Alfa Romeo')
+        CatalogVersion.objects.update(version=F('version') + 1)
+        self.assertEqual([b['name'] for b in client.get(reverse('cars:brands')).data], ['Alfa Romeo'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_catalog(self.write('c.json', '[{"brand": "Audi"}, {"brand": "BMW"}]'))
+        self.assertEqual([b['name'] for b in client.get(reverse('cars:brands')).data], ['Audi', 'BMW'])
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class AsyncCatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_cars', stdout=StringIO())
+
+    def test_async_endpoints_match_sync(self):
+        brand = CarBrand.objects.order_by('id').first()
+        model = CarModel.objects.order_by('id').first()
+        pairs = [
+            (reverse('cars:brands'), reverse('cars:async_brands')),
+            (reverse('cars:brands_with_models'), reverse('cars:async_brands_with_models')),
+            (reverse('cars:models_for_brand', args=[brand.id]), reverse('cars:async_models_for_brand', args=[brand.id])),
+            (reverse('cars:models_for_brand', args=[0]), reverse('cars:async_models_for_brand', args=[0])),
+            (reverse('cars:variants_for_model', args=[model.id]),
+             reverse('cars:async_variants_for_model', args=[model.id])),
+            (reverse('cars:car_types'), reverse('cars:async_car_types')),
+        ]
+        for sync_url, async_url in pairs:
+            with self.subTest(url=async_url):
+                expected = self.client.get(sync_url)
+                # Build the async response from the database rather than the sync view's cache entry
+                bump_catalog_version()
+                response = async_to_sync(self.async_client.get)(async_url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response['Content-Type'], expected['Content-Type'])
+                self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+        response = async_to_sync(self.async_client.post)(reverse('cars:async_brands'))
+        self.assertEqual(response.status_code, 405)
@@ -10,6 +10,13 @@ urlpatterns = [
     path('brands/<int:brand_id>/models/', views.get_models_for_brand, name='models_for_brand'),
     path('models/<int:model_id>/variants/', views.get_variants_for_model, name='variants_for_model'),
     path('types/', views.get_car_types, name='car_types'),
+
+    # Async variants of the catalog endpoints, for ASGI deployments
+    path('async/brands/', views.async_car_brands, name='async_brands'),
+    path('async/brands-with-models/', views.async_car_brands_with_models, name='async_brands_with_models'),
+    path('async/brands/<int:brand_id>/models/', views.async_models_for_brand, name='async_models_for_brand'),
+    path('async/models/<int:model_id>/variants/', views.async_variants_for_model, name='async_variants_for_model'),
+    path('async/types/', views.async_car_types, name='async_car_types'),
     
     # User car management endpoints
     path('my-cars/', views.get_user_cars, name='user_cars'),
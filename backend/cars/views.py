@@ -1,8 +1,13 @@
 from django.shortcuts import render
 from rest_framework import status, generics, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from accounts.throttling import WriteRateThrottle
+from backend.async_api import async_api_view, render
+from .catalog import acached_catalog, cached_catalog
 from .models import CarBrand, CarModel, CarVariant, CarType, Car, CarPhoto
+from .photos import store_car_photos, create_car_photos
 from .serializers import (
     CarBrandSerializer, 
     CarBrandWithModelsSerializer,
@@ -22,9 +27,10 @@ def get_car_brands(request):
     """
     Get all car brands
     """
-    brands = CarBrand.objects.all().order_by('name')
-    serializer = CarBrandSerializer(brands, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    data = cached_catalog('brands', lambda: CarBrandSerializer(
+        CarBrand.objects.all().order_by('name'), many=True
+    ).data)
+    return Response(data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
@@ -33,9 +39,10 @@ def get_car_brands_with_models(request):
     """
     Get all car brands with their models
     """
-    brands = CarBrand.objects.prefetch_related('models').all().order_by('name')
-    serializer = CarBrandWithModelsSerializer(brands, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    data = cached_catalog('brands-with-models', lambda: CarBrandWithModelsSerializer(
+        CarBrand.objects.prefetch_related('models').all().order_by('name'), many=True
+    ).data)
+    return Response(data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
@@ -44,11 +51,14 @@ def get_models_for_brand(request, brand_id):
     """
     Get all models for a specific brand
     """
-    try:
+    def build():
         brand = CarBrand.objects.get(id=brand_id)
         models = CarModel.objects.filter(brand=brand).prefetch_related('variants').order_by('name')
-        serializer = CarModelSerializer(models, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return CarModelSerializer(models, many=True).data
+
+    try:
+        data = cached_catalog(f'brands/{brand_id}/models', build)
+        return Response(data, status=status.HTTP_200_OK)
     except CarBrand.DoesNotExist:
         return Response({'error': 'Brand not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -59,11 +69,14 @@ def get_variants_for_model(request, model_id):
     """
     Get all variants for a specific model
     """
-    try:
+    def build():
         model = CarModel.objects.get(id=model_id)
         variants = CarVariant.objects.filter(model=model).order_by('name')
-        serializer = CarVariantSerializer(variants, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return CarVariantSerializer(variants, many=True).data
+
+    try:
+        data = cached_catalog(f'models/{model_id}/variants', build)
+        return Response(data, status=status.HTTP_200_OK)
     except CarModel.DoesNotExist:
         return Response({'error': 'Model not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -74,9 +87,10 @@ def get_car_types(request):
     """
     Get all car types
     """
-    car_types = CarType.objects.all().order_by('name')
-    serializer = CarTypeSerializer(car_types, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    data = cached_catalog('types', lambda: CarTypeSerializer(
+        CarType.objects.all().order_by('name'), many=True
+    ).data)
+    return Response(data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
@@ -94,6 +108,7 @@ def get_user_cars(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes([WriteRateThrottle])
 def register_car(request):
     """
     Register a new car for the current user with photos
@@ -104,7 +119,7 @@ def register_car(request):
     # Extract photos from request.FILES
     photos = request.FILES.getlist('photos')
     if photos:
-        data['photos'] = photos
+        data.setlist('photos', photos)
     
     serializer = CarCreateSerializer(data=data, context={'request': request})
     if serializer.is_valid():
@@ -135,6 +150,7 @@ def get_car_detail(request, car_id):
 
 @api_view(['PUT', 'PATCH'])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes([WriteRateThrottle])
 def update_car(request, car_id):
     """
     Update a car registration with optional photo updates
@@ -148,7 +164,7 @@ def update_car(request, car_id):
         # Extract photos from request.FILES if present
         photos = request.FILES.getlist('photos')
         if photos:
-            data['photos'] = photos
+            data.setlist('photos', photos)
         
         serializer = CarUpdateSerializer(
             car, 
@@ -186,6 +202,7 @@ def delete_car(request, car_id):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes([WriteRateThrottle])
 def add_car_photos(request, car_id):
     """
     Add additional photos to an existing car
@@ -210,11 +227,12 @@ def add_car_photos(request, car_id):
                     'error': f'Photo {photo.name} is too large. Maximum size is 10MB.'
                 }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create car photos
-        created_photos = []
-        for photo in photos:
-            car_photo = CarPhoto.objects.create(car=car, photo=photo)
-            created_photos.append(CarPhotoSerializer(car_photo).data)
+        # Verify and store photos concurrently, then create rows in one INSERT
+        try:
+            stored_photos = store_car_photos(photos)
+        except ValidationError as e:
+            return Response({'error': e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
+        created_photos = CarPhotoSerializer(create_car_photos(car, stored_photos), many=True).data
         
         return Response({
             'message': f'{len(created_photos)} photos added successfully',
@@ -250,3 +268,59 @@ def delete_car_photo(request, car_id, photo_id):
         return Response({'error': 'Car not found'}, status=status.HTTP_404_NOT_FOUND)
     except CarPhoto.DoesNotExist:
         return Response({'error': 'Photo not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
+# -------------------------
+# Async catalog endpoints (served without a thread under ASGI)
+# -------------------------
+
+@async_api_view(login_required=False)
+async def async_car_brands(request):
+    async def build():
+        brands = [brand async for brand in CarBrand.objects.order_by('name')]
+        return CarBrandSerializer(brands, many=True).data
+
+    return render(await acached_catalog('brands', build))
+
+
+@async_api_view(login_required=False)
+async def async_car_brands_with_models(request):
+    async def build():
+        brands = [brand async for brand in CarBrand.objects.prefetch_related('models').order_by('name')]
+        return CarBrandWithModelsSerializer(brands, many=True).data
+
+    return render(await acached_catalog('brands-with-models', build))
+
+
+@async_api_view(login_required=False)
+async def async_models_for_brand(request, brand_id):
+    async def build():
+        brand = await CarBrand.objects.aget(id=brand_id)
+        models = CarModel.objects.filter(brand=brand).select_related('brand').prefetch_related('variants')
+        return CarModelSerializer([model async for model in models.order_by('name')], many=True).data
+
+    try:
+        return render(await acached_catalog(f'brands/{brand_id}/models', build))
+    except CarBrand.DoesNotExist:
+        return render({'error': 'Brand not found'}, status.HTTP_404_NOT_FOUND)
+
+
+@async_api_view(login_required=False)
+async def async_variants_for_model(request, model_id):
+    async def build():
+        model = await CarModel.objects.aget(id=model_id)
+        variants = CarVariant.objects.filter(model=model).order_by('name')
+        return CarVariantSerializer([variant async for variant in variants], many=True).data
+
+    try:
+        return render(await acached_catalog(f'models/{model_id}/variants', build))
+    except CarModel.DoesNotExist:
+        return render({'error': 'Model not found'}, status.HTTP_404_NOT_FOUND)
+
+
+@async_api_view(login_required=False)
+async def async_car_types(request):
+    async def build():
+        return CarTypeSerializer([car_type async for car_type in CarType.objects.order_by('name')], many=True).data
+
+    return render(await acached_catalog('types', build))
@@ -1,4 +1,9 @@
 from django.contrib import admin
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from backend.pagination import EstimatedCountMixin
+from . import feed
 from .models import RoadTrip, TripEligibility, TripParticipant, TripNotification
 
 
@@ -17,7 +22,7 @@ class TripParticipantInline(admin.TabularInline):
 
 
 @admin.register(RoadTrip)
-class RoadTripAdmin(admin.ModelAdmin):
+class RoadTripAdmin(EstimatedCountMixin, admin.ModelAdmin):
     """Admin for road trips"""
     list_display = [
         'title', 'destination', 'organizer', 'departure_date', 
@@ -46,16 +51,37 @@ class RoadTripAdmin(admin.ModelAdmin):
     inlines = [TripEligibilityInline, TripParticipantInline]
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('organizer')
+        # Counted per row of the page only, rather than grouping the whole table
+        confirmed = TripParticipant.objects.filter(trip=OuterRef('pk'), status='confirmed').order_by().values(
+            'trip'
+        ).annotate(count=Count('pk')).values('count')
+        return super().get_queryset(request).select_related('organizer').annotate(
+            confirmed_total=Coalesce(Subquery(confirmed), 0)
+        )
+    
+    def participant_count(self, obj):
+        return obj.confirmed_total
+    participant_count.short_description = 'Participant count'
+    participant_count.admin_order_field = 'confirmed_total'
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # The eligibility inline is saved by now, so the audience is known
+        feed.publish(form.instance)
 
 
 @admin.register(TripEligibility)
-class TripEligibilityAdmin(admin.ModelAdmin):
+class TripEligibilityAdmin(EstimatedCountMixin, admin.ModelAdmin):
     """Admin for trip eligibility"""
     list_display = ['trip', 'open_to_all', 'get_eligible_brands', 'get_eligible_types']
     list_filter = ['open_to_all']
     filter_horizontal = ['eligible_brands', 'eligible_models', 'eligible_types']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('trip').prefetch_related(
+            'eligible_brands', 'eligible_types'
+        )
+    
     def get_eligible_brands(self, obj):
         return ", ".join([brand.name for brand in obj.eligible_brands.all()[:3]])
     get_eligible_brands.short_description = 'Eligible Brands'
@@ -66,7 +92,7 @@ class TripEligibilityAdmin(admin.ModelAdmin):
 
 
 @admin.register(TripParticipant)
-class TripParticipantAdmin(admin.ModelAdmin):
+class TripParticipantAdmin(EstimatedCountMixin, admin.ModelAdmin):
     """Admin for trip participants"""
     list_display = ['user', 'trip', 'status', 'joined_at']
     list_filter = ['status', 'joined_at']
@@ -78,7 +104,7 @@ class TripParticipantAdmin(admin.ModelAdmin):
 
 
 @admin.register(TripNotification)
-class TripNotificationAdmin(admin.ModelAdmin):
+class TripNotificationAdmin(EstimatedCountMixin, admin.ModelAdmin):
     """Admin for trip notifications"""
     list_display = ['recipient', 'trip', 'notification_type', 'title', 'is_read', 'created_at']
     list_filter = ['notification_type', 'is_read', 'created_at']
@@ -0,0 +1,157 @@
+"""
+Precomputed personal trip feeds, read with GET /api/trips/?feed=true.
+
+A user's feed lists the published, upcoming trips whose audience they are
+in (RoadTrip.audience(), who new-trip notifications go to), by departure
+date. publish() writes the entries when a trip is published (fan-out on
+write), so reading a feed page is a range over the (user, departure_date,
+trip) index of TripFeedEntry.
+
+A trip whose audience is larger than TRIP_FEED_FANOUT_LIMIT users, such as
+one open to all cars on a large site, gets a single shared entry instead,
+and each reader checks the trip's eligibility against their own cars
+(fan-out on read). The few trips everybody can join then cost one row
+rather than one per user.
+
+The signals take a trip out of the feeds when it stops being published;
+trips that have departed are skipped when reading and removed by
+trim_feeds(). Audiences are fixed at publish time, so a user who signs up
+or adds a car afterwards only sees the trip through a shared entry.
+The backfill_trip_feeds command publishes the trips that predate the feeds.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from cars.models import Car
+from .models import TripEligibility, TripFeedEntry
+
+
+def publish(trip):
+    """Write the feed entries of ``trip`` for its current audience, replacing any it had"""
+    TripFeedEntry.objects.filter(trip=trip).delete()
+    if trip.status != 'published' or not trip.is_upcoming:
+        return 0
+    limit = settings.TRIP_FEED_FANOUT_LIMIT
+    user_ids = list(trip.audience().values_list('id', flat=True)[:limit + 1])
+    if len(user_ids) > limit:
+        user_ids = [None]
+    entries = TripFeedEntry.objects.bulk_create(
+        [TripFeedEntry(trip=trip, user_id=user_id, departure_date=trip.departure_date) for user_id in user_ids],
+        batch_size=1000,
+    )
+    return len(entries)
+
+
+def trim_feeds():
+    """
+    Delete the entries of trips that have departed.
+    This can be called by a scheduled task, like send_trip_reminders().
+    """
+    deleted, _ = TripFeedEntry.objects.filter(departure_date__lte=timezone.now()).delete()
+    return deleted
+
+
+def in_audience(user):
+    """Q on shared TripFeedEntry rows: ``user`` is in the trip's audience, as RoadTrip.audience() decides"""
+    cars = Car.objects.filter(user=user)
+    eligibility = OuterRef('trip__eligibility')
+    through = {
+        'carbrand': (TripEligibility.eligible_brands.through, 'brand'),
+        'carmodel': (TripEligibility.eligible_models.through, 'model'),
+        'cartype': (TripEligibility.eligible_types.through, 'car_type'),
+    }
+    matches_car = Q()
+    for target, (model, car_field) in through.items():
+        matches_car |= Exists(model.objects.filter(
+            tripeligibility=eligibility, **{f'{target}__in': cars.values(car_field)}
+        ))
+    return ~Q(trip__organizer=user) & (
+        Q(trip__eligibility__isnull=True) | Q(trip__eligibility__open_to_all=True) | matches_car
+    )
+
+
+class FeedPagination(BasePagination):
+    """
+    Keyset pagination over the request user's feed. The cursor is the
+    (departure_date, trip id) of the last trip on the page and the next page
+    starts after it, so every page is an index range however deep the client
+    reads. There is no count and no previous link.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    def entries(self, request):
+        """The user's own entries and the shared ones they may see, each a sorted range of (departure_date, trip_id)"""
+        after = self.decode_cursor(request)
+        personal = TripFeedEntry.objects.filter(user=request.user)
+        shared = TripFeedEntry.objects.filter(user=None).filter(in_audience(request.user))
+        ranges = []
+        for entries in (personal, shared):
+            entries = entries.filter(departure_date__gt=timezone.now())
+            if after is not None:
+                departure_date, trip_id = after
+                entries = entries.filter(departure_date__gte=departure_date).exclude(
+                    departure_date=departure_date, trip_id__lte=trip_id
+                )
+            ranges.append(
+                entries.order_by('departure_date', 'trip_id').values_list('departure_date', 'trip_id')[:self.page_size + 1]
+            )
+        return ranges
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """The trips on the page, taken from ``queryset`` in feed order"""
+        rows = self.page_rows(request, [row for entries in self.entries(request) for row in entries])
+        trips = queryset.in_bulk([trip_id for _, trip_id in rows])
+        return [trips[trip_id] for _, trip_id in rows if trip_id in trips]
+
+    async def apaginate_queryset(self, queryset, request):
+        rows = [row for entries in self.entries(request) async for row in entries]
+        rows = self.page_rows(request, rows)
+        trips = await queryset.ain_bulk([trip_id for _, trip_id in rows])
+        return [trips[trip_id] for _, trip_id in rows if trip_id in trips]
+
+    def page_rows(self, request, rows):
+        rows = sorted(rows)[:self.page_size + 1]
+        self.request = request
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            departure_date, trip_id = base64.urlsafe_b64decode(encoded.encode()).decode().split(' ')
+            departure_date = datetime.fromisoformat(departure_date)
+            trip_id = int(trip_id)
+        except (TypeError, ValueError, UnicodeDecodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if timezone.is_naive(departure_date):
+            raise NotFound(self.invalid_cursor_message)
+        return departure_date, trip_id
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        departure_date, trip_id = self.last
+        cursor = base64.urlsafe_b64encode(f'{departure_date.isoformat()} {trip_id}'.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_data(self, data):
+        return {'next': self.get_next_link(), 'results': data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
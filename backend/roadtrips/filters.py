@@ -1,7 +1,12 @@
 from django_filters import rest_framework as filters
+from django.contrib.auth import get_user_model
 from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from .models import RoadTrip
 
+User = get_user_model()
+
 
 class RoadTripFilter(filters.FilterSet):
     """Advanced filtering for road trips"""
@@ -37,6 +42,28 @@ class RoadTripFilter(filters.FilterSet):
         help_text='Filter by organizer name'
     )
     
+    # Trip length filtering, on the parsed estimated distance and duration
+    distance_min = filters.NumberFilter(
+        field_name='distance_meters',
+        lookup_expr='gte',
+        help_text='Filter trips at least this many meters long'
+    )
+    distance_max = filters.NumberFilter(
+        field_name='distance_meters',
+        lookup_expr='lte',
+        help_text='Filter trips at most this many meters long'
+    )
+    duration_min = filters.NumberFilter(
+        field_name='duration_minutes',
+        lookup_expr='gte',
+        help_text='Filter trips lasting at least this many minutes'
+    )
+    duration_max = filters.NumberFilter(
+        field_name='duration_minutes',
+        lookup_expr='lte',
+        help_text='Filter trips lasting at most this many minutes'
+    )
+    
     # Location filtering
     destination_contains = filters.CharFilter(
         field_name='destination',
@@ -50,7 +77,8 @@ class RoadTripFilter(filters.FilterSet):
             'status', 'difficulty_level', 'organizer',
             'departure_date_after', 'departure_date_before',
             'upcoming_only', 'has_space', 'organizer_name',
-            'destination_contains'
+            'destination_contains', 'distance_min', 'distance_max',
+            'duration_min', 'duration_max'
         ]
     
     def filter_upcoming(self, queryset, name, value):
@@ -65,4 +93,42 @@ class RoadTripFilter(filters.FilterSet):
             # This would require a more complex query with annotations
             # For now, return all trips
             return queryset
-        return queryset
\ No newline at end of file
+        return queryset
+
+
+class AsyncRoadTripFilter(RoadTripFilter):
+    """
+    RoadTripFilter for the async views. Validating ?organizer= as a model
+    choice looks the user up synchronously, so the async views look it up
+    beforehand (see acheck_organizer) and filter on the id here.
+    """
+    organizer = filters.NumberFilter(field_name='organizer_id')
+
+
+async def acheck_organizer(request):
+    """Reject ?organizer= values that RoadTripFilter would, with its error"""
+    value = request.query_params.get('organizer')
+    if value in (None, ''):
+        return
+    try:
+        exists = await User.objects.filter(pk=value).aexists()
+    except (ValueError, TypeError):
+        exists = False
+    if not exists:
+        field = RoadTripFilter.base_filters['organizer'].field
+        raise ValidationError({'organizer': [field.error_messages['invalid_choice']]})
+
+
+class RoadTripOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that lists "my trips" by departure date unless asked
+    otherwise, the order of the (user, departure_date, trip) membership index,
+    and trips near a point nearest first
+    """
+
+    def get_default_ordering(self, view):
+        if view.request.query_params.get('my_trips') == 'true':
+            return ['memberships__departure_date', 'memberships__trip_id']
+        if 'near' in view.request.query_params:
+            return ['distance_km', 'id']
+        return super().get_default_ordering(view)
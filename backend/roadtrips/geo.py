@@ -0,0 +1,159 @@
+"""
+Trip coordinates and the ?near=lat,lon&radius_km= search.
+
+Meeting points and destinations are free text. resolve() finds the place
+they name in an offline gazetteer (TRIP_GAZETTEER_PATH, a CSV file of
+name,latitude,longitude rows; an alias is another row with the same
+coordinates), and locate() stores the coordinates on the trip when it is
+saved. Text naming no known place leaves them empty. The load_gazetteer
+command adds places from a GeoNames dump and locates existing trips again.
+
+The meeting point is also stored as a cell of a 0.1 degree grid, numbered
+row by row, so the cells of a bounding box form one contiguous range per
+row. near() turns the box around a point into those ranges, which are
+searches on the meeting_cell index, and keeps the trips whose haversine
+distance is within the radius.
+"""
+import csv
+import functools
+import math
+import re
+
+from django.conf import settings
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+CELL_DEGREES = 0.1
+ROWS = round(180 / CELL_DEGREES)
+COLUMNS = round(360 / CELL_DEGREES)
+
+
+def words(text):
+    return tuple(re.findall(r"[\w']+", text.casefold()))
+
+
+class Gazetteer:
+    def __init__(self, places, points):
+        self.places = places
+        # (name, latitude, longitude) of each place, under the first of its names
+        self.points = points
+        self.longest = max((len(name) for name in places), default=0)
+
+    def resolve(self, text):
+        """Coordinates of the longest place name in ``text``, the last one on a tie"""
+        tokens = words(text)
+        for length in range(min(self.longest, len(tokens)), 0, -1):
+            for start in range(len(tokens) - length, -1, -1):
+                coordinates = self.places.get(tokens[start:start + length])
+                if coordinates is not None:
+                    return coordinates
+        return None
+
+
+@functools.lru_cache(maxsize=4)
+def load_gazetteer(path):
+    places, names = {}, {}
+    with open(path, newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            coordinates = (float(row['latitude']), float(row['longitude']))
+            places[words(row['name'])] = coordinates
+            names.setdefault(coordinates, row['name'])
+    return Gazetteer(places, [(name, *coordinates) for coordinates, name in names.items()])
+
+
+def resolve(text):
+    """(latitude, longitude) of the place ``text`` names, or None"""
+    if not text:
+        return None
+    return load_gazetteer(str(settings.TRIP_GAZETTEER_PATH)).resolve(text)
+
+
+def cell(latitude, longitude):
+    row = min(int((latitude + 90) / CELL_DEGREES), ROWS - 1)
+    # Columns count eastwards from the antimeridian
+    column = int(((longitude + 180) % 360) / CELL_DEGREES) % COLUMNS
+    return row * COLUMNS + column
+
+
+def locate(trip):
+    """Set the coordinates of ``trip`` and its meeting point's cell from its text"""
+    trip.meeting_latitude, trip.meeting_longitude = resolve(trip.meeting_point) or (None, None)
+    trip.destination_latitude, trip.destination_longitude = resolve(trip.destination) or (None, None)
+    trip.meeting_cell = None
+    if trip.meeting_latitude is not None:
+        trip.meeting_cell = cell(trip.meeting_latitude, trip.meeting_longitude)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    (south, west, north, east) of the points within ``radius_km``; west and
+    east may lie past the antimeridian, and the box spans every longitude
+    when the circle reaches a pole.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    south = max(-90.0, latitude - math.degrees(angle))
+    north = min(90.0, latitude + math.degrees(angle))
+    spread = math.sin(angle) / math.cos(math.radians(latitude)) if abs(latitude) < 90 else 2
+    if south == -90 or north == 90 or spread >= 1:
+        return south, -180.0, north, 180.0
+    spread = math.degrees(math.asin(spread))
+    return south, longitude - spread, north, longitude + spread
+
+
+def cell_ranges(south, west, north, east):
+    """Inclusive (first, last) cell ranges covering the box, merged where they meet"""
+    first_row = cell(south, 0) // COLUMNS
+    last_row = cell(north, 0) // COLUMNS
+    if east - west >= 360 - CELL_DEGREES:
+        return [(first_row * COLUMNS, last_row * COLUMNS + COLUMNS - 1)]
+    west_column = cell(0, west) % COLUMNS
+    east_column = cell(0, east) % COLUMNS
+    ranges = []
+    for row in range(first_row, last_row + 1):
+        start = row * COLUMNS
+        if west_column <= east_column:
+            row_ranges = [(start + west_column, start + east_column)]
+        else:
+            # The box crosses the antimeridian
+            row_ranges = [(start, start + east_column), (start + west_column, start + COLUMNS - 1)]
+        for first, last in row_ranges:
+            if ranges and ranges[-1][1] + 1 == first:
+                ranges[-1] = (ranges[-1][0], last)
+            else:
+                ranges.append((first, last))
+    return ranges
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = (
+        math.sin((latitude2 - latitude1) / 2) ** 2
+        + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_km(latitude, longitude, prefix='meeting'):
+    """Haversine distance in km from the point to the trip's ``prefix`` coordinates, as an expression"""
+    latitude = math.radians(latitude)
+    point_latitude = Radians(F(f'{prefix}_latitude'))
+    a = (
+        Power(Sin((point_latitude - Value(latitude)) / 2), 2)
+        + Value(math.cos(latitude)) * Cos(point_latitude)
+        * Power(Sin((Radians(F(f'{prefix}_longitude')) - Value(math.radians(longitude))) / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a), output_field=FloatField())
+
+
+def near(queryset, latitude, longitude, radius_km):
+    """Trips in ``queryset`` meeting within ``radius_km`` of the point, with their ``distance_km``"""
+    cells = Q()
+    for first, last in cell_ranges(*bounding_box(latitude, longitude, radius_km)):
+        cells |= Q(meeting_cell__range=(first, last))
+    # As a subquery the cell ranges are read from the index whatever the
+    # outer ordering; inline, SQLite prefers walking the ordering's index
+    candidates = queryset.model.objects.filter(cells).values('pk')
+    return queryset.filter(pk__in=candidates).annotate(
+        distance_km=distance_km(latitude, longitude)
+    ).filter(distance_km__lte=radius_km)
@@ -0,0 +1,72 @@
+"""
+Parse the free-text estimated_distance and estimated_duration of trips.
+
+The text is whatever organizers typed: "500 miles", "800km", "1,200 km",
+"2 days", "6 hours 30 min", "1h30", "3-4 hours". Each number with its unit
+is converted and the parts are added up; a range counts as its midpoint, a
+number without a unit as kilometers or hours (minutes right after hours)
+and a number followed by another word ("3 stops") is skipped. Text with no
+number gives
+None, so the trip is left out of range filters rather than guessed at.
+"""
+import re
+
+METERS = {
+    'm': 1, 'meter': 1, 'meters': 1, 'metre': 1, 'metres': 1,
+    'km': 1000, 'kms': 1000, 'kilometer': 1000, 'kilometers': 1000, 'kilometre': 1000, 'kilometres': 1000,
+    'mi': 1609.344, 'mile': 1609.344, 'miles': 1609.344,
+}
+MINUTES = {
+    'm': 1, 'min': 1, 'mins': 1, 'minute': 1, 'minutes': 1,
+    'h': 60, 'hr': 60, 'hrs': 60, 'hour': 60, 'hours': 60,
+    'd': 1440, 'day': 1440, 'days': 1440, 'night': 1440, 'nights': 1440,
+    'w': 10080, 'wk': 10080, 'week': 10080, 'weeks': 10080,
+}
+
+NUMBER = r'\d+(?:[.,]\d+)?'
+QUANTITY = re.compile(rf'({NUMBER})(?:\s*(?:-|–|to)\s*({NUMBER}))?\s*([a-z]*)')
+
+
+def number(text):
+    # "1,200" is a thousands separator, "2,5" a decimal comma
+    if re.fullmatch(r'\d{1,3}(,\d{3})+', text):
+        return float(text.replace(',', ''))
+    return float(text.replace(',', '.'))
+
+
+def parse(text, units, default_unit):
+    if not text:
+        return None
+    total, found = 0.0, False
+    unit = None
+    for low, high, word in QUANTITY.findall(text.casefold()):
+        if word:
+            if word not in units:
+                # Not a length: "3 stops", "2 cars"
+                continue
+            unit = word
+        elif units is MINUTES and unit is not None and units[unit] == 60:
+            # "1h30": a bare number after hours is minutes
+            unit = 'min'
+        else:
+            unit = default_unit
+        value = number(low) if not high else (number(low) + number(high)) / 2
+        total += value * units[unit]
+        found = True
+    return round(total) if found else None
+
+
+def parse_distance(text):
+    """Meters in ``text`` such as "500 miles", or None"""
+    return parse(text, METERS, 'km')
+
+
+def parse_duration(text):
+    """Minutes in ``text`` such as "2 days", or None"""
+    return parse(text, MINUTES, 'hours')
+
+
+def measure(trip):
+    """Set the parsed distance and duration of ``trip`` from its text"""
+    trip.distance_meters = parse_distance(trip.estimated_distance)
+    trip.duration_minutes = parse_duration(trip.estimated_duration)
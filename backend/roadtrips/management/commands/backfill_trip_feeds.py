@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from roadtrips import feed
+from roadtrips.models import RoadTrip
+
+
+class Command(BaseCommand):
+    help = 'Write the feed entries of published, upcoming trips, e.g. those published before feeds existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of trips loaded per query')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        trips = RoadTrip.objects.filter(
+            status='published', departure_date__gt=timezone.now()
+        ).select_related('eligibility')
+        published = entries = 0
+        last_id = 0
+
+        while True:
+            batch = list(trips.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for trip in batch:
+                # Readers see the trip's old entries or its new ones, never none
+                with transaction.atomic():
+                    entries += feed.publish(trip)
+            published += len(batch)
+            self.stdout.write(f'Published {published} trips...')
+
+        self.stdout.write(self.style.SUCCESS(f'Published {published} trips to feeds with {entries} entries.'))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from roadtrips.lengths import measure
+from roadtrips.models import RoadTrip
+
+
+class Command(BaseCommand):
+    help = 'Parse the estimated distance and duration of trips into meters and minutes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of trips parsed per bulk update')
+        parser.add_argument('--all', action='store_true',
+                            help='Parse every trip again, not only those missing a value')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        trips = RoadTrip.objects.only('id', 'estimated_distance', 'estimated_duration')
+        if not options['all']:
+            trips = trips.filter(
+                Q(distance_meters__isnull=True) & ~Q(estimated_distance='') |
+                Q(duration_minutes__isnull=True) & ~Q(estimated_duration='')
+            )
+        parsed = unparsed = 0
+        last_id = 0
+
+        while True:
+            batch = list(trips.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for trip in batch:
+                measure(trip)
+                if (trip.estimated_distance and trip.distance_meters is None or
+                        trip.estimated_duration and trip.duration_minutes is None):
+                    unparsed += 1
+            RoadTrip.objects.bulk_update(batch, ['distance_meters', 'duration_minutes'])
+            parsed += len(batch)
+            self.stdout.write(f'Parsed {parsed} trips...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Parsed {parsed} trips, {unparsed} with a distance or duration that has no number.'
+        ))
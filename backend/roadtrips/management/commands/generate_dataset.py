@@ -0,0 +1,366 @@
+import bisect
+import math
+import multiprocessing
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+
+from accounts.availability import availability_index
+from accounts.models import CustomUser
+from cars.models import CarVariant, CarType, Car
+from roadtrips import feed, geo, lengths
+from roadtrips.models import RoadTrip, TripEligibility, TripMembership, TripParticipant, TripNotification
+
+PRESETS = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+EMAIL_DOMAIN = 'dataset.example.com'
+PASSWORD = 'Dataset-pass-123!'
+
+FIRST_NAMES = [
+    'Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn',
+    'Noa', 'Lior', 'Maya', 'Omer', 'Yael', 'Daniel', 'Sara', 'Amit', 'Tal', 'Eden',
+]
+LAST_NAMES = [
+    'Cohen', 'Levi', 'Smith', 'Garcia', 'Khan', 'Nguyen', 'Muller', 'Rossi', 'Silva', 'Novak',
+    'Mizrahi', 'Peretz', 'Brown', 'Lopez', 'Kim', 'Ivanov', 'Dubois', 'Costa', 'Berg', 'Sato',
+]
+DESTINATIONS = [
+    'Eilat', 'Dead Sea', 'Golan Heights', 'Mitzpe Ramon', 'Galilee', 'Haifa', 'Negev Desert',
+    'Mount Hermon', 'Caesarea', 'Timna Park', 'Lake Kinneret', 'Jerusalem Hills', 'Akko', 'Arad',
+]
+MEETING_POINTS = [
+    'Main gas station at the highway exit', 'Central bus station parking lot',
+    'Mall parking, north entrance', 'Train station car park', 'Beach promenade car park',
+]
+# Towns in the gazetteer, so the trips get coordinates
+MEETING_TOWNS = [
+    'Tel Aviv', 'Jerusalem', 'Haifa', 'Beer Sheva', 'Netanya', 'Rishon LeZion', 'Ashdod', 'Tiberias',
+]
+
+TIERS = (['free', 'premium', 'enterprise'], [80, 15, 5])
+DIFFICULTIES = (['easy', 'moderate', 'challenging'], [50, 35, 15])
+PARTICIPANT_STATUSES = (['confirmed', 'pending', 'declined'], [80, 15, 5])
+NOTIFICATION_TYPES = (
+    ['new_trip', 'participant_joined', 'trip_updated', 'trip_reminder', 'trip_cancelled'],
+    [60, 15, 10, 10, 5],
+)
+
+# Per-user averages; actual counts are drawn from an exponential distribution
+TRIPS_PER_USER = 0.05
+PARTICIPATIONS_PER_USER = 3
+NOTIFICATIONS_PER_USER = 8
+MAX_PARTICIPATIONS = 25
+MAX_NOTIFICATIONS = 60
+
+
+def chunk_rng(plan, phase, chunk):
+    """Random generator for one chunk, independent of which process runs it"""
+    return random.Random(f'{plan["seed"]}:{phase}:{chunk}')
+
+
+def chunk_range(plan, total, chunk):
+    start = chunk * plan['batch_size']
+    return range(start, min(start + plan['batch_size'], total))
+
+
+def trip_title(index):
+    return f'{DESTINATIONS[index % len(DESTINATIONS)]} run #{index + 1}'
+
+
+_popularity = {}
+
+
+def trip_popularity(plan):
+    """
+    Cumulative Zipf weights over trips in a seeded random order, so a few
+    trips attract most participants and notifications.
+    """
+    key = (plan['seed'], plan['trips'], plan['zipf'])
+    if key not in _popularity:
+        ranks = list(range(1, plan['trips'] + 1))
+        random.Random(f'{plan["seed"]}:popularity').shuffle(ranks)
+        cumulative, total = [], 0.0
+        for rank in ranks:
+            total += rank ** -plan['zipf']
+            cumulative.append(total)
+        _popularity.clear()
+        _popularity[key] = cumulative
+    return _popularity[key]
+
+
+def pick_trips(rng, cumulative, count):
+    """Draw up to ``count`` distinct trip indexes weighted by popularity"""
+    picked = set()
+    for _ in range(count):
+        picked.add(bisect.bisect_left(cumulative, rng.random() * cumulative[-1]))
+    return sorted(picked)
+
+
+def draw_count(rng, average, limit):
+    return min(int(rng.expovariate(1 / average)), limit) if average else 0
+
+
+def generate_users(plan, chunk):
+    """Users with one car each from the seeded catalog"""
+    rng = chunk_rng(plan, 'users', chunk)
+    catalog = plan['catalog']
+    users, cars = [], []
+    for n in chunk_range(plan, plan['users'], chunk):
+        user_id = plan['user_base'] + n
+        users.append(CustomUser(
+            id=user_id,
+            email=f'user{user_id}@{EMAIL_DOMAIN}',
+            name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            phone=f'+999{user_id:012d}',
+            password=plan['password'],
+            tier=rng.choices(*TIERS)[0],
+        ))
+        variant_id, model_id, brand_id = rng.choice(catalog['variants'])
+        cars.append(Car(
+            id=plan['car_base'] + n,
+            user_id=user_id,
+            brand_id=brand_id,
+            model_id=model_id,
+            variant_id=variant_id,
+            car_type_id=rng.choice(catalog['types']),
+        ))
+    CustomUser.objects.bulk_create(users, batch_size=plan['batch_size'])
+    Car.objects.bulk_create(cars, batch_size=plan['batch_size'])
+    return len(users) + len(cars)
+
+
+def generate_trips(plan, chunk):
+    """Trips with a mix of open, brand, type and model eligibility rules"""
+    rng = chunk_rng(plan, 'trips', chunk)
+    catalog = plan['catalog']
+    now = datetime.fromtimestamp(plan['now'], dt_timezone.utc)
+    cumulative = trip_popularity(plan)
+    expected_share = plan['users'] * PARTICIPATIONS_PER_USER / cumulative[-1]
+    through = {
+        'brands': TripEligibility.eligible_brands.through,
+        'models': TripEligibility.eligible_models.through,
+        'types': TripEligibility.eligible_types.through,
+    }
+    foreign_keys = {'brands': 'carbrand_id', 'models': 'carmodel_id', 'types': 'cartype_id'}
+
+    trips, eligibilities, rules = [], [], {name: [] for name in through}
+    for t in chunk_range(plan, plan['trips'], chunk):
+        trip_id = plan['trip_base'] + t
+        departure = now + timedelta(days=rng.uniform(-60, 180))
+        if departure < now:
+            status = 'completed' if rng.random() < 0.9 else 'cancelled'
+        else:
+            status = rng.choices(['published', 'draft', 'cancelled'], [85, 10, 5])[0]
+        weight = cumulative[t] - (cumulative[t - 1] if t else 0)
+        trip = RoadTrip(
+            id=trip_id,
+            title=trip_title(t),
+            destination=DESTINATIONS[t % len(DESTINATIONS)],
+            departure_date=departure,
+            meeting_point=f'{rng.choice(MEETING_POINTS)}, {MEETING_TOWNS[t % len(MEETING_TOWNS)]}',
+            description=f'Convoy to {DESTINATIONS[t % len(DESTINATIONS)]}, generated for load testing.',
+            organizer_id=plan['user_base'] + rng.randrange(plan['users']),
+            status=status,
+            max_participants=max(10, math.ceil(weight * expected_share * 1.5)),
+            estimated_duration=f'{rng.randint(2, 48)} hours',
+            estimated_distance=f'{rng.randint(50, 900)} km',
+            difficulty_level=rng.choices(*DIFFICULTIES)[0],
+        )
+        # bulk_create() skips the pre_save signals that locate and measure trips
+        geo.locate(trip)
+        lengths.measure(trip)
+        trips.append(trip)
+
+        eligibility_id = plan['eligibility_base'] + t
+        roll = rng.random()
+        eligibilities.append(TripEligibility(id=eligibility_id, trip_id=trip_id, open_to_all=roll < 0.4))
+        if roll < 0.4:
+            continue
+        name, size = ('brands', 3) if roll < 0.7 else ('types', 2) if roll < 0.9 else ('models', 4)
+        for target in rng.sample(catalog[name], min(rng.randint(1, size), len(catalog[name]))):
+            rules[name].append(through[name](**{
+                'tripeligibility_id': eligibility_id, foreign_keys[name]: target,
+            }))
+
+    RoadTrip.objects.bulk_create(trips, batch_size=plan['batch_size'])
+    TripEligibility.objects.bulk_create(eligibilities, batch_size=plan['batch_size'])
+    created = len(trips) + len(eligibilities)
+    for name, rows in rules.items():
+        through[name].objects.bulk_create(rows, batch_size=plan['batch_size'])
+        created += len(rows)
+    return created
+
+
+def generate_activity(plan, chunk):
+    """Participations and notifications for one slice of users, skewed towards popular trips"""
+    rng = chunk_rng(plan, 'activity', chunk)
+    cumulative = trip_popularity(plan)
+    participants, notifications = [], []
+    for n in chunk_range(plan, plan['users'], chunk):
+        user_id = plan['user_base'] + n
+        count = draw_count(rng, PARTICIPATIONS_PER_USER, MAX_PARTICIPATIONS)
+        for t in pick_trips(rng, cumulative, count):
+            participants.append(TripParticipant(
+                trip_id=plan['trip_base'] + t,
+                user_id=user_id,
+                status=rng.choices(*PARTICIPANT_STATUSES)[0],
+            ))
+
+        for _ in range(draw_count(rng, NOTIFICATIONS_PER_USER, MAX_NOTIFICATIONS)):
+            t = bisect.bisect_left(cumulative, rng.random() * cumulative[-1])
+            notification_type = rng.choices(*NOTIFICATION_TYPES)[0]
+            notifications.append(TripNotification(
+                recipient_id=user_id,
+                trip_id=plan['trip_base'] + t,
+                notification_type=notification_type,
+                title=f'{notification_type.replace("_", " ").capitalize()}: {trip_title(t)}',
+                message=f'Update about {trip_title(t)}.',
+                is_read=rng.random() < 0.7,
+                related_user_id=plan['user_base'] + rng.randrange(plan['users']),
+            ))
+    TripParticipant.objects.bulk_create(participants, batch_size=plan['batch_size'])
+    TripNotification.objects.bulk_create(notifications, batch_size=plan['batch_size'])
+    return len(participants) + len(notifications)
+
+
+def generate_memberships(plan, chunk):
+    """Memberships of one slice of trips; bulk_create() skipped the signals that add them"""
+    ids = chunk_range(plan, plan['trips'], chunk)
+    trips = RoadTrip.objects.filter(
+        id__gte=plan['trip_base'] + ids.start, id__lt=plan['trip_base'] + ids.stop
+    )
+    return len(TripMembership.objects.rebuild(trips))
+
+
+def generate_feeds(plan, chunk):
+    """Feed entries of one slice of trips, once their eligibility and the users' cars exist"""
+    ids = chunk_range(plan, plan['trips'], chunk)
+    trips = RoadTrip.objects.select_related('eligibility').filter(
+        id__gte=plan['trip_base'] + ids.start, id__lt=plan['trip_base'] + ids.stop
+    )
+    return sum(feed.publish(trip) for trip in trips)
+
+
+PHASES = [
+    ('users', 'users', generate_users),
+    ('trips', 'trips', generate_trips),
+    ('activity', 'users', generate_activity),
+    ('memberships', 'trips', generate_memberships),
+    ('feeds', 'trips', generate_feeds),
+]
+
+
+def run_chunk(task):
+    phase, plan, chunk = task
+    generate = {name: fn for name, _, fn in PHASES}[phase]
+    with transaction.atomic():
+        return generate(plan, chunk)
+
+
+class Command(BaseCommand):
+    help = 'Generate a large synthetic dataset of users, cars, trips, participants and notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=sorted(PRESETS), default='10k',
+                            help='Dataset size by number of users')
+        parser.add_argument('--users', type=int,
+                            help='Number of users, overriding the preset')
+        parser.add_argument('--trips', type=int,
+                            help=f'Number of trips (default: {TRIPS_PER_USER:g} per user)')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Random seed; the same seed on an empty database gives the same rows')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Users or trips generated and inserted per transaction')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes generating chunks in parallel')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Exponent of the power law that spreads participants over trips')
+
+    def handle(self, *args, **options):
+        users = options['users'] or PRESETS[options['preset']]
+        if users < 1 or options['batch_size'] < 1:
+            raise CommandError('--users and --batch-size must be positive')
+        catalog = self.load_catalog()
+
+        def next_id(model):
+            return (model.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+
+        plan = {
+            'seed': options['seed'],
+            'users': users,
+            'trips': options['trips'] or max(1, int(users * TRIPS_PER_USER)),
+            'batch_size': options['batch_size'],
+            'zipf': options['zipf'],
+            # Shared hash: hashing a million passwords would dominate the run
+            'password': make_password(PASSWORD),
+            'now': time.time(),
+            'catalog': catalog,
+            # Primary keys are assigned up front so chunks never look each other up
+            'user_base': next_id(CustomUser),
+            'car_base': next_id(Car),
+            'trip_base': next_id(RoadTrip),
+            'eligibility_base': next_id(TripEligibility),
+        }
+
+        started = time.perf_counter()
+        for phase, total_key, generate in PHASES:
+            chunks = math.ceil(plan[total_key] / plan['batch_size'])
+            tasks = [(phase, plan, chunk) for chunk in range(chunks)]
+            phase_started = time.perf_counter()
+            rows = sum(self.run_tasks(tasks, options['workers']))
+            elapsed = time.perf_counter() - phase_started
+            self.stdout.write(
+                f'{phase:>11}: {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)'
+            )
+
+        self.reset_sequences()
+        availability_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {plan["users"]} users and {plan["trips"]} trips '
+            f'in {time.perf_counter() - started:.1f}s (password: {PASSWORD})'
+        ))
+
+    def load_catalog(self):
+        variants = list(CarVariant.objects.values_list('id', 'model_id', 'model__brand_id'))
+        types = list(CarType.objects.values_list('id', flat=True))
+        if not variants or not types:
+            raise CommandError('The car catalog is empty; run seed_cars first')
+        return {
+            'variants': variants,
+            'brands': sorted({brand_id for _, _, brand_id in variants}),
+            'models': sorted({model_id for _, model_id, _ in variants}),
+            'types': types,
+        }
+
+    def run_tasks(self, tasks, workers):
+        if workers <= 1 or len(tasks) <= 1:
+            return [run_chunk(task) for task in tasks]
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.stderr.write('Parallel generation needs fork(); running in one process')
+            return [run_chunk(task) for task in tasks]
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.stderr.write('An in-memory database cannot be shared; running in one process')
+            return [run_chunk(task) for task in tasks]
+        # Children must open their own connections rather than share the parent's
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            return list(pool.imap_unordered(run_chunk, tasks))
+
+    def reset_sequences(self):
+        """Move sequences past the explicit primary keys (a no-op on SQLite)"""
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [CustomUser, Car, RoadTrip, TripEligibility]
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
@@ -0,0 +1,108 @@
+import csv
+import io
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from roadtrips import geo, meeting
+from roadtrips.models import RoadTrip
+
+# Columns of a GeoNames dump (readme.txt in https://download.geonames.org/export/dump/)
+NAME, ASCII_NAME, LATITUDE, LONGITUDE, FEATURE_CLASS, COUNTRY, POPULATION = 1, 2, 4, 5, 6, 8, 14
+LOCATED_FIELDS = [
+    'meeting_latitude', 'meeting_longitude', 'meeting_cell', 'destination_latitude', 'destination_longitude',
+]
+
+
+def read_dump(path):
+    """Lines of a GeoNames dump, either the .txt file or the .zip it is published in"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = [name for name in archive.namelist() if name.endswith('.txt') and name != 'readme.txt']
+            if not members:
+                raise CommandError(f'{path} holds no GeoNames .txt file.')
+            with archive.open(members[0]) as file:
+                yield from io.TextIOWrapper(file, encoding='utf-8')
+    else:
+        with open(path, encoding='utf-8') as file:
+            yield from file
+
+
+class Command(BaseCommand):
+    help = (
+        'Add the populated places of a GeoNames dump (e.g. cities15000.zip from '
+        'https://download.geonames.org/export/dump/, CC BY 4.0) to the trip gazetteer '
+        'at TRIP_GAZETTEER_PATH, then locate existing trips again. Where several places '
+        'share a name the most populous wins. Restart the workers to pick up the new file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump', help='GeoNames dump, as .txt or .zip')
+        parser.add_argument('--countries', default='',
+                            help='Comma-separated ISO country codes to keep, e.g. US,CA; all by default')
+        parser.add_argument('--min-population', type=int, default=0,
+                            help='Skip places with fewer inhabitants')
+        parser.add_argument('--replace', action='store_true',
+                            help='Drop the places already in the gazetteer instead of keeping them')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of trips located per bulk update')
+
+    def handle(self, *args, **options):
+        path = Path(settings.TRIP_GAZETTEER_PATH)
+        countries = {code.strip().upper() for code in options['countries'].split(',') if code.strip()}
+
+        rows, seen = [], set()
+        if not options['replace'] and path.exists():
+            with open(path, newline='', encoding='utf-8') as file:
+                for row in csv.DictReader(file):
+                    rows.append((row['name'], row['latitude'], row['longitude']))
+                    seen.add(geo.words(row['name']))
+        kept = len(rows)
+
+        places = []
+        for line in read_dump(options['dump']):
+            columns = line.rstrip('\n').split('\t')
+            if len(columns) <= POPULATION or columns[FEATURE_CLASS] != 'P':
+                continue
+            if countries and columns[COUNTRY] not in countries:
+                continue
+            population = int(columns[POPULATION] or 0)
+            if population < options['min_population']:
+                continue
+            places.append((population, columns))
+
+        for _, columns in sorted(places, key=lambda place: -place[0]):
+            # The ASCII spelling is an alias, so 'Montreal' finds Montréal too
+            for name in dict.fromkeys((columns[NAME], columns[ASCII_NAME])):
+                if name and geo.words(name) not in seen:
+                    rows.append((name, columns[LATITUDE], columns[LONGITUDE]))
+                    seen.add(geo.words(name))
+
+        rows.sort(key=lambda row: row[0].casefold())
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, suffix='.tmp', delete=False,
+                                         newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(['name', 'latitude', 'longitude'])
+            writer.writerows(rows)
+        os.replace(file.name, path)
+        geo.load_gazetteer.cache_clear()
+        meeting.load_candidates.cache_clear()
+        self.stdout.write(f'Wrote {len(rows)} place names to {path}, {len(rows) - kept} of them new.')
+
+        located = 0
+        last_id = 0
+        trips = RoadTrip.objects.only('id', 'meeting_point', 'destination').order_by('id')
+        while True:
+            batch = list(trips.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for trip in batch:
+                geo.locate(trip)
+                located += trip.meeting_latitude is not None or trip.destination_latitude is not None
+            RoadTrip.objects.bulk_update(batch, LOCATED_FIELDS)
+
+        self.stdout.write(self.style.SUCCESS(f'Located {located} trips.'))
@@ -0,0 +1,142 @@
+"""
+Candidate meeting points for a convoy, from GET /api/trips/{id}/meeting_points/.
+
+The members of a trip are its organizer and confirmed participants. Each
+starts from the home area they gave when joining, resolved through the
+gazetteer like trip locations, or else from their latest shared position.
+Every gazetteer place is a candidate. A member's detour through one is how
+much longer home -> candidate -> destination is than driving straight to
+the destination, or the distance home -> candidate when the destination is
+not located. Candidates are ranked by the total or by the largest detour.
+
+The candidates are kept as an array of unit vectors, computed once per
+gazetteer, so the distances from every member to every candidate are one
+NumPy matrix product turned into arcs. Rankings are cached per destination,
+set of member positions and objective, and computed again only when one of
+them changes.
+"""
+import functools
+import hashlib
+import json
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from backend.metrics import CACHE_REQUESTS
+from . import geo, telemetry
+from .models import TripParticipant
+
+OBJECTIVES = ('total', 'max')
+# Member positions are rounded to about 100 m, so a car creeping along
+# does not recompute the ranking on every fix
+KEY_PRECISION = 3
+
+
+def unit_vectors(coordinates):
+    """An (n, 3) array of unit vectors for a sequence of (latitude, longitude) in degrees"""
+    latitude, longitude = np.radians(np.asarray(coordinates, dtype=float).reshape(-1, 2)).T
+    return np.column_stack((
+        np.cos(latitude) * np.cos(longitude),
+        np.cos(latitude) * np.sin(longitude),
+        np.sin(latitude),
+    ))
+
+
+def central_angles(a, b):
+    """The (len(a), len(b)) matrix of central angles between two arrays of unit vectors"""
+    # Rounding can take the dot product of (anti)parallel vectors just past 1
+    return np.arccos(np.clip(a @ b.T, -1.0, 1.0))
+
+
+class Candidates:
+    """The gazetteer's places as unit vectors, for distances to all of them at once"""
+
+    def __init__(self, points):
+        self.points = points
+        self.vectors = unit_vectors([(latitude, longitude) for _, latitude, longitude in points])
+
+    def angles(self, origins):
+        """The central angle from each of ``origins`` to every candidate, one row per origin"""
+        return central_angles(unit_vectors(origins), self.vectors)
+
+    def rank(self, origins, destination=None, objective='total', limit=5):
+        """
+        The ``limit`` candidates with the smallest total detour of members
+        starting at ``origins``, a list of (latitude, longitude), or with
+        the smallest largest detour when ``objective`` is 'max'
+        """
+        # Detours stay in radians until the end: sums and maxima scale with them
+        detours = self.angles(origins)
+        if destination is not None:
+            target = unit_vectors([destination])
+            onward = central_angles(target, self.vectors)[0]
+            direct = central_angles(unit_vectors(origins), target)
+            detours += onward
+            detours -= direct
+        totals, largest = detours.sum(axis=0), detours.max(axis=0)
+        first, second = (totals, largest) if objective == 'total' else (largest, totals)
+        # lexsort orders by its last key first and is stable, so ties keep gazetteer order
+        best = np.lexsort((second, first))[:limit]
+        km = geo.EARTH_RADIUS_KM
+        return [
+            {
+                'name': self.points[i][0],
+                'latitude': self.points[i][1],
+                'longitude': self.points[i][2],
+                # The triangle inequality keeps detours from going below zero but rounding does not
+                'total_detour_km': round(max(0.0, float(totals[i]) * km), 1),
+                'max_detour_km': round(max(0.0, float(largest[i]) * km), 1),
+            }
+            for i in best
+        ]
+
+
+@functools.lru_cache(maxsize=4)
+def load_candidates(path):
+    return Candidates(geo.load_gazetteer(path).points)
+
+
+def origins(trip):
+    """
+    (member count, {user_id: (latitude, longitude)}) for the members of
+    ``trip``, from home areas and then shared positions
+    """
+    confirmed = TripParticipant.objects.filter(trip=trip, status='confirmed').values_list(
+        'user_id', 'home_latitude', 'home_longitude'
+    )
+    members = {trip.organizer_id: None}
+    for user_id, latitude, longitude in confirmed:
+        members[user_id] = (latitude, longitude) if latitude is not None else None
+    if None in members.values():
+        for position in telemetry.latest_positions(trip.id):
+            if members.get(position['user'], ()) is None:
+                members[position['user']] = (position['latitude'], position['longitude'])
+    return len(members), {user_id: origin for user_id, origin in members.items() if origin is not None}
+
+
+def meeting_points(trip, objective='total', limit=5):
+    """The ranked candidates for ``trip``, a RoadTrip with its organizer and destination coordinates"""
+    member_count, located = origins(trip)
+    destination = None
+    if trip.destination_latitude is not None:
+        destination = (trip.destination_latitude, trip.destination_longitude)
+    result = {'objective': objective, 'members': member_count, 'located': len(located), 'candidates': []}
+    if not located:
+        return result
+
+    points = sorted(
+        (round(latitude, KEY_PRECISION), round(longitude, KEY_PRECISION)) for latitude, longitude in located.values()
+    )
+    digest = hashlib.sha256(json.dumps([destination, objective, limit, points]).encode()).hexdigest()
+    cache = caches[settings.MEETING_POINTS_CACHE]
+    key = f'roadtrips:meeting-points:{digest}'
+    candidates = cache.get(key)
+    if candidates is None:
+        CACHE_REQUESTS.inc(cache='meeting_points', result='miss')
+        candidates = load_candidates(str(settings.TRIP_GAZETTEER_PATH)).rank(points, destination, objective, limit)
+        cache.set(key, candidates, settings.MEETING_POINTS_CACHE_TTL)
+    else:
+        CACHE_REQUESTS.inc(cache='meeting_points', result='hit')
+    result['candidates'] = candidates
+    return result
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadtrips', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='roadtrip',
+            name='roadtrips_r_status_13752e_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tripnotification',
+            name='roadtrips_t_recipie_41f21e_idx',
+        ),
+        migrations.AlterField(
+            model_name='tripnotification',
+            name='recipient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='trip_notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tripparticipant',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='trip_participations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='roadtrip',
+            index=models.Index(fields=['status', 'departure_date'], name='roadtrips_r_status_273972_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roadtrip',
+            index=models.Index(fields=['-created_at'], name='roadtrips_r_created_8c8d8a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripnotification',
+            index=models.Index(fields=['recipient', '-created_at'], name='roadtrips_t_recipie_c2bba5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripnotification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient'], name='notification_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripparticipant',
+            index=models.Index(fields=['trip', 'status'], name='roadtrips_t_trip_id_cf5c07_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripparticipant',
+            index=models.Index(fields=['user', 'trip'], name='roadtrips_t_user_id_21bd4a_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_memberships(apps, schema_editor):
+    RoadTrip = apps.get_model('roadtrips', 'RoadTrip')
+    TripParticipant = apps.get_model('roadtrips', 'TripParticipant')
+    TripMembership = apps.get_model('roadtrips', 'TripMembership')
+    memberships, departures = {}, {}
+    for trip_id, organizer_id, departure_date in RoadTrip.objects.values_list('id', 'organizer_id', 'departure_date'):
+        departures[trip_id] = departure_date
+        memberships[trip_id, organizer_id] = TripMembership(
+            trip_id=trip_id, user_id=organizer_id, role='organizer', departure_date=departure_date
+        )
+    for trip_id, user_id in TripParticipant.objects.values_list('trip_id', 'user_id').iterator():
+        memberships.setdefault((trip_id, user_id), TripMembership(
+            trip_id=trip_id, user_id=user_id, role='participant', departure_date=departures[trip_id]
+        ))
+    TripMembership.objects.bulk_create(memberships.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadtrips', '0002_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('organizer', 'Organizer'), ('participant', 'Participant')], max_length=20)),
+                ('departure_date', models.DateTimeField()),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='roadtrips.roadtrip')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='trip_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'departure_date', 'trip'], name='roadtrips_t_user_id_e45515_idx')],
+                'unique_together': {('trip', 'user')},
+            },
+        ),
+        migrations.RunPython(create_memberships, migrations.RunPython.noop),
+    ]
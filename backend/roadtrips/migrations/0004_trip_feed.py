@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadtrips', '0003_trip_membership'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripFeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('departure_date', models.DateTimeField()),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='roadtrips.roadtrip')),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='trip_feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Trip feed entries',
+                'indexes': [models.Index(fields=['user', 'departure_date', 'trip'], name='roadtrips_t_user_id_6052d0_idx')],
+                'unique_together': {('trip', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+from roadtrips import geo
+
+
+def locate_trips(apps, schema_editor):
+    RoadTrip = apps.get_model('roadtrips', 'RoadTrip')
+    trips = list(RoadTrip.objects.only('meeting_point', 'destination'))
+    for trip in trips:
+        geo.locate(trip)
+    RoadTrip.objects.bulk_update(trips, [
+        'meeting_latitude', 'meeting_longitude', 'meeting_cell', 'destination_latitude', 'destination_longitude',
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadtrips', '0004_trip_feed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roadtrip',
+            name='destination_latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='roadtrip',
+            name='destination_longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='roadtrip',
+            name='meeting_cell',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='roadtrip',
+            name='meeting_latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='roadtrip',
+            name='meeting_longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='roadtrip',
+            index=models.Index(fields=['meeting_cell'], name='roadtrips_r_meeting_cc8e98_idx'),
+        ),
+        migrations.RunPython(locate_trips, migrations.RunPython.noop),
+    ]
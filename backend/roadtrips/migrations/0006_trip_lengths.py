@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadtrips', '0005_trip_coordinates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roadtrip',
+            name='distance_meters',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='roadtrip',
+            name='duration_minutes',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='roadtrip',
+            index=models.Index(fields=['distance_meters'], name='roadtrips_r_distanc_430628_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roadtrip',
+            index=models.Index(fields=['duration_minutes'], name='roadtrips_r_duratio_b79314_idx'),
+        ),
+    ]
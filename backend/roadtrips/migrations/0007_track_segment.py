@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadtrips', '0006_trip_lengths'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField()),
+                ('points', models.TextField()),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_segments', to='roadtrips.roadtrip')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='track_segments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trip', 'ended_at'], name='roadtrips_t_trip_id_deb8fe_idx')],
+            },
+        ),
+    ]
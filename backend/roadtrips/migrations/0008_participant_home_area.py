@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadtrips', '0007_track_segment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripparticipant',
+            name='home_area',
+            field=models.CharField(blank=True, help_text='Where the participant drives from', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='tripparticipant',
+            name='home_latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='tripparticipant',
+            name='home_longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
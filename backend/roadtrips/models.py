@@ -3,7 +3,7 @@ from django.contrib.auth import get_user_model
 from django.core.validators import MinLengthValidator
 from django.utils import timezone
 from datetime import timedelta
-from cars.models import CarBrand, CarModel, CarType
+from cars.models import Car, CarBrand, CarModel, CarType
 
 User = get_user_model()
 
@@ -57,12 +57,34 @@ class RoadTrip(models.Model):
         default='easy'
     )
     
+    # Coordinates resolved from the text by roadtrips.geo; empty when the
+    # gazetteer does not know the place
+    meeting_latitude = models.FloatField(null=True, blank=True, editable=False)
+    meeting_longitude = models.FloatField(null=True, blank=True, editable=False)
+    meeting_cell = models.IntegerField(null=True, blank=True, editable=False)
+    destination_latitude = models.FloatField(null=True, blank=True, editable=False)
+    destination_longitude = models.FloatField(null=True, blank=True, editable=False)
+    
+    # estimated_distance and estimated_duration parsed by roadtrips.lengths;
+    # empty when the text has no number
+    distance_meters = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    duration_minutes = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['departure_date']),
-            models.Index(fields=['status']),
+            # ?status=...&upcoming=true and the reminders' published trips
+            # departing on a given day
+            models.Index(fields=['status', 'departure_date']),
             models.Index(fields=['organizer']),
+            # The default ordering of the trip list
+            models.Index(fields=['-created_at']),
+            # ?near=: grid cell ranges around the point
+            models.Index(fields=['meeting_cell']),
+            # ?distance_min=&distance_max= and ?duration_min=&duration_max=
+            models.Index(fields=['distance_meters']),
+            models.Index(fields=['duration_minutes']),
         ]
     
     def __str__(self):
@@ -80,11 +102,14 @@ class RoadTrip(models.Model):
     @property
     def is_full(self):
         """Check if trip has reached maximum participants"""
-        return self.participants.filter(status='confirmed').count() >= self.max_participants
+        return self.participant_count >= self.max_participants
     
     @property
     def participant_count(self):
         """Get current confirmed participant count"""
+        # Annotated, or set by loaders that count the trips of a page together
+        if 'confirmed_total' in self.__dict__:
+            return self.confirmed_total
         return self.participants.filter(status='confirmed').count()
     
     @property
@@ -92,6 +117,24 @@ class RoadTrip(models.Model):
         """Check if trip is in the future"""
         return self.departure_date > timezone.now()
 
+    def audience(self):
+        """
+        Users the trip is for: those with a car meeting its eligibility
+        criteria, or everyone when it has none. Never the organizer.
+        """
+        users = User.objects.exclude(id=self.organizer_id)
+        if not hasattr(self, 'eligibility') or self.eligibility.open_to_all:
+            return users
+        eligibility = self.eligibility
+        # One subquery over the cars' (brand|model|car_type, user) indexes,
+        # however many users match
+        cars = Car.objects.filter(
+            models.Q(brand__in=eligibility.eligible_brands.all()) |
+            models.Q(model__in=eligibility.eligible_models.all()) |
+            models.Q(car_type__in=eligibility.eligible_types.all())
+        )
+        return users.filter(id__in=cars.values('user'))
+
 
 class TripEligibility(models.Model):
     """Car eligibility criteria for trips"""
@@ -120,16 +163,17 @@ class TripEligibility(models.Model):
         if self.open_to_all:
             return True
         
-        # Get user's car
-        user_car = user.cars.first()  # Assuming user has at least one car
+        # Get user's first car; .all() rather than .first() and ids rather
+        # than .exists() so that prefetched cars and criteria are used
+        user_car = min(user.cars.all(), key=lambda car: car.pk, default=None)
         if not user_car:
             return False
         
         # Check if user's car matches any criteria
         return (
-            self.eligible_brands.filter(id=user_car.brand.id).exists() or
-            self.eligible_models.filter(id=user_car.model.id).exists() or
-            self.eligible_types.filter(id=user_car.car_type.id).exists()
+            user_car.brand_id in {brand.id for brand in self.eligible_brands.all()} or
+            user_car.model_id in {model.id for model in self.eligible_models.all()} or
+            user_car.car_type_id in {car_type.id for car_type in self.eligible_types.all()}
         )
 
 
@@ -143,7 +187,8 @@ class TripParticipant(models.Model):
     ]
     
     trip = models.ForeignKey(RoadTrip, on_delete=models.CASCADE, related_name='participants')
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trip_participations')
+    # (user, trip) in Meta.indexes covers lookups by user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trip_participations', db_index=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     
     # Timestamps
@@ -153,15 +198,108 @@ class TripParticipant(models.Model):
     # Optional participant details
     message = models.TextField(blank=True, help_text="Message from participant")
     emergency_contact = models.CharField(max_length=100, blank=True)
+    home_area = models.CharField(max_length=200, blank=True, help_text="Where the participant drives from")
+    
+    # Resolved from home_area by the gazetteer (see roadtrips.geo), for meeting point suggestions
+    home_latitude = models.FloatField(null=True, blank=True, editable=False)
+    home_longitude = models.FloatField(null=True, blank=True, editable=False)
     
     class Meta:
         unique_together = ('trip', 'user')
         ordering = ['joined_at']
+        indexes = [
+            # participant_count and is_full count confirmed participants per trip
+            models.Index(fields=['trip', 'status']),
+            # A user's trips (my_trips) without reading the participant rows
+            models.Index(fields=['user', 'trip']),
+        ]
     
     def __str__(self):
         return f"{self.user.name} - {self.trip.title} ({self.status})"
 
 
+class TripMembershipManager(models.Manager):
+    def rebuild(self, trips):
+        """
+        Recreate the memberships of ``trips`` (a RoadTrip queryset) from their
+        organizers and participants. For rows written without the signals that
+        maintain memberships, such as by bulk_create().
+        """
+        trip_ids = trips.values('id')
+        self.filter(trip__in=trip_ids).delete()
+        memberships, departures = {}, {}
+        for trip_id, organizer_id, departure_date in trips.values_list('id', 'organizer_id', 'departure_date'):
+            departures[trip_id] = departure_date
+            memberships[trip_id, organizer_id] = self.model(
+                trip_id=trip_id, user_id=organizer_id, role=TripMembership.ORGANIZER, departure_date=departure_date
+            )
+        participants = TripParticipant.objects.filter(trip__in=trip_ids).values_list('trip_id', 'user_id')
+        for trip_id, user_id in participants.iterator():
+            # An organizer who also joined their own trip stays the organizer
+            memberships.setdefault((trip_id, user_id), self.model(
+                trip_id=trip_id, user_id=user_id, role=TripMembership.PARTICIPANT,
+                departure_date=departures[trip_id],
+            ))
+        return self.bulk_create(memberships.values(), batch_size=1000)
+
+
+class TripMembership(models.Model):
+    """
+    A user's place in a trip, as organizer or participant.
+
+    "My trips" reads this instead of ORing the organizer with a join to the
+    participants: one row per user and trip, indexed by user and departure
+    date, so the list is a single index range in the order it is shown.
+    Maintained by the signals in signals.py; departure_date copies the trip's.
+    """
+    ORGANIZER = 'organizer'
+    PARTICIPANT = 'participant'
+    ROLE_CHOICES = [
+        (ORGANIZER, 'Organizer'),
+        (PARTICIPANT, 'Participant'),
+    ]
+
+    trip = models.ForeignKey(RoadTrip, on_delete=models.CASCADE, related_name='memberships')
+    # (user, departure_date, trip) in Meta.indexes covers lookups by user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trip_memberships', db_index=False)
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    departure_date = models.DateTimeField()
+
+    objects = TripMembershipManager()
+
+    class Meta:
+        unique_together = ('trip', 'user')
+        indexes = [
+            models.Index(fields=['user', 'departure_date', 'trip']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.trip.title} ({self.role})"
+
+
+class TripFeedEntry(models.Model):
+    """
+    A published, upcoming trip in a user's feed; see feed.py. An entry
+    without a user is shared by the trip's whole audience.
+    """
+    trip = models.ForeignKey(RoadTrip, on_delete=models.CASCADE, related_name='feed_entries')
+    # (user, departure_date, trip) in Meta.indexes covers lookups by user
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='trip_feed_entries', null=True, blank=True, db_index=False
+    )
+    departure_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('trip', 'user')
+        verbose_name_plural = "Trip feed entries"
+        indexes = [
+            models.Index(fields=['user', 'departure_date', 'trip']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.name if self.user else 'Everyone'}: {self.trip.title}"
+
+
 class TripNotification(models.Model):
     """Notifications for trip-related events"""
     NOTIFICATION_TYPES = [
@@ -176,7 +314,10 @@ class TripNotification(models.Model):
         ('trip_reminder', 'Trip Reminder'),
     ]
     
-    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trip_notifications')
+    # (recipient, -created_at) in Meta.indexes covers lookups by recipient
+    recipient = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='trip_notifications', db_index=False
+    )
     trip = models.ForeignKey(RoadTrip, on_delete=models.CASCADE, related_name='notifications')
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES)
     
@@ -199,9 +340,43 @@ class TripNotification(models.Model):
     class Meta:
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['recipient', 'is_read']),
+            # The notification list: a user's notifications, newest first
+            models.Index(fields=['recipient', '-created_at']),
             models.Index(fields=['created_at']),
+            # unread_count and mark_all_read only touch unread notifications
+            models.Index(
+                fields=['recipient'],
+                condition=models.Q(is_read=False),
+                name='notification_unread_idx',
+            ),
         ]
     
     def __str__(self):
         return f"Notification for {self.recipient.name}: {self.title}"
+
+
+class TrackSegment(models.Model):
+    """
+    A run of one car's GPS fixes during a trip, as flushed by
+    roadtrips.telemetry: an encoded polyline of (latitude, longitude, time)
+    deltas rather than one row per fix
+    """
+    trip = models.ForeignKey(RoadTrip, on_delete=models.CASCADE, related_name='track_segments')
+    # Only ever looked up within a trip
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='track_segments', db_index=False)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    point_count = models.PositiveIntegerField()
+    points = models.TextField()
+    # The last fix, for latest positions this process holds none of
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    
+    class Meta:
+        indexes = [
+            # Tracks since a time, and the latest fixes, of a trip
+            models.Index(fields=['trip', 'ended_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.point_count} fixes of user {self.user_id} in trip {self.trip_id}"
@@ -1,12 +1,14 @@
 from rest_framework import serializers
 from django.utils import timezone
 from datetime import timedelta
+from backend.serializers import ProfiledModelSerializer
 from .models import RoadTrip, TripEligibility, TripParticipant, TripNotification
+from . import feed
 from cars.models import CarBrand, CarModel, CarType
 from accounts.serializers import UserProfileSerializer
 
 
-class TripEligibilitySerializer(serializers.ModelSerializer):
+class TripEligibilitySerializer(ProfiledModelSerializer):
     """Serializer for trip eligibility criteria"""
     eligible_brands = serializers.PrimaryKeyRelatedField(
         queryset=CarBrand.objects.all(),
@@ -46,7 +48,7 @@ class TripEligibilitySerializer(serializers.ModelSerializer):
         return [car_type.name for car_type in obj.eligible_types.all()]
 
 
-class TripParticipantSerializer(serializers.ModelSerializer):
+class TripParticipantSerializer(ProfiledModelSerializer):
     """Serializer for trip participants"""
     user = UserProfileSerializer(read_only=True)
     user_id = serializers.IntegerField(write_only=True)
@@ -55,17 +57,19 @@ class TripParticipantSerializer(serializers.ModelSerializer):
         model = TripParticipant
         fields = [
             'id', 'user', 'user_id', 'status', 'joined_at', 'updated_at',
-            'message', 'emergency_contact'
+            'message', 'emergency_contact', 'home_area'
         ]
         read_only_fields = ['joined_at', 'updated_at']
 
 
-class RoadTripListSerializer(serializers.ModelSerializer):
+class RoadTripListSerializer(ProfiledModelSerializer):
     """Simplified serializer for trip listings"""
     organizer = UserProfileSerializer(read_only=True)
     participant_count = serializers.ReadOnlyField()
     is_full = serializers.ReadOnlyField()
     is_upcoming = serializers.ReadOnlyField()
+    # Only on ?near= results
+    distance_km = serializers.FloatField(read_only=True)
     
     class Meta:
         model = RoadTrip
@@ -73,11 +77,12 @@ class RoadTripListSerializer(serializers.ModelSerializer):
             'id', 'title', 'destination', 'departure_date', 'meeting_point',
             'organizer', 'status', 'max_participants', 'participant_count',
             'is_full', 'is_upcoming', 'difficulty_level', 'estimated_duration',
-            'estimated_distance', 'created_at'
+            'estimated_distance', 'distance_meters', 'duration_minutes', 'created_at', 'meeting_latitude', 'meeting_longitude',
+            'destination_latitude', 'destination_longitude', 'distance_km'
         ]
 
 
-class RoadTripDetailSerializer(serializers.ModelSerializer):
+class RoadTripDetailSerializer(ProfiledModelSerializer):
     """Detailed serializer for individual trip view"""
     organizer = UserProfileSerializer(read_only=True)
     eligibility = TripEligibilitySerializer(read_only=True)
@@ -97,9 +102,11 @@ class RoadTripDetailSerializer(serializers.ModelSerializer):
             'id', 'title', 'destination', 'departure_date', 'meeting_point',
             'description', 'organizer', 'status', 'max_participants',
             'participant_count', 'is_full', 'is_upcoming', 'difficulty_level',
-            'estimated_duration', 'estimated_distance', 'created_at', 'updated_at',
+            'estimated_duration', 'estimated_distance', 'distance_meters', 'duration_minutes',
+            'created_at', 'updated_at',
             'eligibility', 'participants', 'user_eligible', 'user_participating',
-            'user_participation_status'
+            'user_participation_status', 'meeting_latitude', 'meeting_longitude',
+            'destination_latitude', 'destination_longitude'
         ]
     
     def get_user_eligible(self, obj):
@@ -110,20 +117,21 @@ class RoadTripDetailSerializer(serializers.ModelSerializer):
         return False
     
     def get_user_participating(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.participants.filter(user=request.user).exists()
-        return False
+        return self.participation(obj) is not None
     
     def get_user_participation_status(self, obj):
+        participation = self.participation(obj)
+        return participation.status if participation else None
+    
+    def participation(self, obj):
+        """The current user's participation in the trip, looked up among its prefetched participants"""
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            participation = obj.participants.filter(user=request.user).first()
-            return participation.status if participation else None
+            return next((p for p in obj.participants.all() if p.user_id == request.user.id), None)
         return None
 
 
-class RoadTripCreateUpdateSerializer(serializers.ModelSerializer):
+class RoadTripCreateUpdateSerializer(ProfiledModelSerializer):
     """Serializer for creating and updating trips"""
     eligibility = TripEligibilitySerializer(required=False)
     
@@ -190,6 +198,9 @@ class RoadTripCreateUpdateSerializer(serializers.ModelSerializer):
         # Create eligibility criteria
         self._create_or_update_eligibility(trip, eligibility_data)
         
+        # Fan out to the feeds now that the audience is known
+        feed.publish(trip)
+        
         return trip
     
     def update(self, instance, validated_data):
@@ -201,9 +212,11 @@ class RoadTripCreateUpdateSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
         instance.save()
         
-        # Update eligibility criteria if provided
+        # Update eligibility criteria if provided; new criteria change who
+        # the trip is shown to
         if eligibility_data is not None:
             self._create_or_update_eligibility(instance, eligibility_data)
+            feed.publish(instance)
         
         return instance
     
@@ -234,7 +247,7 @@ class RoadTripCreateUpdateSerializer(serializers.ModelSerializer):
         eligibility.eligible_types.set(eligible_types)
 
 
-class TripNotificationSerializer(serializers.ModelSerializer):
+class TripNotificationSerializer(ProfiledModelSerializer):
     """Serializer for trip notifications"""
     trip = RoadTripListSerializer(read_only=True)
     related_user = UserProfileSerializer(read_only=True)
@@ -261,4 +274,10 @@ class JoinTripSerializer(serializers.Serializer):
         required=False,
         allow_blank=True,
         help_text="Emergency contact information"
+    )
+    home_area = serializers.CharField(
+        max_length=200,
+        required=False,
+        allow_blank=True,
+        help_text="Town or area you drive from, for meeting point suggestions"
     )
\ No newline at end of file
@@ -1,58 +1,47 @@
-from django.db.models.signals import post_save
+import time
+
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import RoadTrip, TripNotification, TripParticipant
+from backend.metrics import NOTIFICATION_FANOUT_DURATION, NOTIFICATION_FANOUT_SIZE
+from . import geo, lengths
+from .models import RoadTrip, TripFeedEntry, TripMembership, TripNotification, TripParticipant
 
 User = get_user_model()
 
 
+def record_fanout(event, size, started):
+    NOTIFICATION_FANOUT_SIZE.observe(size, event=event)
+    NOTIFICATION_FANOUT_DURATION.observe(time.perf_counter() - started, event=event)
+
+
+@receiver(pre_save, sender=RoadTrip)
+def locate_trip(sender, instance, **kwargs):
+    """Resolve the meeting point and destination to coordinates, from the in-memory gazetteer"""
+    geo.locate(instance)
+
+
+@receiver(pre_save, sender=RoadTrip)
+def measure_trip(sender, instance, **kwargs):
+    """Parse the estimated distance and duration into meters and minutes"""
+    lengths.measure(instance)
+
+
+@receiver(pre_save, sender=TripParticipant)
+def locate_participant(sender, instance, **kwargs):
+    """Resolve the participant's home area to coordinates"""
+    instance.home_latitude, instance.home_longitude = geo.resolve(instance.home_area) or (None, None)
+
+
 @receiver(post_save, sender=RoadTrip)
 def send_new_trip_notifications(sender, instance, created, **kwargs):
     """
     Send notifications to eligible users when a new trip is created
     """
     if created and instance.status == 'published':
-        # Get all users who might be eligible for this trip
-        eligible_users = []
-        
-        if hasattr(instance, 'eligibility'):
-            eligibility = instance.eligibility
-            
-            if eligibility.open_to_all:
-                # If open to all, notify all users except the organizer
-                eligible_users = User.objects.exclude(id=instance.organizer.id)
-            else:
-                # Find users with cars that match eligibility criteria
-                eligible_user_ids = set()
-                
-                # Check brand eligibility
-                if eligibility.eligible_brands.exists():
-                    brand_eligible_users = User.objects.filter(
-                        cars__brand__in=eligibility.eligible_brands.all()
-                    ).values_list('id', flat=True)
-                    eligible_user_ids.update(brand_eligible_users)
-                
-                # Check model eligibility
-                if eligibility.eligible_models.exists():
-                    model_eligible_users = User.objects.filter(
-                        cars__model__in=eligibility.eligible_models.all()
-                    ).values_list('id', flat=True)
-                    eligible_user_ids.update(model_eligible_users)
-                
-                # Check type eligibility
-                if eligibility.eligible_types.exists():
-                    type_eligible_users = User.objects.filter(
-                        cars__car_type__in=eligibility.eligible_types.all()
-                    ).values_list('id', flat=True)
-                    eligible_user_ids.update(type_eligible_users)
-                
-                # Get user objects and exclude organizer
-                eligible_users = User.objects.filter(
-                    id__in=eligible_user_ids
-                ).exclude(id=instance.organizer.id)
-        else:
-            # No eligibility criteria set, notify all users except organizer
-            eligible_users = User.objects.exclude(id=instance.organizer.id)
+        started = time.perf_counter()
+        eligible_users = instance.audience()
         
         # Create notifications for eligible users
         notifications_to_create = []
@@ -71,6 +60,7 @@ def send_new_trip_notifications(sender, instance, created, **kwargs):
         # Batch create notifications for performance
         if notifications_to_create:
             TripNotification.objects.bulk_create(notifications_to_create)
+        record_fanout('new_trip', len(notifications_to_create), started)
 
 
 @receiver(post_save, sender=RoadTrip)
@@ -79,6 +69,7 @@ def send_trip_update_notifications(sender, instance, created, **kwargs):
     Send notifications to participants when trip details are updated
     """
     if not created:  # Only for updates, not creation
+        started = time.perf_counter()
         # Get all confirmed participants
         participants = User.objects.filter(
             trip_participations__trip=instance,
@@ -102,6 +93,7 @@ def send_trip_update_notifications(sender, instance, created, **kwargs):
         # Batch create notifications
         if notifications_to_create:
             TripNotification.objects.bulk_create(notifications_to_create)
+        record_fanout('trip_updated', len(notifications_to_create), started)
 
 
 @receiver(post_save, sender=TripParticipant)
@@ -117,6 +109,64 @@ def send_participation_notifications(sender, instance, created, **kwargs):
         pass
 
 
+@receiver(post_save, sender=RoadTrip)
+def sync_trip_memberships(sender, instance, created, **kwargs):
+    """
+    Give a new trip's organizer their membership, and keep an updated trip's
+    memberships in step with its departure date and organizer
+    """
+    if created:
+        TripMembership.objects.create(
+            trip=instance, user_id=instance.organizer_id,
+            role=TripMembership.ORGANIZER, departure_date=instance.departure_date
+        )
+        return
+    memberships = TripMembership.objects.filter(trip=instance)
+    if memberships.filter(user_id=instance.organizer_id, role=TripMembership.ORGANIZER).exists():
+        memberships.update(departure_date=instance.departure_date)
+    else:
+        # The organizer was reassigned, which only the admin allows
+        TripMembership.objects.rebuild(RoadTrip.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=RoadTrip)
+def sync_trip_feed(sender, instance, created, **kwargs):
+    """
+    Take a trip that is no longer published out of the feeds, and keep the
+    entries of a published one in step with its departure date. Entries are
+    written by feed.publish() once the trip's eligibility is in place.
+    """
+    if created:
+        return
+    entries = TripFeedEntry.objects.filter(trip=instance)
+    if instance.status == 'published':
+        entries.update(departure_date=instance.departure_date)
+    else:
+        entries.delete()
+
+
+@receiver(post_save, sender=TripParticipant)
+def add_participant_membership(sender, instance, created, **kwargs):
+    """Give a new participant their membership"""
+    if created:
+        # An organizer joining their own trip keeps their organizer membership
+        TripMembership.objects.bulk_create([TripMembership(
+            trip_id=instance.trip_id, user_id=instance.user_id,
+            role=TripMembership.PARTICIPANT, departure_date=instance.trip.departure_date
+        )], ignore_conflicts=True)
+
+
+@receiver(post_delete, sender=TripParticipant)
+def remove_participant_membership(sender, instance, origin=None, **kwargs):
+    """Remove the membership of a participant who left"""
+    # Deleting the trip or the user deletes their memberships as well
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is TripParticipant:
+        TripMembership.objects.filter(
+            trip_id=instance.trip_id, user_id=instance.user_id, role=TripMembership.PARTICIPANT
+        ).delete()
+
+
 # Additional utility function to send trip reminders
 def send_trip_reminders():
     """
@@ -124,12 +174,16 @@ def send_trip_reminders():
     This can be called by a scheduled task (e.g., Celery) to send reminders
     """
     from django.utils import timezone
-    from datetime import timedelta
+    from datetime import datetime, timedelta
     
     # Find trips starting in 24 hours
-    tomorrow = timezone.now() + timedelta(hours=24)
+    started = time.perf_counter()
+    tomorrow = timezone.localdate(timezone.now() + timedelta(hours=24))
+    # A range over the day rather than departure_date__date, which wraps the
+    # column in a function and so cannot use an index
     upcoming_trips = RoadTrip.objects.filter(
-        departure_date__date=tomorrow.date(),
+        departure_date__gte=timezone.make_aware(datetime.combine(tomorrow, datetime.min.time())),
+        departure_date__lt=timezone.make_aware(datetime.combine(tomorrow + timedelta(days=1), datetime.min.time())),
         status='published'
     )
     
@@ -157,5 +211,6 @@ def send_trip_reminders():
     # Batch create reminder notifications
     if notifications_to_create:
         TripNotification.objects.bulk_create(notifications_to_create)
+    record_fanout('trip_reminder', len(notifications_to_create), started)
     
     return len(notifications_to_create)
\ No newline at end of file
@@ -0,0 +1,336 @@
+"""
+Live convoy positions, shared with POST /api/trips/{id}/telemetry/.
+
+The organizer and confirmed participants of a trip send batches of GPS
+fixes. TelemetryBuffer keeps each trip's fixes in a ring buffer and every
+car's latest fix in memory, so the latest positions (GET telemetry/) are
+served without reading tracks. A trip's fixes are flushed once there are
+TELEMETRY_FLUSH_POINTS of them or the oldest is TELEMETRY_FLUSH_SECONDS old,
+which a flusher thread checks every second, so trips that stop sending are
+stored too: one bulk insert with a TrackSegment per car, holding its fixes
+as an encoded polyline of (latitude, longitude, time) deltas. GET track/
+decodes the segments.
+
+The buffer belongs to the process. Fixes not flushed yet are flushed when
+it exits normally and lost when it is killed, and the latest positions of
+cars whose fixes went to another worker
+come from their stored segments of the last TELEMETRY_LIVE_SECONDS. When a
+trip's buffer is full because flushes fail, its oldest fixes are dropped.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from rest_framework.exceptions import ValidationError
+
+from backend.metrics import TELEMETRY_POINTS
+from .models import RoadTrip, TrackSegment, TripParticipant
+
+logger = logging.getLogger(__name__)
+
+# Coordinates are stored in units of 1e-5 degrees (about a meter) and times in milliseconds
+SCALE = 10 ** 5
+# Clock skew allowed for fixes stamped in the future
+FUTURE_TOLERANCE = 60  # seconds
+SWEEP_INTERVAL = 1  # seconds between looks for trips due a flush by age
+
+
+def encode_track(points):
+    """
+    Polyline text of integer triples, each stored as the difference from
+    the previous one: the encoding of Google's polyline format, with a
+    third value per point
+    """
+    chunks = []
+    previous = (0, 0, 0)
+    for point in points:
+        for value, before in zip(point, previous):
+            delta = value - before
+            delta = ~(delta << 1) if delta < 0 else delta << 1
+            while delta >= 0x20:
+                chunks.append(chr((0x20 | (delta & 0x1f)) + 63))
+                delta >>= 5
+            chunks.append(chr(delta + 63))
+        previous = point
+    return ''.join(chunks)
+
+
+def decode_track(text):
+    values = []
+    value = shift = 0
+    for char in text:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        if chunk & 0x20:
+            shift += 5
+            continue
+        values.append(~(value >> 1) if value & 1 else value >> 1)
+        value = shift = 0
+    points = []
+    latitude = longitude = offset = 0
+    for i in range(0, len(values), 3):
+        latitude += values[i]
+        longitude += values[i + 1]
+        offset += values[i + 2]
+        points.append((latitude, longitude, offset))
+    return points
+
+
+def milliseconds(moment):
+    return round(moment.timestamp() * 1000)
+
+
+def from_milliseconds(value):
+    return datetime.fromtimestamp(value / 1000, dt_timezone.utc)
+
+
+def parse_fixes(data):
+    """
+    (milliseconds, latitude, longitude) fixes, in stored units, from a
+    request body of {"points": [[latitude, longitude, unix_time], ...]}
+    """
+    points = data.get('points') if isinstance(data, dict) else None
+    if not isinstance(points, list) or not points:
+        raise ValidationError({'points': 'Expected a non-empty list of [latitude, longitude, unix_time].'})
+    if len(points) > settings.TELEMETRY_MAX_BATCH_POINTS:
+        raise ValidationError({'points': f'At most {settings.TELEMETRY_MAX_BATCH_POINTS} points per request.'})
+    now = time.time()
+    oldest, newest = now - settings.TELEMETRY_MAX_FIX_AGE, now + FUTURE_TOLERANCE
+    fixes = []
+    for point in points:
+        try:
+            latitude, longitude, recorded = point
+            valid = -90 <= latitude <= 90 and -180 <= longitude <= 180 and oldest <= recorded <= newest
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise ValidationError({'points': f'Invalid point {point!r}: expected [latitude, longitude, unix_time] '
+                                             f'within the last {settings.TELEMETRY_MAX_FIX_AGE} seconds.'})
+        fixes.append((round(recorded * 1000), round(latitude * SCALE), round(longitude * SCALE)))
+    return fixes
+
+
+def shares_positions(trip, user):
+    """Whether ``user`` may send and read positions in ``trip``: its organizer or a confirmed participant"""
+    return trip.organizer_id == user.id or TripParticipant.objects.filter(
+        trip=trip, user=user, status='confirmed'
+    ).exists()
+
+
+def build_segments(trip_id, fixes):
+    """One TrackSegment per car from buffered (user_id, milliseconds, latitude, longitude) fixes"""
+    by_user = defaultdict(list)
+    for user_id, *fix in fixes:
+        by_user[user_id].append(fix)
+    segments = []
+    for user_id, user_fixes in by_user.items():
+        user_fixes.sort()
+        start, (end, latitude, longitude) = user_fixes[0][0], user_fixes[-1]
+        segments.append(TrackSegment(
+            trip_id=trip_id, user_id=user_id,
+            started_at=from_milliseconds(start), ended_at=from_milliseconds(end),
+            point_count=len(user_fixes),
+            points=encode_track([(lat, lon, at - start) for at, lat, lon in user_fixes]),
+            latitude=latitude / SCALE, longitude=longitude / SCALE,
+        ))
+    return segments
+
+
+class TelemetryBuffer:
+    """Per-process buffer of the trips' unflushed fixes and latest positions; see the module docstring"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # trip_id -> deque of (user_id, milliseconds, latitude, longitude)
+        self.pending = {}
+        # trip_id -> monotonic time its oldest pending fix was buffered
+        self.pending_since = {}
+        # trip_id -> {user_id: (milliseconds, latitude, longitude)}
+        self.latest = {}
+        # trip_id -> monotonic time of its last batch
+        self.received_at = {}
+        self.swept_at = time.monotonic()
+        self.flusher = None
+        self.stopping = threading.Event()
+
+    def add(self, trip_id, user_id, fixes):
+        """Buffer one car's fixes, flushing what is due; returns how many old fixes a full buffer dropped"""
+        if self.flusher is None and settings.TELEMETRY_FLUSH_THREAD:
+            self.start_flusher()
+        now = time.monotonic()
+        with self.lock:
+            pending = self.pending.get(trip_id)
+            if pending is None:
+                pending = self.pending[trip_id] = deque(maxlen=settings.TELEMETRY_BUFFER_POINTS)
+                self.pending_since[trip_id] = now
+            dropped = max(0, len(pending) + len(fixes) - pending.maxlen)
+            pending.extend((user_id, *fix) for fix in fixes)
+            latest = self.latest.setdefault(trip_id, {})
+            newest = max(fixes)
+            if user_id not in latest or latest[user_id] < newest:
+                latest[user_id] = newest
+            self.received_at[trip_id] = now
+            full = len(pending) >= settings.TELEMETRY_FLUSH_POINTS
+
+        TELEMETRY_POINTS.inc(len(fixes), outcome='accepted')
+        if dropped:
+            TELEMETRY_POINTS.inc(dropped, outcome='dropped')
+        if full:
+            self.flush([trip_id])
+        if now - self.swept_at > SWEEP_INTERVAL:
+            self.sweep(now)
+        return dropped
+
+    def start_flusher(self):
+        """Sweep from a daemon thread every SWEEP_INTERVAL seconds, and flush everything at exit"""
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.stopping.clear()
+            self.flusher = threading.Thread(target=self.run_flusher, name='telemetry-flusher', daemon=True)
+            self.flusher.start()
+        atexit.register(self.shutdown)
+
+    def run_flusher(self):
+        while not self.stopping.wait(SWEEP_INTERVAL):
+            try:
+                self.sweep(time.monotonic())
+            except Exception:
+                logger.exception('Telemetry sweep failed')
+            finally:
+                close_old_connections()
+
+    def shutdown(self):
+        """Stop the flusher and store every pending fix"""
+        atexit.unregister(self.shutdown)
+        self.stopping.set()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
+
+    def sweep(self, now):
+        """Flush the trips whose oldest fix waited TELEMETRY_FLUSH_SECONDS, and forget idle trips"""
+        with self.lock:
+            self.swept_at = now
+            due = [
+                trip_id for trip_id, since in self.pending_since.items()
+                if now - since > settings.TELEMETRY_FLUSH_SECONDS
+            ]
+            for trip_id, received_at in list(self.received_at.items()):
+                if now - received_at > settings.TELEMETRY_LIVE_SECONDS and trip_id not in self.pending:
+                    del self.received_at[trip_id]
+                    self.latest.pop(trip_id, None)
+        if due:
+            self.flush(due)
+
+    def flush(self, trip_ids=None):
+        """Store the pending fixes of ``trip_ids`` (default: every trip) as track segments"""
+        with self.lock:
+            taken = {
+                trip_id: self.pending.pop(trip_id) for trip_id in list(trip_ids or self.pending)
+                if trip_id in self.pending
+            }
+            for trip_id in taken:
+                del self.pending_since[trip_id]
+        if not taken:
+            return 0
+
+        try:
+            # Fixes of trips deleted since they were received have nowhere to go
+            existing = set(RoadTrip.objects.filter(id__in=taken).values_list('id', flat=True))
+            segments = [
+                segment for trip_id, fixes in taken.items() if trip_id in existing
+                for segment in build_segments(trip_id, fixes)
+            ]
+            with transaction.atomic():
+                TrackSegment.objects.bulk_create(segments, batch_size=500)
+        except IntegrityError:
+            logger.exception('Dropped the telemetry of trips %s', sorted(taken))
+            return 0
+        except DatabaseError:
+            # E.g. the database is locked: keep the fixes for the next flush
+            logger.warning('Could not flush the telemetry of trips %s', sorted(taken), exc_info=True)
+            self.requeue(taken)
+            return 0
+        TELEMETRY_POINTS.inc(sum(segment.point_count for segment in segments), outcome='stored')
+        return len(segments)
+
+    def requeue(self, taken):
+        now = time.monotonic()
+        with self.lock:
+            for trip_id, fixes in taken.items():
+                # Fixes received meanwhile are newer; the ring keeps the newest
+                newer = self.pending.get(trip_id, ())
+                pending = self.pending[trip_id] = deque(fixes, maxlen=settings.TELEMETRY_BUFFER_POINTS)
+                pending.extend(newer)
+                self.pending_since[trip_id] = now
+
+    def latest_positions(self, trip_id):
+        with self.lock:
+            return dict(self.latest.get(trip_id, {}))
+
+    def pending_fixes(self, trip_id):
+        with self.lock:
+            return list(self.pending.get(trip_id, ()))
+
+
+buffer = TelemetryBuffer()
+
+
+def latest_positions(trip_id):
+    """
+    The latest fix of every car in the trip, newest first: from memory, and
+    from the recently stored segments for cars this process has none of
+    """
+    positions = {
+        user_id: (at, latitude / SCALE, longitude / SCALE)
+        for user_id, (at, latitude, longitude) in buffer.latest_positions(trip_id).items()
+    }
+    since = from_milliseconds((time.time() - settings.TELEMETRY_LIVE_SECONDS) * 1000)
+    stored = TrackSegment.objects.filter(trip_id=trip_id, ended_at__gte=since).exclude(
+        user_id__in=list(positions)
+    ).order_by('ended_at').values_list('user_id', 'ended_at', 'latitude', 'longitude')
+    for user_id, ended_at, latitude, longitude in stored:
+        positions[user_id] = (milliseconds(ended_at), latitude, longitude)
+    return [
+        {'user': user_id, 'latitude': latitude, 'longitude': longitude, 'recorded_at': from_milliseconds(at)}
+        for user_id, (at, latitude, longitude) in sorted(positions.items(), key=lambda item: -item[1][0])
+    ]
+
+
+def tracks(trip_id, since, user_id=None):
+    """
+    Every car's fixes (or ``user_id``'s) recorded at or after ``since``, as
+    [latitude, longitude, unix_time] lists in time order: the stored
+    segments decoded, and the fixes this process has not flushed yet
+    """
+    since_ms = milliseconds(since)
+    segments = TrackSegment.objects.filter(trip_id=trip_id, ended_at__gte=since)
+    pending = buffer.pending_fixes(trip_id)
+    if user_id is not None:
+        segments = segments.filter(user_id=user_id)
+        pending = [fix for fix in pending if fix[0] == user_id]
+
+    by_user = defaultdict(list)
+    for segment_user, started_at, points in segments.values_list('user_id', 'started_at', 'points'):
+        start = milliseconds(started_at)
+        by_user[segment_user].extend(
+            (start + offset, latitude, longitude) for latitude, longitude, offset in decode_track(points)
+        )
+    for fix_user, *fix in pending:
+        by_user[fix_user].append(tuple(fix))
+    result = []
+    for track_user, fixes in sorted(by_user.items()):
+        points = [
+            [latitude / SCALE, longitude / SCALE, at / 1000]
+            for at, latitude, longitude in sorted(set(fixes)) if at >= since_ms
+        ]
+        if points:
+            result.append({'user': track_user, 'points': points})
+    return result
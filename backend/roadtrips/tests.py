@@ -1,3 +1,909 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from accounts.models import CustomUser
+from cars.models import Car, CarBrand, CarModel, CarType
+from . import geo, lengths, meeting, telemetry
+from .feed import FeedPagination, trim_feeds
+from .models import (
+    RoadTrip, TrackSegment, TripEligibility, TripFeedEntry, TripMembership, TripParticipant, TripNotification,
+)
+from .signals import send_new_trip_notifications, send_trip_reminders
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class GenerateDatasetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_cars', stdout=StringIO())
+
+    def generate(self, **options):
+        call_command('generate_dataset', stdout=StringIO(), **options)
+
+    def test_generates_related_rows(self):
+        self.generate(users=300, trips=20, batch_size=64, seed=7)
+
+        self.assertEqual(CustomUser.objects.count(), 300)
+        self.assertEqual(Car.objects.count(), 300)
+        self.assertEqual(RoadTrip.objects.count(), 20)
+        self.assertEqual(TripEligibility.objects.count(), 20)
+        self.assertTrue(TripEligibility.objects.filter(open_to_all=True).exists())
+        self.assertTrue(TripEligibility.objects.filter(open_to_all=False, eligible_brands__isnull=False).exists())
+        self.assertTrue(TripNotification.objects.exists())
+        members = set(RoadTrip.objects.values_list('id', 'organizer_id'))
+        members |= set(TripParticipant.objects.values_list('trip_id', 'user_id'))
+        self.assertEqual(set(TripMembership.objects.values_list('trip_id', 'user_id')), members)
+        self.assertTrue(TripFeedEntry.objects.exists())
+        user = CustomUser.objects.first()
+        self.assertTrue(user.check_password('Dataset-pass-123!'))
+
+        # Participants follow a power law: the busiest trip dwarfs the median one
+        per_trip = sorted(Counter(TripParticipant.objects.values_list('trip_id', flat=True)).values())
+        self.assertGreater(per_trip[-1], 3 * per_trip[len(per_trip) // 2])
+
+    def test_appends_after_existing_rows(self):
+        self.generate(users=50, trips=5, seed=1)
+        self.generate(users=50, trips=5, seed=1)
+        self.assertEqual(CustomUser.objects.count(), 100)
+        self.assertEqual(RoadTrip.objects.count(), 10)
+
+    def test_same_seed_gives_same_rows(self):
+        def snapshot():
+            return (
+                list(CustomUser.objects.order_by('id').values_list('id', 'email', 'name', 'tier')),
+                list(Car.objects.order_by('id').values_list('user_id', 'variant_id', 'car_type_id')),
+                list(RoadTrip.objects.order_by('id').values_list('organizer_id', 'status', 'max_participants')),
+                list(TripParticipant.objects.order_by('trip_id', 'user_id').values_list('trip_id', 'user_id', 'status')),
+                list(TripNotification.objects.order_by('id').values_list('recipient_id', 'trip_id', 'title')),
+            )
+
+        self.generate(users=120, trips=10, batch_size=50, seed=3)
+        first = snapshot()
+        CustomUser.objects.all().delete()
+        # Workers fall back to one process on the in-memory test database
+        self.generate(users=120, trips=10, batch_size=50, seed=3, workers=2, stderr=StringIO())
+        self.assertEqual(snapshot(), first)
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class TripMembershipTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer, cls.member, cls.other = [
+            CustomUser.objects.create_user(email=f'{name}@example.com', password='pass12345', name=name,
+                                           phone=f'+1555000000{n}')
+            for n, name in enumerate(['organizer', 'member', 'other'])
+        ]
+
+    def create_trip(self, organizer, days):
+        return RoadTrip.objects.create(
+            title=f'Trip in {days} days', destination='Mitzpe Ramon', meeting_point='Central station',
+            description='A drive through the desert.', organizer=organizer,
+            departure_date=timezone.now() + timedelta(days=days),
+        )
+
+    def memberships(self, trip):
+        return dict(TripMembership.objects.filter(trip=trip).values_list('user_id', 'role'))
+
+    def test_signals_maintain_memberships(self):
+        trip = self.create_trip(self.organizer, 10)
+        self.assertEqual(self.memberships(trip), {self.organizer.id: 'organizer'})
+
+        participant = TripParticipant.objects.create(trip=trip, user=self.member)
+        TripParticipant.objects.create(trip=trip, user=self.organizer)
+        self.assertEqual(self.memberships(trip), {self.organizer.id: 'organizer', self.member.id: 'participant'})
+
+        trip.departure_date += timedelta(days=1)
+        trip.save()
+        self.assertEqual(
+            set(TripMembership.objects.filter(trip=trip).values_list('departure_date', flat=True)),
+            {trip.departure_date},
+        )
+
+        participant.delete()
+        self.assertEqual(self.memberships(trip), {self.organizer.id: 'organizer'})
+
+        trip.organizer = self.other
+        trip.save()
+        # The previous organizer had joined the trip as well
+        self.assertEqual(self.memberships(trip), {self.other.id: 'organizer', self.organizer.id: 'participant'})
+
+        trip.delete()
+        self.assertFalse(TripMembership.objects.exists())
+
+    def test_my_trips_lists_memberships_by_departure(self):
+        organized = self.create_trip(self.member, 20)
+        joined = self.create_trip(self.organizer, 5)
+        TripParticipant.objects.create(trip=joined, user=self.member)
+        TripParticipant.objects.create(trip=organized, user=self.other)
+        self.create_trip(self.other, 1)
+
+        self.client.force_login(self.member)
+        url = reverse('roadtrips:roadtrip-list')
+        response = self.client.get(url, {'my_trips': 'true'})
+        self.assertEqual([trip['id'] for trip in response.json()['results']], [joined.id, organized.id])
+        response = self.client.get(url, {'my_trips': 'true', 'ordering': '-departure_date'})
+        self.assertEqual([trip['id'] for trip in response.json()['results']], [organized.id, joined.id])
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class TripFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_cars', stdout=StringIO())
+        cls.brands = list(CarBrand.objects.order_by('id')[:2])
+        cls.organizer, cls.reader, cls.other = users = [
+            CustomUser.objects.create_user(email=f'{name}@example.com', password='pass12345', name=name,
+                                           phone=f'+1555000001{n}')
+            for n, name in enumerate(['organizer', 'reader', 'other'])
+        ]
+        for user, brand in zip(users, [cls.brands[0], cls.brands[0], cls.brands[1]]):
+            Car.objects.create(user=user, brand=brand)
+
+    def setUp(self):
+        self.client.force_login(self.reader)
+
+    def create_trip(self, days, brands=None):
+        """A trip published through the API, which fans it out to the feeds"""
+        self.client.force_login(self.organizer)
+        eligibility = {'eligible_brands': [brand.id for brand in brands]} if brands else {'open_to_all': True}
+        response = self.client.post(reverse('roadtrips:roadtrip-list'), {
+            'title': f'Trip in {days} days', 'destination': 'Mitzpe Ramon', 'meeting_point': 'Central station',
+            'description': 'A drive through the desert.',
+            'departure_date': (timezone.now() + timedelta(days=days)).isoformat(), 'eligibility': eligibility,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.client.force_login(self.reader)
+        return RoadTrip.objects.get(title=f'Trip in {days} days')
+
+    def feed(self, user=None, **params):
+        if user is not None:
+            self.client.force_login(user)
+        response = self.client.get(reverse('roadtrips:roadtrip-list'), {'feed': 'true', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def cursor(self, page):
+        return parse_qs(urlparse(page['next']).query)['cursor'][0]
+
+    def feed_ids(self, user=None):
+        return [trip['id'] for trip in self.feed(user)['results']]
+
+    def test_feed_lists_the_audience_trips_by_departure(self):
+        later = self.create_trip(30)
+        sooner = self.create_trip(10, brands=[self.brands[0]])
+        other_brand = self.create_trip(5, brands=[self.brands[1]])
+        draft = self.create_trip(7)
+        draft.status = 'draft'
+        draft.save()
+
+        self.assertEqual(TripFeedEntry.objects.filter(trip=sooner).count(), 1)
+        self.assertEqual(self.feed_ids(), [sooner.id, later.id])
+        self.assertEqual(self.feed_ids(self.other), [other_brand.id, later.id])
+        self.assertEqual(self.feed_ids(self.organizer), [])
+
+    def test_cursor_pagination(self):
+        trips = [self.create_trip(days) for days in range(5, 10)]
+        with mock.patch.object(FeedPagination, 'page_size', 2):
+            pages, params = [], {}
+            while True:
+                page = self.feed(**params)
+                self.assertNotIn('count', page)
+                pages.append([trip['id'] for trip in page['results']])
+                if page['next'] is None:
+                    break
+                params = {'cursor': self.cursor(page)}
+        self.assertEqual(pages, [[trip.id for trip in trips[i:i + 2]] for i in range(0, 5, 2)])
+
+        response = self.client.get(reverse('roadtrips:roadtrip-list'), {'feed': 'true', 'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_large_audiences_share_one_entry(self):
+        with override_settings(TRIP_FEED_FANOUT_LIMIT=1):
+            everyone = self.create_trip(20)
+            brand = self.create_trip(10, brands=[self.brands[0]])
+            small = self.create_trip(5, brands=[self.brands[1]])
+
+        self.assertEqual(list(TripFeedEntry.objects.filter(trip=everyone).values_list('user', flat=True)), [None])
+        self.assertEqual(list(TripFeedEntry.objects.filter(trip=small).values_list('user', flat=True)), [self.other.id])
+        self.assertEqual(self.feed_ids(), [brand.id, everyone.id])
+        self.assertEqual(self.feed_ids(self.other), [small.id, everyone.id])
+        self.assertEqual(self.feed_ids(self.organizer), [])
+
+    def test_trips_leave_the_feed(self):
+        cancelled, moved, departed = [self.create_trip(days) for days in (10, 20, 30)]
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        self.assertFalse(TripFeedEntry.objects.filter(trip=cancelled).exists())
+
+        moved.departure_date = timezone.now() + timedelta(days=40)
+        moved.save()
+        RoadTrip.objects.filter(pk=departed.pk).update(departure_date=timezone.now() - timedelta(hours=1))
+        TripFeedEntry.objects.filter(trip=departed).update(departure_date=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.feed_ids(self.reader), [moved.id])
+
+        self.assertEqual(trim_feeds(), 2)
+        self.assertEqual(list(TripFeedEntry.objects.values_list('trip', flat=True)), [moved.id, moved.id])
+
+    def test_backfill_publishes_upcoming_trips(self):
+        sooner, later = self.create_trip(10, brands=[self.brands[0]]), self.create_trip(30)
+        draft, departed = self.create_trip(7), self.create_trip(20)
+        RoadTrip.objects.filter(pk=draft.pk).update(status='draft')
+        RoadTrip.objects.filter(pk=departed.pk).update(departure_date=timezone.now() - timedelta(hours=1))
+        TripFeedEntry.objects.all().delete()
+
+        out = StringIO()
+        call_command('backfill_trip_feeds', batch_size=1, stdout=out)
+        self.assertIn('Published 2 trips to feeds with 3 entries.', out.getvalue())
+        self.assertEqual(self.feed_ids(), [sooner.id, later.id])
+        self.assertEqual(self.feed_ids(self.other), [later.id])
+
+    def test_async_feed_matches_sync(self):
+        for days in range(5, 8):
+            self.create_trip(days)
+        auth = {'Authorization': f'Token {Token.objects.create(user=self.reader).key}'}
+        sync_url, async_url = reverse('roadtrips:roadtrip-list'), reverse('roadtrips:async_trip_list')
+        with mock.patch.object(FeedPagination, 'page_size', 2):
+            for params in [{}, {'cursor': self.cursor(self.feed())}]:
+                response = async_to_sync(self.async_client.get)(async_url, {'feed': 'true', **params}, headers=auth)
+                content = response.content.decode().replace(async_url, sync_url)
+                self.assertEqual(json.loads(content), self.feed(**params))
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class TripLocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer = CustomUser.objects.create_user(
+            email='organizer@example.com', password='pass12345', name='organizer', phone='+15550000000'
+        )
+
+    def create_trip(self, meeting_point, destination='Dead Sea'):
+        return RoadTrip.objects.create(
+            title='Located trip', destination=destination, meeting_point=meeting_point,
+            description='A drive to somewhere.', organizer=self.organizer,
+            departure_date=timezone.now() + timedelta(days=10),
+        )
+
+    def near(self, **params):
+        self.client.force_login(self.organizer)
+        return self.client.get(reverse('roadtrips:roadtrip-list'), params)
+
+    def test_trips_are_located_from_their_text(self):
+        trip = self.create_trip('Gas station at the exit, Tel Aviv')
+        self.assertEqual((trip.meeting_latitude, trip.meeting_longitude), (32.0853, 34.7818))
+        self.assertEqual((trip.destination_latitude, trip.destination_longitude), (31.559, 35.4732))
+        self.assertEqual(trip.meeting_cell, geo.cell(32.0853, 34.7818))
+
+        trip.meeting_point = 'The usual place'
+        trip.save()
+        trip.refresh_from_db()
+        self.assertIsNone(trip.meeting_latitude)
+        self.assertIsNone(trip.meeting_cell)
+        self.assertEqual(trip.destination_latitude, 31.559)
+
+    def test_resolve_prefers_the_longest_name(self):
+        self.assertEqual(geo.resolve('Picnic by the Sea of Galilee'), geo.resolve('Kinneret'))
+        self.assertEqual(geo.resolve('from haifa to the negev desert'), geo.resolve('Negev Desert'))
+        self.assertIsNone(geo.resolve('Nowhere in particular'))
+
+    def test_load_gazetteer_from_geonames(self):
+        def place(geonameid, name, ascii_name, latitude, longitude, country, population, feature_class='P'):
+            columns = [geonameid, name, ascii_name, '', latitude, longitude, feature_class, 'PPL', country]
+            return '\t'.join(columns + ['', '', '', '', '', str(population), '', '', 'America/Denver', '2024-01-01'])
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'gazetteer.csv')
+        shutil.copy(settings.TRIP_GAZETTEER_PATH, path)
+        dump = os.path.join(directory, 'cities.txt')
+        with open(dump, 'w', encoding='utf-8') as file:
+            file.write('\n'.join([
+                place('1', 'Denver', 'Denver', '39.73915', '-104.9847', 'US', 715522),
+                place('2', 'Springfield', 'Springfield', '37.21533', '-93.29824', 'US', 169176),
+                place('3', 'Springfield', 'Springfield', '39.80172', '-89.64371', 'US', 114394),
+                place('4', 'Montréal', 'Montreal', '45.50884', '-73.58781', 'CA', 1762949),
+                place('5', 'Rocky Mountains', 'Rocky Mountains', '48.0', '-113.0', 'US', 0, feature_class='T'),
+            ]) + '\n')
+
+        with override_settings(TRIP_GAZETTEER_PATH=path):
+            trip = self.create_trip('Union Station, Denver', destination='Springfield')
+            self.assertIsNone(trip.meeting_latitude)
+
+            out = StringIO()
+            call_command('load_gazetteer', dump, countries='us,ca', stdout=out)
+            self.addCleanup(geo.load_gazetteer.cache_clear)
+            self.assertIn('4 of them new', out.getvalue())
+            self.assertIn('Located 1 trips.', out.getvalue())
+
+            trip.refresh_from_db()
+            self.assertEqual((trip.meeting_latitude, trip.meeting_longitude), (39.73915, -104.9847))
+            # The most populous of the places sharing a name
+            self.assertEqual(trip.destination_latitude, 37.21533)
+            self.assertEqual(geo.resolve('Old Montreal'), geo.resolve('Montréal'))
+            self.assertIsNotNone(geo.resolve('Tel Aviv'))
+            self.assertIsNone(geo.resolve('Rocky Mountains'))
+
+            call_command('load_gazetteer', dump, countries='CA', replace=True, stdout=StringIO())
+            self.assertIsNone(geo.resolve('Tel Aviv'))
+            self.assertIsNotNone(geo.resolve('Montreal'))
+
+    def test_cell_ranges(self):
+        def covered(box, latitude, longitude):
+            cell = geo.cell(latitude, longitude)
+            return any(first <= cell <= last for first, last in geo.cell_ranges(*box))
+
+        # Across the antimeridian the box covers both edges of the grid
+        box = geo.bounding_box(0, 179.95, 20)
+        self.assertTrue(covered(box, 0.1, 179.9))
+        self.assertTrue(covered(box, -0.1, -179.9))
+        self.assertFalse(covered(box, 0, 0))
+        self.assertFalse(covered(box, 0, 179))
+        # Near a pole it spans every longitude, in one range
+        box = geo.bounding_box(89.95, 10, 20)
+        self.assertEqual((box[1], box[3]), (-180, 180))
+        self.assertEqual(len(geo.cell_ranges(*box)), 1)
+        self.assertTrue(covered(box, 89.9, -170))
+
+    def test_near_filters_by_distance(self):
+        tel_aviv = self.create_trip('Beach promenade, Tel Aviv')
+        netanya = self.create_trip('Netanya train station')
+        self.create_trip('Haifa port')
+        self.create_trip('The usual place')
+
+        response = self.near(near='32.0853,34.7818', radius_km=35)
+        results = response.json()['results']
+        self.assertEqual([trip['id'] for trip in results], [tel_aviv.id, netanya.id])
+        self.assertEqual(results[0]['distance_km'], 0)
+        self.assertAlmostEqual(results[1]['distance_km'], geo.haversine_km(32.0853, 34.7818, 32.3215, 34.8532), 6)
+
+        response = self.near(near='32.0853,34.7818', radius_km=10, ordering='-created_at')
+        self.assertEqual([trip['id'] for trip in response.json()['results']], [tel_aviv.id])
+
+        # Inside the corner of the bounding box but 29km away
+        response = self.near(near='31.8853,34.5818', radius_km=25)
+        self.assertEqual(response.json()['results'], [])
+
+    def test_near_rejects_bad_parameters(self):
+        for params in [{'near': 'Tel Aviv'}, {'near': '1,2,3'}, {'near': '91,0'}, {'near': 'nan,0'},
+                       {'near': '0,0', 'radius_km': '0'}, {'near': '0,0', 'radius_km': '1000'},
+                       {'near': '0,0', 'radius_km': 'far'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.near(**params).status_code, 400)
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class TripLengthTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer = CustomUser.objects.create_user(
+            email='organizer@example.com', password='pass12345', name='organizer', phone='+15550000000'
+        )
+
+    def create_trip(self, distance='', duration=''):
+        return RoadTrip.objects.create(
+            title='Measured trip', destination='Eilat', meeting_point='Central station',
+            description='A long drive south.', organizer=self.organizer,
+            departure_date=timezone.now() + timedelta(days=10),
+            estimated_distance=distance, estimated_duration=duration,
+        )
+
+    def list_ids(self, **params):
+        self.client.force_login(self.organizer)
+        response = self.client.get(reverse('roadtrips:roadtrip-list'), params)
+        return [trip['id'] for trip in response.json()['results']]
+
+    def test_parse(self):
+        for text, meters in [('500 miles', 804672), ('800km', 800000), ('1,200 km', 1200000), ('2,5 km', 2500),
+                             ('about 300', 300000), ('3 stops, 120 km', 120000), ('far', None), ('', None)]:
+            with self.subTest(text=text):
+                self.assertEqual(lengths.parse_distance(text), meters)
+        for text, minutes in [('2 days', 2880), ('6 hours 30 min', 390), ('1h30', 90), ('3-4 hours', 210),
+                              ('1.5 hrs', 90), ('5', 300), ('3 to 4 days', 5040), ('a weekend', None)]:
+            with self.subTest(text=text):
+                self.assertEqual(lengths.parse_duration(text), minutes)
+
+    def test_trips_are_measured_on_save(self):
+        trip = self.create_trip('500 miles', '2 days')
+        self.assertEqual((trip.distance_meters, trip.duration_minutes), (804672, 2880))
+        trip.estimated_distance = 'not sure'
+        trip.save()
+        trip.refresh_from_db()
+        self.assertEqual((trip.distance_meters, trip.duration_minutes), (None, 2880))
+
+    def test_length_filters_and_ordering(self):
+        short = self.create_trip('80 km', '3 hours')
+        middle = self.create_trip('250 km', '1 day')
+        long = self.create_trip('900 km', '3 days')
+        self.create_trip('unknown', 'unknown')
+
+        self.assertEqual(self.list_ids(distance_min=100000, ordering='distance_meters'), [middle.id, long.id])
+        self.assertEqual(self.list_ids(distance_max=300000, ordering='-distance_meters'), [middle.id, short.id])
+        self.assertEqual(self.list_ids(duration_min=60, duration_max=1440, ordering='duration_minutes'),
+                         [short.id, middle.id])
+
+    def test_backfill_command(self):
+        RoadTrip.objects.bulk_create([RoadTrip(
+            title='Imported trip', destination='Eilat', meeting_point='Central station',
+            description='Created without signals.', organizer=self.organizer,
+            departure_date=timezone.now() + timedelta(days=10),
+            estimated_distance=distance, estimated_duration='6 hours',
+        ) for distance in ['300 km', 'a long way']])
+        self.assertFalse(RoadTrip.objects.filter(duration_minutes__isnull=False).exists())
+
+        out = StringIO()
+        call_command('backfill_trip_lengths', batch_size=1, stdout=out)
+        self.assertEqual(
+            sorted(RoadTrip.objects.values_list('distance_meters', 'duration_minutes'), key=str),
+            [(300000, 360), (None, 360)],
+        )
+        self.assertIn('Parsed 2 trips, 1 with', out.getvalue())
+
+
+@override_settings(
+    PERF_SAMPLE_RATE=0, TELEMETRY_FLUSH_THREAD=False, TELEMETRY_FLUSH_POINTS=1000, TELEMETRY_FLUSH_SECONDS=30,
+)
+class TelemetryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer, cls.driver, cls.pending, cls.outsider = [
+            CustomUser.objects.create_user(email=f'{name}@example.com', password='pass12345', name=name,
+                                           phone=f'+1555000000{n}')
+            for n, name in enumerate(['organizer', 'driver', 'pending', 'outsider'])
+        ]
+        cls.trip = RoadTrip.objects.create(
+            title='Convoy', destination='Eilat', meeting_point='Central station',
+            description='A convoy down south.', organizer=cls.organizer,
+            departure_date=timezone.now() + timedelta(days=10),
+        )
+        TripParticipant.objects.create(trip=cls.trip, user=cls.driver, status='confirmed')
+        TripParticipant.objects.create(trip=cls.trip, user=cls.pending, status='pending')
+
+    def setUp(self):
+        patcher = mock.patch.object(telemetry, 'buffer', telemetry.TelemetryBuffer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, user, points):
+        self.client.force_login(user)
+        return self.client.post(reverse('roadtrips:roadtrip-telemetry', args=[self.trip.id]),
+                                {'points': points}, content_type='application/json')
+
+    def get(self, viewer, route='roadtrip-telemetry', **params):
+        self.client.force_login(viewer)
+        return self.client.get(reverse(f'roadtrips:{route}', args=[self.trip.id]), params)
+
+    def drive(self, start, count, latitude=32.0853, longitude=34.7818):
+        """``count`` fixes a second apart from unix time ``start``, heading north-east"""
+        start = int(start)
+        return [[round(latitude + i * 0.0007, 5), round(longitude + i * 0.0003, 5), start + i] for i in range(count)]
+
+    def test_encoding_round_trip(self):
+        points = [(3208530, 3478180, 0), (3208460, 3478250, 1000), (-8999999, 17999999, 1500), (0, -18000000, 10 ** 9)]
+        self.assertEqual(telemetry.decode_track(telemetry.encode_track(points)), points)
+        self.assertEqual(telemetry.decode_track(''), [])
+
+    def test_latest_positions_are_served_from_memory(self):
+        now = time.time()
+        self.assertEqual(self.post(self.driver, self.drive(now - 20, 10)).status_code, 202)
+        response = self.post(self.organizer, self.drive(now - 5, 3, latitude=31.5))
+        self.assertEqual(response.json(), {'accepted': 3})
+
+        self.client.force_login(self.driver)
+        # Session, user, trip, participation, and the stored positions of cars missing from memory
+        with self.assertNumQueries(5):
+            positions = self.client.get(reverse('roadtrips:roadtrip-telemetry', args=[self.trip.id])).json()['positions']
+        self.assertEqual([position['user'] for position in positions], [self.organizer.id, self.driver.id])
+        self.assertEqual(positions[1]['latitude'], self.drive(now - 20, 10)[-1][0])
+        self.assertFalse(TrackSegment.objects.exists())
+
+    def test_only_the_convoy_shares_positions(self):
+        for user in (self.pending, self.outsider):
+            with self.subTest(user=user.name):
+                self.assertEqual(self.post(user, self.drive(time.time(), 1)).status_code, 403)
+                self.assertEqual(self.get(user).status_code, 403)
+                self.assertEqual(self.get(user, 'roadtrip-track').status_code, 403)
+
+    def test_bad_batches_are_rejected(self):
+        now = time.time()
+        for points in [[], 'far', [[32, 34]], [[91, 34, now]], [[32, 34, 'now']], [[32, 34, now - 7200]],
+                       [[32, 34, now + 3600]], self.drive(now - 1000, 1001)]:
+            with self.subTest(points=str(points)[:40]):
+                self.assertEqual(self.post(self.driver, points).status_code, 400)
+        self.assertEqual(telemetry.buffer.pending_fixes(self.trip.id), [])
+
+    @override_settings(TELEMETRY_FLUSH_POINTS=8)
+    def test_full_buffers_are_flushed_as_segments(self):
+        now = time.time()
+        driver, organizer = self.drive(now - 100, 6), self.drive(now - 100, 5, latitude=31.5)
+        self.post(self.driver, driver)
+        self.assertFalse(TrackSegment.objects.exists())
+        self.post(self.organizer, organizer[:3])
+        self.post(self.organizer, organizer[3:])
+
+        segments = {segment.user_id: segment for segment in TrackSegment.objects.all()}
+        self.assertEqual(sorted(segments), sorted([self.driver.id, self.organizer.id]))
+        self.assertEqual((segments[self.driver.id].point_count, segments[self.organizer.id].point_count), (6, 3))
+        self.assertLess(len(segments[self.driver.id].points), 6 * 12)
+
+        # Tracks join the stored segments with the fixes still buffered
+        tracks = {track['user']: track['points'] for track in self.get(self.driver, 'roadtrip-track').json()['tracks']}
+        self.assertEqual(tracks, {self.driver.id: driver, self.organizer.id: organizer})
+        response = self.get(self.driver, 'roadtrip-track', since=int(now - 100) + 3, user=self.driver.id)
+        self.assertEqual(response.json()['tracks'], [{'user': self.driver.id, 'points': driver[3:]}])
+        self.assertEqual(self.get(self.driver, 'roadtrip-track', since='yesterday').status_code, 400)
+
+    def test_old_buffers_are_flushed_and_latest_positions_outlive_them(self):
+        self.post(self.driver, self.drive(time.time() - 10, 4))
+        telemetry.buffer.sweep(time.monotonic() + 31)
+        self.assertEqual(TrackSegment.objects.get().point_count, 4)
+
+        # Another process, or this one after a restart, has no fixes in memory
+        with mock.patch.object(telemetry, 'buffer', telemetry.TelemetryBuffer()):
+            positions = self.get(self.organizer).json()['positions']
+        self.assertEqual([position['user'] for position in positions], [self.driver.id])
+        self.assertEqual(positions[0]['longitude'], self.drive(0, 4)[-1][1])
+
+    @override_settings(TELEMETRY_BUFFER_POINTS=5)
+    def test_full_ring_buffers_drop_the_oldest_fixes(self):
+        fixes = telemetry.parse_fixes({'points': self.drive(time.time() - 10, 8)})
+        self.assertEqual(telemetry.buffer.add(self.trip.id, self.driver.id, fixes), 3)
+        self.assertEqual([fix[1:] for fix in telemetry.buffer.pending_fixes(self.trip.id)], fixes[3:])
+
+    def test_fixes_of_deleted_trips_are_dropped(self):
+        fixes = telemetry.parse_fixes({'points': self.drive(time.time() - 10, 3)})
+        telemetry.buffer.add(self.trip.id, self.driver.id, fixes)
+        RoadTrip.objects.filter(id=self.trip.id).delete()
+        self.assertEqual(telemetry.buffer.flush(), 0)
+        self.assertEqual(telemetry.buffer.pending_fixes(self.trip.id), [])
+
+
+@override_settings(PERF_SAMPLE_RATE=0, TELEMETRY_FLUSH_THREAD=False)
+class TelemetryFlusherTests(TransactionTestCase):
+    """The flusher thread writes through its own connection, so the fixtures must be committed"""
+
+    def setUp(self):
+        self.driver = CustomUser.objects.create_user(
+            email='driver@example.com', password='pass12345', name='Driver', phone='+15550000001'
+        )
+        self.trip = RoadTrip.objects.create(
+            title='Convoy', destination='Eilat', meeting_point='Central station',
+            description='A convoy down south.', organizer=self.driver,
+            departure_date=timezone.now() + timedelta(days=10),
+        )
+
+    @override_settings(TELEMETRY_FLUSH_SECONDS=0, TELEMETRY_FLUSH_THREAD=True)
+    def test_idle_trips_are_flushed_without_more_batches(self):
+        buffer = telemetry.TelemetryBuffer()
+        flushed_by = []
+        flushed = threading.Event()
+        flush = buffer.flush
+
+        def recording_flush(trip_ids=None):
+            try:
+                return flush(trip_ids)
+            finally:
+                flushed_by.append(threading.current_thread().name)
+                flushed.set()
+
+        buffer.flush = recording_flush
+        # Keep add() from sweeping itself
+        buffer.swept_at = time.monotonic() + 60
+        with mock.patch.object(telemetry, 'SWEEP_INTERVAL', 0.01):
+            buffer.add(self.trip.id, self.driver.id, telemetry.parse_fixes({'points': [[32.08, 34.78, time.time()]]}))
+            # No other batch arrives: the flusher thread has to store the fix
+            self.assertTrue(flushed.wait(5))
+            buffer.shutdown()
+        self.assertEqual(flushed_by[0], 'telemetry-flusher')
+        self.assertEqual(TrackSegment.objects.get().point_count, 1)
+
+    def test_shutdown_stores_pending_fixes(self):
+        buffer = telemetry.TelemetryBuffer()
+        buffer.add(self.trip.id, self.driver.id, telemetry.parse_fixes({'points': [[32.08, 34.78, time.time()]]}))
+        self.assertIsNone(buffer.flusher)
+        buffer.shutdown()
+        self.assertEqual(TrackSegment.objects.get().point_count, 1)
+
+
+@override_settings(PERF_SAMPLE_RATE=0, TELEMETRY_FLUSH_THREAD=False)
+class MeetingPointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer, cls.driver, cls.pending, cls.outsider = [
+            CustomUser.objects.create_user(email=f'{name}@example.com', password='pass12345', name=name,
+                                           phone=f'+1555000000{n}')
+            for n, name in enumerate(['organizer', 'driver', 'pending', 'outsider'])
+        ]
+        cls.trip = RoadTrip.objects.create(
+            title='Convoy', destination='Eilat', meeting_point='Central station',
+            description='A convoy down south.', organizer=cls.organizer,
+            departure_date=timezone.now() + timedelta(days=10),
+        )
+        TripParticipant.objects.create(trip=cls.trip, user=cls.driver, status='confirmed')
+        TripParticipant.objects.create(trip=cls.trip, user=cls.pending, status='pending', home_area='Metula')
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(telemetry, 'buffer', telemetry.TelemetryBuffer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.candidates = meeting.load_candidates(str(settings.TRIP_GAZETTEER_PATH))
+
+    def meeting_points(self, viewer, **params):
+        self.client.force_login(viewer)
+        return self.client.get(reverse('roadtrips:roadtrip-meeting-points', args=[self.trip.id]), params)
+
+    def pairwise(self, origins, destination, objective):
+        """The ranking from one haversine_km call per member and candidate"""
+        scores = []
+        for name, latitude, longitude in self.candidates.points:
+            detours = [
+                geo.haversine_km(*origin, latitude, longitude)
+                + (geo.haversine_km(latitude, longitude, *destination) - geo.haversine_km(*origin, *destination)
+                   if destination else 0)
+                for origin in origins
+            ]
+            total, largest = sum(detours), max(detours)
+            scores.append(((total, largest) if objective == 'total' else (largest, total), name, total, largest))
+        return sorted(scores)
+
+    def test_rank_matches_pairwise_distances(self):
+        origins = [(32.794, 34.9896), (32.0853, 34.7818), (31.7683, 35.2137), (31.252, 34.7915)]
+        for destination in [(29.5577, 34.9519), None]:
+            for objective in meeting.OBJECTIVES:
+                with self.subTest(destination=destination, objective=objective):
+                    ranked = self.candidates.rank(origins, destination, objective, limit=5)
+                    expected = self.pairwise(origins, destination, objective)[:5]
+                    self.assertEqual([candidate['name'] for candidate in ranked], [row[1] for row in expected])
+                    for candidate, (_, _, total, largest) in zip(ranked, expected):
+                        self.assertAlmostEqual(candidate['total_detour_km'], total, delta=0.06)
+                        self.assertAlmostEqual(candidate['max_detour_km'], largest, delta=0.06)
+
+    def test_members_start_from_home_areas_then_positions(self):
+        self.client.force_login(self.driver)
+        response = self.client.post(reverse('roadtrips:roadtrip-home-area', args=[self.trip.id]),
+                                    {'home_area': 'Our place in Haifa'})
+        self.assertEqual(response.json()['home_area'], 'Our place in Haifa')
+        self.assertEqual(self.meeting_points(self.driver).json(),
+                         {'objective': 'total', 'members': 2, 'located': 1,
+                          'candidates': self.candidates.rank([(32.794, 34.99)], (29.5577, 34.9519))})
+
+        # The organizer has no home area but shares a position; the pending participant's is ignored
+        self.client.force_login(self.organizer)
+        self.client.post(reverse('roadtrips:roadtrip-telemetry', args=[self.trip.id]),
+                         {'points': [[32.08531, 34.78179, int(time.time())]]}, content_type='application/json')
+        response = self.meeting_points(self.organizer, objective='max', limit=3)
+        self.assertEqual(response.json()['located'], 2)
+        self.assertEqual(response.json()['candidates'], self.candidates.rank(
+            [(32.085, 34.782), (32.794, 34.99)], (29.5577, 34.9519), 'max', 3
+        ))
+
+    def test_rankings_are_cached_per_member_positions(self):
+        TripParticipant.objects.filter(user=self.driver).update(home_latitude=32.794, home_longitude=34.9896)
+        first = self.meeting_points(self.driver).json()
+        with mock.patch.object(meeting.Candidates, 'rank', side_effect=AssertionError('not cached')):
+            self.assertEqual(self.meeting_points(self.organizer).json(), first)
+
+        participant = TripParticipant.objects.get(user=self.driver)
+        participant.home_area = 'Tel Aviv'
+        participant.save()
+        self.assertNotEqual(self.meeting_points(self.driver).json(), first)
+
+    def test_meeting_points_are_for_the_convoy(self):
+        for user in (self.pending, self.outsider):
+            with self.subTest(user=user.name):
+                self.assertEqual(self.meeting_points(user).status_code, 403)
+        for params in [{'objective': 'median'}, {'limit': 0}, {'limit': 'all'}, {'limit': 51}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.meeting_points(self.driver, **params).status_code, 400)
+        response = self.meeting_points(self.driver)
+        self.assertEqual(response.json(), {'objective': 'total', 'members': 2, 'located': 0, 'candidates': []})
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class AsyncReadEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_cars', stdout=StringIO())
+        call_command('generate_dataset', users=40, trips=30, seed=11, stdout=StringIO())
+        cls.user = CustomUser.objects.filter(trip_notifications__isnull=False).order_by('id').first()
+        cls.token = Token.objects.create(user=cls.user)
+        cls.trip = RoadTrip.objects.order_by('id').first()
+
+    def assertSameResponse(self, sync_url, async_url, **headers):
+        expected = self.client.get(sync_url, headers=headers)
+        response = async_to_sync(self.async_client.get)(async_url, headers=headers)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.get('WWW-Authenticate'), expected.get('WWW-Authenticate'))
+        # Pagination links point at the endpoint that was called
+        content = response.content.decode().replace(async_url.split('?')[0], sync_url.split('?')[0])
+        self.assertEqual(json.loads(content), json.loads(expected.content))
+        return response
+
+    def test_async_endpoints_match_sync(self):
+        auth = {'Authorization': f'Token {self.token.key}'}
+        trips, async_trips = reverse('roadtrips:roadtrip-list'), reverse('roadtrips:async_trip_list')
+        for query in ['', '?page=2', '?page=9', '?my_trips=true', '?status=published&ordering=departure_date',
+                      f'?organizer={self.trip.organizer_id}', '?search=trip', '?organizer=abc']:
+            with self.subTest(query=query):
+                self.assertSameResponse(trips + query, async_trips + query, **auth)
+
+        for trip_id in [self.trip.id, 0]:
+            self.assertSameResponse(
+                reverse('roadtrips:roadtrip-detail', args=[trip_id]),
+                reverse('roadtrips:async_trip_detail', args=[trip_id]), **auth
+            )
+
+        response = self.assertSameResponse(
+            reverse('roadtrips:tripnotification-list'), reverse('roadtrips:async_notification_list'), **auth
+        )
+        self.assertTrue(json.loads(response.content)['results'])
+        self.assertSameResponse(
+            reverse('roadtrips:tripnotification-unread-count'), reverse('roadtrips:async_unread_count'), **auth
+        )
+
+    def test_async_views_query_once_per_relation_from_the_calling_thread(self):
+        """
+        Serializing runs in the event loop, where a query would raise
+        SynchronousOnlyOperation; every query comes from the async ORM,
+        which runs it on the thread waiting for the event loop
+        """
+        auth = {'Authorization': f'Token {self.token.key}'}
+        execute = CursorWrapper._execute
+        threads = []
+
+        def recording_execute(cursor, *args):
+            threads.append(threading.current_thread())
+            return execute(cursor, *args)
+
+        cache.clear()
+        trips = reverse('roadtrips:async_trip_list')
+        # After the token and the page (and the count, on the first), one query
+        # each for participant counts, cars, car photos and monthly trip counts.
+        # The token is read every time, since the default cache is per-process.
+        for url, queries in [
+            (trips, 7), (trips + '?page=2', 6),
+            # The trip, its participants and their users, and the eligibility criteria
+            (reverse('roadtrips:async_trip_detail', args=[self.trip.id]), 11),
+            (reverse('roadtrips:async_notification_list'), 6),
+        ]:
+            with self.subTest(url=url):
+                threads.clear()
+                with mock.patch.object(CursorWrapper, '_execute', recording_execute):
+                    response = async_to_sync(self.async_client.get)(url, headers=auth)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(threads), queries)
+                self.assertEqual(set(threads), {threading.current_thread()})
+
+    def test_authentication_matches_sync(self):
+        unread, async_unread = reverse('roadtrips:tripnotification-unread-count'), reverse('roadtrips:async_unread_count')
+        response = self.assertSameResponse(unread, async_unread)
+        self.assertEqual(response.status_code, 401)
+        self.assertSameResponse(unread, async_unread, Authorization='Token not-a-token')
+
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        response = self.assertSameResponse(unread, async_unread)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(PERF_SAMPLE_RATE=0)
+class QueryPlanTests(TestCase):
+    """
+    The hot queries are run for real against a seeded database, and each
+    statement they issue is EXPLAINed: none may scan a whole table, with or
+    without an index, instead of searching an index.
+    Without ANALYZE statistics SQLite plans as if every table were large, so
+    the plans do not depend on how many rows were seeded.
+    """
+
+    # The car catalog is small and read whole on purpose
+    SMALL_TABLES = {model._meta.db_table for model in (CarBrand, CarModel, CarType)}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_cars', stdout=StringIO())
+        call_command('generate_dataset', users=120, trips=40, seed=5, stdout=StringIO())
+        cls.user = CustomUser.objects.filter(
+            trip_participations__isnull=False, trip_notifications__isnull=False
+        ).order_by('id').first()
+        cls.trip = RoadTrip.objects.filter(participants__isnull=False).order_by('id').first()
+
+    def full_scans(self, queries):
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if not re.match(r'(SELECT|UPDATE|DELETE)\b', sql):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                for *_, detail in cursor.fetchall():
+                    # SCAN walks the whole table, in index order if USING INDEX
+                    match = re.match(r'SCAN (\w+)', detail)
+                    if match and match[1] not in self.SMALL_TABLES:
+                        scans.append(f'{detail}: {sql}')
+        return scans
+
+    def captured(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        self.assertTrue(queries.captured_queries)
+        return queries.captured_queries
+
+    def assertNoFullScans(self, run):
+        self.assertEqual(self.full_scans(self.captured(run)), [])
+
+    def test_plan_check_catches_full_scans(self):
+        queries = self.captured(lambda: list(RoadTrip.objects.filter(meeting_point='Depot')))
+        self.assertEqual(len(self.full_scans(queries)), 1)
+
+    def test_new_trip_fanout(self):
+        eligibility = TripEligibility.objects.create(trip=RoadTrip.objects.create(
+            title='Plan check', destination='Anywhere', departure_date=self.trip.departure_date,
+            meeting_point='Main square', description='Checking the query plans', organizer=self.user,
+        ), open_to_all=False)
+        eligibility.eligible_brands.set(CarBrand.objects.all()[:2])
+        eligibility.eligible_models.set(CarModel.objects.all()[:2])
+        eligibility.eligible_types.set(CarType.objects.all()[:2])
+        self.assertNoFullScans(lambda: send_new_trip_notifications(
+            RoadTrip, instance=eligibility.trip, created=True
+        ))
+
+    def test_trip_list_filters(self):
+        self.client.force_login(self.user)
+        url = reverse('roadtrips:roadtrip-list')
+        for query in ['?upcoming=true&status=published', '?status=draft', '?my_trips=true', '?organized=true',
+                      '?feed=true', '?near=32.08,34.78&radius_km=50', '?near=32.08,34.78&ordering=-created_at',
+                      '?distance_min=100000&distance_max=300000', '?duration_max=600&ordering=duration_minutes']:
+            with self.subTest(query=query):
+                self.assertNoFullScans(lambda: self.assertEqual(self.client.get(url + query).status_code, 200))
+
+    def test_my_trips_is_one_index_range(self):
+        self.client.force_login(self.user)
+        queries = self.captured(lambda: self.client.get(reverse('roadtrips:roadtrip-list'), {'my_trips': 'true'}))
+        page = next(query['sql'] for query in queries if 'tripmembership' in query['sql'] and 'LIMIT' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {page}')
+            plan = [detail for *_, detail in cursor.fetchall()]
+        self.assertIn('USING COVERING INDEX', plan[0])
+        self.assertFalse([detail for detail in plan if 'TEMP B-TREE' in detail], plan)
+
+    def test_trip_detail(self):
+        self.client.force_login(self.user)
+        url = reverse('roadtrips:roadtrip-detail', args=[self.trip.id])
+        self.assertNoFullScans(lambda: self.assertEqual(self.client.get(url).status_code, 200))
+
+    def test_notifications(self):
+        self.client.force_login(self.user)
+        for url, method in [
+            (reverse('roadtrips:tripnotification-list'), self.client.get),
+            (reverse('roadtrips:tripnotification-unread-count'), self.client.get),
+            (reverse('roadtrips:tripnotification-mark-all-read'), self.client.post),
+        ]:
+            with self.subTest(url=url):
+                self.assertNoFullScans(lambda: self.assertEqual(method(url).status_code, 200))
+
+    def test_trip_reminders(self):
+        self.assertNoFullScans(send_trip_reminders)
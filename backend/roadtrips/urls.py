@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import views
 from .views import RoadTripViewSet, TripNotificationViewSet
 
 # Create router and register viewsets
@@ -11,10 +12,19 @@ app_name = 'roadtrips'
 
 urlpatterns = [
     path('api/', include(router.urls)),
+
+    # Async variants of the hot read endpoints, for ASGI deployments
+    path('api/async/trips/', views.async_trip_list, name='async_trip_list'),
+    path('api/async/trips/<int:pk>/', views.async_trip_detail, name='async_trip_detail'),
+    path('api/async/notifications/', views.async_notification_list, name='async_notification_list'),
+    path('api/async/notifications/unread_count/', views.async_unread_count, name='async_unread_count'),
 ]
 
 # Available endpoints:
 # GET    /api/trips/                    - List all trips (with filtering)
+# GET    /api/trips/?feed=true          - The user's personal feed, by departure date (cursor pagination)
+# GET    /api/trips/?near=lat,lon&radius_km=25 - Trips meeting within radius_km of a point
+# GET    /api/trips/?distance_min=&distance_max=&duration_min=&duration_max= - Trips by parsed length (meters, minutes)
 # POST   /api/trips/                    - Create new trip
 # GET    /api/trips/{id}/               - Get trip details
 # PUT    /api/trips/{id}/               - Update trip (organizer only)
@@ -24,9 +34,17 @@ urlpatterns = [
 # POST   /api/trips/{id}/leave/         - Leave a trip
 # GET    /api/trips/{id}/participants/  - Get trip participants
 # POST   /api/trips/{id}/update_participant_status/ - Update participant status (organizer only)
+# POST   /api/trips/{id}/telemetry/     - Share a batch of GPS fixes (organizer and confirmed participants)
+# GET    /api/trips/{id}/telemetry/     - Latest position of every car in the trip
+# GET    /api/trips/{id}/track/?since=  - Tracks of the trip's cars since a unix time
+# POST   /api/trips/{id}/home_area/     - Set where you drive from (participants)
+# GET    /api/trips/{id}/meeting_points/?objective=total|max&limit=5 - Meeting points with the smallest detours
 #
 # GET    /api/notifications/            - List user's notifications
 # GET    /api/notifications/{id}/       - Get notification details
 # POST   /api/notifications/{id}/mark_read/ - Mark notification as read
 # POST   /api/notifications/mark_all_read/  - Mark all notifications as read
-# GET    /api/notifications/unread_count/   - Get unread notifications count
\ No newline at end of file
+# GET    /api/notifications/unread_count/   - Get unread notifications count
+#
+# GET    /api/async/trips/, /api/async/trips/{id}/, /api/async/notifications/,
+#        /api/async/notifications/unread_count/ - async variants of the reads above
\ No newline at end of file
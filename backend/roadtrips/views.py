@@ -1,10 +1,23 @@
-from django.shortcuts import render
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import Count
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from accounts.serializers import aprefetch_profiles
+from accounts.throttling import TelemetryRateThrottle, WriteRateThrottle
+from backend.async_api import async_api_view, render
+from backend.metrics import TRIP_JOINS
+from backend.pagination import CachedCountPageNumberPagination, UncountedPageNumberPagination
+from . import geo, meeting, telemetry
+from .feed import FeedPagination
+from .filters import AsyncRoadTripFilter, RoadTripFilter, RoadTripOrderingFilter, acheck_organizer
 from .models import RoadTrip, TripParticipant, TripNotification
 from .serializers import (
     RoadTripListSerializer,
@@ -39,13 +52,15 @@ class RoadTripViewSet(viewsets.ModelViewSet):
     ).all()
     
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, RoadTripOrderingFilter]
     
     # Filtering options
-    filterset_fields = ['status', 'difficulty_level', 'organizer']
+    filterset_class = RoadTripFilter
     search_fields = ['title', 'destination', 'description']
-    ordering_fields = ['departure_date', 'created_at', 'participant_count']
+    ordering_fields = ['departure_date', 'created_at', 'participant_count', 'distance_meters', 'duration_minutes']
     ordering = ['-created_at']
+    # Listing and reordering the same filters counts them once
+    pagination_class = CachedCountPageNumberPagination
     
     def get_serializer_class(self):
         """Return appropriate serializer based on action"""
@@ -56,6 +71,14 @@ class RoadTripViewSet(viewsets.ModelViewSet):
         else:
             return RoadTripDetailSerializer
     
+    def get_throttles(self):
+        """Throttle the write-heavy actions per user"""
+        if self.action in ['create', 'join', 'leave']:
+            return [WriteRateThrottle()]
+        if self.action == 'telemetry' and self.request.method == 'POST':
+            return [TelemetryRateThrottle()]
+        return super().get_throttles()
+    
     def get_queryset(self):
         """Filter queryset based on query parameters"""
         queryset = super().get_queryset()
@@ -72,17 +95,45 @@ class RoadTripViewSet(viewsets.ModelViewSet):
         
         # Filter by trips user is participating in
         if self.request.query_params.get('my_trips') == 'true':
-            queryset = queryset.filter(
-                Q(organizer=self.request.user) |
-                Q(participants__user=self.request.user)
-            ).distinct()
+            # One membership per user and trip, so no DISTINCT is needed
+            queryset = queryset.filter(memberships__user=self.request.user)
         
         # Filter by trips user organized
         if self.request.query_params.get('organized') == 'true':
             queryset = queryset.filter(organizer=self.request.user)
         
+        # Filter by trips meeting within radius_km of a point
+        if 'near' in self.request.query_params:
+            queryset = geo.near(queryset, *self.near_params())
+        
         return queryset
     
+    def near_params(self):
+        """(latitude, longitude, radius_km) from ?near=lat,lon&radius_km="""
+        params = self.request.query_params
+        try:
+            latitude, longitude = (float(value) for value in params['near'].split(','))
+        except ValueError:
+            raise ValidationError({'near': 'Expected "latitude,longitude".'})
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValidationError({'near': 'Latitude must be within ±90 and longitude within ±180.'})
+        try:
+            radius_km = float(params.get('radius_km', settings.TRIP_NEAR_DEFAULT_RADIUS_KM))
+        except ValueError:
+            raise ValidationError({'radius_km': 'Expected a number.'})
+        if not 0 < radius_km <= settings.TRIP_NEAR_MAX_RADIUS_KM:
+            raise ValidationError({'radius_km': f'Must be above 0 and at most {settings.TRIP_NEAR_MAX_RADIUS_KM}.'})
+        return latitude, longitude, radius_km
+    
+    def list(self, request, *args, **kwargs):
+        """List trips; ?feed=true lists the user's personal feed instead"""
+        if request.query_params.get('feed') != 'true':
+            return super().list(request, *args, **kwargs)
+        paginator = FeedPagination()
+        trips = paginator.paginate_queryset(self.queryset.all(), request)
+        serializer = self.get_serializer(trips, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
     def perform_create(self, serializer):
         """Set the organizer when creating a trip"""
         serializer.save(organizer=self.request.user)
@@ -115,6 +166,7 @@ class RoadTripViewSet(viewsets.ModelViewSet):
         
         # Check if user is already participating
         if trip.participants.filter(user=user).exists():
+            TRIP_JOINS.inc(outcome='already_joined')
             return Response(
                 {'error': 'You are already participating in this trip'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -122,6 +174,7 @@ class RoadTripViewSet(viewsets.ModelViewSet):
         
         # Check if trip is full
         if trip.is_full:
+            TRIP_JOINS.inc(outcome='full')
             return Response(
                 {'error': 'This trip is full'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -129,6 +182,7 @@ class RoadTripViewSet(viewsets.ModelViewSet):
         
         # Check if trip is in the past
         if not trip.is_upcoming:
+            TRIP_JOINS.inc(outcome='not_upcoming')
             return Response(
                 {'error': 'Cannot join a trip that has already started or ended'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -136,6 +190,7 @@ class RoadTripViewSet(viewsets.ModelViewSet):
         
         # Check eligibility
         if hasattr(trip, 'eligibility') and not trip.eligibility.is_user_eligible(user):
+            TRIP_JOINS.inc(outcome='ineligible')
             return Response(
                 {'error': 'Your car does not meet the eligibility criteria for this trip'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -149,7 +204,8 @@ class RoadTripViewSet(viewsets.ModelViewSet):
                 user=user,
                 status='confirmed',  # Auto-confirm for now
                 message=serializer.validated_data.get('message', ''),
-                emergency_contact=serializer.validated_data.get('emergency_contact', '')
+                emergency_contact=serializer.validated_data.get('emergency_contact', ''),
+                home_area=serializer.validated_data.get('home_area', '')
             )
             
             # Create notification for organizer
@@ -161,11 +217,13 @@ class RoadTripViewSet(viewsets.ModelViewSet):
                 message=f"{user.name} has joined your trip '{trip.title}'",
                 related_user=user
             )
+            TRIP_JOINS.inc(outcome='success')
             
             return Response(
                 TripParticipantSerializer(participant).data,
                 status=status.HTTP_201_CREATED
             )
+        TRIP_JOINS.inc(outcome='invalid')
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'])
@@ -214,6 +272,83 @@ class RoadTripViewSet(viewsets.ModelViewSet):
         serializer = TripParticipantSerializer(participants, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get', 'post'])
+    def telemetry(self, request, pk=None):
+        """Share a batch of GPS fixes (POST), or get the latest position of every car (GET)"""
+        # Only the columns the membership check needs, not the detail queryset
+        trip = get_object_or_404(RoadTrip.objects.only('id', 'organizer_id'), pk=pk)
+        if not telemetry.shares_positions(trip, request.user):
+            return Response(
+                {'error': 'Only the organizer and confirmed participants can share positions'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if request.method == 'POST':
+            fixes = telemetry.parse_fixes(request.data)
+            telemetry.buffer.add(trip.id, request.user.id, fixes)
+            return Response({'accepted': len(fixes)}, status=status.HTTP_202_ACCEPTED)
+        return Response({'positions': telemetry.latest_positions(trip.id)})
+    
+    @action(detail=True, methods=['get'])
+    def track(self, request, pk=None):
+        """Get the track of every car, or of ?user=, since ?since= (unix time; default an hour ago)"""
+        trip = get_object_or_404(RoadTrip.objects.only('id', 'organizer_id'), pk=pk)
+        if not telemetry.shares_positions(trip, request.user):
+            return Response(
+                {'error': 'Only the organizer and confirmed participants can see tracks'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            since = float(request.query_params.get('since', time.time() - 3600))
+            since = datetime.fromtimestamp(since, dt_timezone.utc)
+            user_id = request.query_params.get('user')
+            user_id = int(user_id) if user_id is not None else None
+        except (ValueError, OverflowError, OSError):
+            return Response(
+                {'error': 'since must be a unix time and user a user id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'tracks': telemetry.tracks(trip.id, since, user_id)})
+    
+    @action(detail=True, methods=['get'])
+    def meeting_points(self, request, pk=None):
+        """Suggest meeting points with the smallest ?objective=total (default) or max detour of the members"""
+        trip = get_object_or_404(
+            RoadTrip.objects.only('id', 'organizer_id', 'destination_latitude', 'destination_longitude'), pk=pk
+        )
+        if not telemetry.shares_positions(trip, request.user):
+            return Response(
+                {'error': 'Only the organizer and confirmed participants can see meeting points'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        objective = request.query_params.get('objective', 'total')
+        try:
+            limit = int(request.query_params.get('limit', settings.MEETING_POINTS_DEFAULT_LIMIT))
+        except ValueError:
+            limit = 0
+        if objective not in meeting.OBJECTIVES or not 1 <= limit <= settings.MEETING_POINTS_MAX_LIMIT:
+            return Response(
+                {'error': f'objective must be total or max and limit between 1 and {settings.MEETING_POINTS_MAX_LIMIT}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(meeting.meeting_points(trip, objective, limit))
+    
+    @action(detail=True, methods=['post'])
+    def home_area(self, request, pk=None):
+        """Set where you drive from, as a participant"""
+        trip = get_object_or_404(RoadTrip.objects.only('id'), pk=pk)
+        try:
+            participant = trip.participants.get(user=request.user)
+        except TripParticipant.DoesNotExist:
+            return Response(
+                {'error': 'You are not participating in this trip'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = JoinTripSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        participant.home_area = serializer.validated_data.get('home_area', '')
+        participant.save(update_fields=['home_area', 'home_latitude', 'home_longitude', 'updated_at'])
+        return Response(TripParticipantSerializer(participant).data)
+    
     @action(detail=True, methods=['post'])
     def update_participant_status(self, request, pk=None):
         """Update participant status (organizer only)"""
@@ -272,6 +407,8 @@ class TripNotificationViewSet(viewsets.ReadOnlyModelViewSet):
     """
     serializer_class = TripNotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Notifications pile up and are read newest first, a page or two deep
+    pagination_class = UncountedPageNumberPagination
     
     def get_queryset(self):
         """Return notifications for the current user"""
@@ -298,3 +435,83 @@ class TripNotificationViewSet(viewsets.ReadOnlyModelViewSet):
         """Get count of unread notifications"""
         count = self.get_queryset().filter(is_read=False).count()
         return Response({'unread_count': count})
+
+
+# -------------------------
+# Async read endpoints (served without a thread under ASGI)
+# -------------------------
+# These reuse the viewsets' querysets, filters and serializers. Everything the
+# serializers read is loaded beforehand through the async ORM: the page, then
+# participant counts, and the organizers' and other users' cars and trip
+# counts, a query each for the whole page. Serializing then runs no queries.
+
+def viewset_for(viewset_class, request, action, **kwargs):
+    return viewset_class(request=request, action=action, args=(), kwargs=kwargs, format_kwarg=None)
+
+
+async def afilter_trips(view):
+    """view.filter_queryset(view.get_queryset()), with ?organizer= looked up through the async ORM"""
+    await acheck_organizer(view.request)
+    view.filterset_class = AsyncRoadTripFilter
+    return view.filter_queryset(view.get_queryset())
+
+
+async def aload_participant_counts(trips):
+    """Set the confirmed participant count of every trip in ``trips`` from one grouped query"""
+    if not trips:
+        return
+    counts = TripParticipant.objects.filter(
+        trip__in={trip.id for trip in trips}, status='confirmed'
+    ).order_by().values('trip').annotate(count=Count('id'))
+    confirmed = {row['trip']: row['count'] async for row in counts}
+    for trip in trips:
+        trip.confirmed_total = confirmed.get(trip.id, 0)
+
+
+@async_api_view()
+async def async_trip_list(request):
+    view = viewset_for(RoadTripViewSet, request, 'list')
+    if request.query_params.get('feed') == 'true':
+        paginator = FeedPagination()
+        queryset = view.queryset.all()
+    else:
+        paginator = view.pagination_class()
+        queryset = await afilter_trips(view)
+    # The list shows no participants or eligibility
+    trips = await paginator.apaginate_queryset(queryset.prefetch_related(None), request)
+    await aload_participant_counts(trips)
+    await aprefetch_profiles(trip.organizer for trip in trips)
+    return render(paginator.get_paginated_data(view.get_serializer(trips, many=True).data))
+
+
+@async_api_view()
+async def async_trip_detail(request, pk):
+    view = viewset_for(RoadTripViewSet, request, 'retrieve', pk=pk)
+    queryset = await afilter_trips(view)
+    trip = await aget_object_or_404(queryset.prefetch_related('eligibility__eligible_models__brand'), pk=pk)
+    await aload_participant_counts([trip])
+    # The current user's cars decide user_eligible
+    await aprefetch_profiles([trip.organizer, request.user, *(p.user for p in trip.participants.all())])
+    return render(view.get_serializer(trip).data)
+
+
+@async_api_view()
+async def async_notification_list(request):
+    view = viewset_for(TripNotificationViewSet, request, 'list')
+    paginator = view.pagination_class()
+    notifications = await paginator.apaginate_queryset(
+        view.get_queryset().select_related('trip__organizer'), request
+    )
+    trips = [notification.trip for notification in notifications]
+    await aload_participant_counts(trips)
+    await aprefetch_profiles(
+        [trip.organizer for trip in trips] + [notification.related_user for notification in notifications]
+    )
+    return render(paginator.get_paginated_data(view.get_serializer(notifications, many=True).data))
+
+
+@async_api_view()
+async def async_unread_count(request):
+    view = viewset_for(TripNotificationViewSet, request, 'unread_count')
+    count = await view.get_queryset().filter(is_read=False).acount()
+    return render({'unread_count': count})